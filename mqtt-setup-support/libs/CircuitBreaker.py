@@ -0,0 +1,230 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import requests
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, List, Literal, Optional
+
+
+State = Literal["closed", "open", "half-open", "down"]
+
+# Seconds before the first probe and the longest wait between two probes
+DEFAULT_COOLDOWN = 5.0
+DEFAULT_MAX_COOLDOWN = 60.0
+
+
+def is_backend_failure(ex: BaseException) -> bool:
+    """
+    Check if an error says that the target is unhealthy: the call got no reply,
+    timed out, was throttled (429) or failed on the server (5xx). Any other
+    error, e.g. a 404 or a 409 of one item, is about the call, not the target.
+    """
+    seen = set()
+    while ex is not None and id(ex) not in seen:
+        seen.add(id(ex))
+        if isinstance(ex, (requests.ConnectionError, requests.Timeout)):
+            return True
+        if isinstance(ex, (ConnectionError, TimeoutError)):
+            return True
+        status = _get_status(ex)
+        if status is not None:
+            return status == 429 or status >= 500
+        # Errors wrapped by the clients, e.g. `raise ... from`, msrest's
+        # inner exception or the cause of a GCP retry
+        ex = (
+            ex.__cause__
+            or getattr(ex, "inner_exception", None)
+            or getattr(ex, "cause", None)
+        )
+    return False
+
+
+def _get_status(ex: BaseException) -> Optional[int]:
+    """
+    Get the HTTP status of an error of the SDP API, Azure or GCP if it has one
+    """
+    response = getattr(ex, "response", None)
+    for value in [
+        getattr(response, "status_code", None),
+        getattr(ex, "status_code", None),
+        getattr(ex, "code", None),
+    ]:
+        if isinstance(value, int):
+            return value
+    return None
+
+
+class BreakerPolicy:
+    def __init__(
+        self,
+        failures: int,
+        cooldown: float = DEFAULT_COOLDOWN,
+        max_cooldown: float = DEFAULT_MAX_COOLDOWN,
+        max_probes: int = 5,
+    ):
+        """
+        When the circuit of a backend target opens and how long it waits: it
+        opens after `failures` consecutive failed calls, and a probe is sent
+        after `cooldown` seconds, doubled after every failed probe up to
+        `max_cooldown`. After `max_probes` failed probes the target is down.
+        """
+        if failures < 1:
+            raise Exception(f"Invalid breaker failures {failures}")
+        if cooldown <= 0 or max_cooldown < cooldown:
+            raise Exception(f"Invalid breaker cooldown {cooldown}")
+        if max_probes < 1:
+            raise Exception(f"Invalid breaker probes {max_probes}")
+        self.failures = failures
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.max_probes = max_probes
+
+    @staticmethod
+    def parse(value: str):
+        """
+        Parse `FAILURES[:COOLDOWN]`, e.g. `10` or `10:5`, None for `0`
+        """
+        failures, _, cooldown = value.partition(":")
+        try:
+            failures = int(failures)
+            cooldown = float(cooldown) if cooldown else DEFAULT_COOLDOWN
+        except ValueError:
+            raise Exception(f"Invalid breaker {value}, expected FAILURES[:COOLDOWN]")
+        if failures == 0:
+            return None
+        return BreakerPolicy(
+            failures=failures,
+            cooldown=cooldown,
+            max_cooldown=max(DEFAULT_MAX_COOLDOWN, cooldown),
+        )
+
+
+class CircuitBreaker:
+    def __init__(self, target: str, policy: BreakerPolicy):
+        """
+        Circuit of one backend target. Calls report their result with `guard`.
+
+        - `closed`: calls run, consecutive failures are counted
+        - `open`: the items of the target are deferred until the cooldown ends
+        - `half-open`: one item runs as a probe, its result closes the circuit
+          or opens it again with a longer cooldown
+        - `down`: too many probes failed, the remaining items run and fail
+          without any call
+
+        Listeners are called with the breaker and its new state.
+        """
+        self.target = target
+        self.policy = policy
+        self.state: State = "closed"
+        self.failures = 0
+        self.probes = 0
+        self.__probing = False
+        self.__listeners: List[Callable] = []
+        self.__lock = Lock()
+
+    def add_listener(self, fn: Callable):
+        with self.__lock:
+            self.__listeners.append(fn)
+
+    def get_cooldown(self) -> float:
+        """
+        Seconds before the next probe
+        """
+        return min(
+            self.policy.cooldown * (2**self.probes),
+            self.policy.max_cooldown,
+        )
+
+    def is_deferring(self) -> bool:
+        """
+        Check if new items of the target have to wait
+        """
+        return self.state in ("open", "half-open")
+
+    def is_probing(self) -> bool:
+        return self.__probing
+
+    def try_probe(self) -> bool:
+        """
+        Make the calling item the probe if the circuit is `half-open` and no
+        other item is probing
+        """
+        with self.__lock:
+            if self.state == "half-open" and not self.__probing:
+                self.__probing = True
+                return True
+            return False
+
+    def release_probe(self):
+        """
+        Let another item probe, the last one ended without a call
+        """
+        with self.__lock:
+            self.__probing = False
+
+    def half_open(self):
+        """
+        End the cooldown, the next item is the probe
+        """
+        with self.__lock:
+            if self.state != "open":
+                return
+            self.state = "half-open"
+            listeners = list(self.__listeners)
+        for fn in listeners:
+            fn(self, "half-open")
+
+    def check(self):
+        """
+        Raise if the target is down
+        """
+        if self.state == "down":
+            raise Exception(
+                f"Circuit of {self.target} is open, {self.probes} probes failed"
+            )
+
+    @contextmanager
+    def guard(self):
+        """
+        Count the result of the calls in the `with` block. Only an exception
+        of an unhealthy target is a failure, see `is_backend_failure`, the
+        target answered any other one.
+        """
+        self.check()
+        try:
+            yield
+        except Exception as ex:
+            self.record(not is_backend_failure(ex))
+            raise
+        self.record(True)
+
+    def record(self, success: bool):
+        with self.__lock:
+            state = self.state
+            if state == "closed":
+                self.failures = 0 if success else self.failures + 1
+                if self.failures < self.policy.failures:
+                    return
+                self.probes = 0
+                new_state: State = "open"
+            elif state == "half-open" and self.__probing:
+                self.__probing = False
+                if success:
+                    self.failures = 0
+                    self.probes = 0
+                    new_state = "closed"
+                else:
+                    self.probes += 1
+                    new_state = (
+                        "down" if self.probes >= self.policy.max_probes else "open"
+                    )
+            else:
+                # Calls that were running when the circuit opened
+                return
+            self.state = new_state
+            listeners = list(self.__listeners)
+        for fn in listeners:
+            fn(self, new_state)
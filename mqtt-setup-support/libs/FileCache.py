@@ -0,0 +1,75 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import hashlib
+import os
+import pickle
+import tempfile
+from typing import Any, Optional
+
+
+# Bytes read at once to hash a file
+READ_SIZE = 1 << 20
+
+
+class FileCache:
+    def __init__(self, directory: str, version: str):
+        """
+        Results computed from input files, stored as pickles in a local
+        directory. An entry is keyed by the content of the file and the
+        version of the tool, so it is used again only while neither changed.
+        Only point it at a directory nobody else can write to, entries are
+        unpickled.
+        """
+        self.directory = directory
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def get_key(self, filename: str, *parts) -> str:
+        """
+        Hash the content of a file with the version and the given parts, e.g.
+        what was taken from the file
+        """
+        digest = hashlib.sha256()
+        digest.update(repr((self.version, *parts)).encode("utf-8"))
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(READ_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Get the value of a key, None if it is not cached or cannot be read
+        """
+        try:
+            with open(self.__get_path(key), "rb") as f:
+                value = pickle.load(f)
+        except Exception:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: Any):
+        """
+        Store the value of a key, a failed write only loses the entry
+        """
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        except OSError:
+            return
+        try:
+            # Readers never see a partly written entry
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self.__get_path(key))
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def __get_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.pickle")
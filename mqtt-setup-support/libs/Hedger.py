@@ -0,0 +1,236 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import asyncio
+import contextvars
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from threading import Lock
+from typing import Callable, Deque, Dict, List, Optional
+from libs.Scheduler import get_current_lane
+
+
+# Latencies kept per operation, and the number of them before calls are hedged
+LATENCY_WINDOW = 1000
+MIN_SAMPLES = 20
+
+
+class Hedger:
+    def __init__(self, percentile: float = 95.0, max_workers: int = 32):
+        """
+        Send a second attempt of an idempotent read when the first one takes
+        longer than a percentile of the recent latencies of the operation, and
+        keep the first reply. Only for calls that are safe to run twice.
+
+        Called from a task of a scheduler lane, the second attempt takes a
+        free slot and a rate token of the lane, and is not sent when the lane
+        is at its concurrency.
+        """
+        if not 0 < percentile < 100:
+            raise Exception(f"Invalid hedge percentile {percentile}")
+        self.percentile = percentile
+        self.__executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="hedge"
+        )
+        self.__latencies: Dict[str, Deque[float]] = {}
+        self.__calls: Dict[str, int] = {}
+        self.__hedged: Dict[str, int] = {}
+        self.__lock = Lock()
+
+    def call(self, operation: str, fn: Callable, *args, **kwargs):
+        delay = self.__start(operation)
+        if delay is None:
+            started = time.monotonic()
+            result = fn(*args, **kwargs)
+            self.__add_latency(operation, time.monotonic() - started)
+            return result
+
+        first = self.__submit(None, fn, args, kwargs)
+        if wait([first], timeout=delay).done:
+            return self.__result(operation, [first])
+
+        lane = get_current_lane()
+        if lane is not None and not lane.try_acquire_slot():
+            # The lane is at its concurrency, keep the first attempt only
+            return self.__result(operation, [first])
+
+        self.__count_hedge(operation)
+        second = self.__submit(lane, fn, args, kwargs)
+        if lane is not None:
+            self.__release_after(lane.release_slot, [first, second])
+        return self.__result(operation, [first, second])
+
+    async def call_async(self, operation: str, fn: Callable, *args, **kwargs):
+        delay = self.__start(operation)
+        started = time.monotonic()
+        if delay is None:
+            result = await fn(*args, **kwargs)
+            self.__add_latency(operation, time.monotonic() - started)
+            return result
+
+        first = asyncio.ensure_future(fn(*args, **kwargs))
+        done, _ = await asyncio.wait([first], timeout=delay)
+        lane = get_current_lane()
+        if not done and lane is not None and not await lane.try_acquire_slot_async():
+            # The lane is at its concurrency, keep the first attempt only
+            await asyncio.wait([first])
+            done = {first}
+        if done:
+            self.__add_latency(operation, time.monotonic() - started)
+            return first.result()
+
+        self.__count_hedge(operation)
+        started = time.monotonic()
+        second = asyncio.ensure_future(self.__attempt_async(lane, fn, *args, **kwargs))
+        if lane is not None:
+            self.__release_after(lane.release_slot, [first, second])
+        pending = {first, second}
+        error: BaseException = None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    self.__add_latency(operation, time.monotonic() - started)
+                    return task.result()
+                error = error or task.exception()
+        raise error
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """
+        Number of calls and hedged calls per operation
+        """
+        with self.__lock:
+            return {
+                operation: {
+                    "calls": calls,
+                    "hedged": self.__hedged.get(operation, 0),
+                    "rate": self.__hedged.get(operation, 0) / calls,
+                }
+                for operation, calls in self.__calls.items()
+            }
+
+    def get_info(self) -> str:
+        return ", ".join(
+            f"{operation} {stats['hedged']}/{stats['calls']} ({stats['rate']:.1%})"
+            for operation, stats in sorted(self.get_stats().items())
+        )
+
+    def shutdown(self):
+        # Do not wait for the attempts whose reply is not needed anymore
+        self.__executor.shutdown(wait=False)
+
+    def __start(self, operation: str) -> Optional[float]:
+        """
+        Count a call and get the seconds after which it is hedged, None until
+        enough latencies are known
+        """
+        with self.__lock:
+            self.__calls[operation] = self.__calls.get(operation, 0) + 1
+            latencies = self.__latencies.get(operation)
+            if latencies is None or len(latencies) < MIN_SAMPLES:
+                return None
+            values = sorted(latencies)
+        return values[min(len(values) - 1, int(len(values) * self.percentile / 100))]
+
+    def __count_hedge(self, operation: str):
+        with self.__lock:
+            self.__hedged[operation] = self.__hedged.get(operation, 0) + 1
+
+    def __add_latency(self, operation: str, latency: float):
+        with self.__lock:
+            if operation not in self.__latencies:
+                self.__latencies[operation] = deque(maxlen=LATENCY_WINDOW)
+            self.__latencies[operation].append(latency)
+
+    def __submit(self, lane, fn: Callable, args, kwargs) -> Future:
+        """
+        Run an attempt, after a rate token of `lane` if given
+        """
+        # Run in a copy of the caller's context, e.g. to keep the current span
+        context = contextvars.copy_context()
+        return self.__executor.submit(context.run, self.__timed, lane, fn, args, kwargs)
+
+    def __timed(self, lane, fn: Callable, args, kwargs):
+        if lane is not None:
+            lane.acquire_rate()
+        started = time.monotonic()
+        return fn(*args, **kwargs), time.monotonic() - started
+
+    async def __attempt_async(self, lane, fn: Callable, *args, **kwargs):
+        if lane is not None:
+            await lane.acquire_rate_async()
+        return await fn(*args, **kwargs)
+
+    def __release_after(self, release: Callable, attempts: List):
+        """
+        Call `release` once all of the attempts ended. The caller's slot only
+        covers one of them, and it is given back as soon as the first reply
+        is returned.
+        """
+        remaining = [len(attempts)]
+        lock = Lock()
+
+        def on_done(_):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] > 0:
+                    return
+            release()
+
+        for attempt in attempts:
+            attempt.add_done_callback(on_done)
+
+    def __result(self, operation: str, attempts: List[Future]):
+        """
+        Get the first successful reply of the attempts, or the first error if
+        all of them failed
+        """
+        pending = set(attempts)
+        error: BaseException = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for attempt in done:
+                if attempt.exception() is None:
+                    result, latency = attempt.result()
+                    self.__add_latency(operation, latency)
+                    return result
+                error = error or attempt.exception()
+        raise error
+
+
+_hedger: Optional[Hedger] = None
+
+
+def set_hedger(hedger: Optional[Hedger]):
+    """
+    Enable hedging with a given hedger, or disable it with None
+    """
+    global _hedger
+    _hedger = hedger
+
+
+def hedged(operation: str, fn: Callable, *args, **kwargs):
+    """
+    Call an idempotent read, hedged if hedging is enabled
+    """
+    hedger = _hedger
+    if hedger is None:
+        return fn(*args, **kwargs)
+    return hedger.call(operation, fn, *args, **kwargs)
+
+
+async def hedged_async(operation: str, fn: Callable, *args, **kwargs):
+    """
+    Await an idempotent read, hedged if hedging is enabled
+    """
+    hedger = _hedger
+    if hedger is None:
+        return await fn(*args, **kwargs)
+    return await hedger.call_async(operation, fn, *args, **kwargs)
@@ -0,0 +1,142 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import cProfile
+import io
+import logging
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict, List, Optional
+
+
+class Profiler:
+    def __init__(self, prefix: str, top: int = 30):
+        """
+        CPU profile of all threads and wall-clock time per phase of a run,
+        written to `<prefix>.pstats` and a readable report `<prefix>.txt`
+        """
+        self.prefix = prefix
+        self.top = top
+        self.__profiles: List[cProfile.Profile] = []
+        self.__phases: Dict[str, List[float]] = {}
+        self.__lock = Lock()
+        self.__started = time.perf_counter()
+
+    def start(self):
+        """
+        Start profiling the current thread and every thread started after it
+        """
+        self.__enable()
+        # Since 3.12 one profile sees all threads and a second one cannot be enabled
+        if sys.version_info < (3, 12):
+            threading.setprofile(self.__start_thread)
+
+    def add_phase(self, name: str, seconds: float):
+        """
+        Count the time of one block of a phase
+        """
+        with self.__lock:
+            total = self.__phases.setdefault(name, [0.0, 0])
+            total[0] += seconds
+            total[1] += 1
+
+    def wrap_handler(self, handler: logging.Handler):
+        """
+        Count the time spent in a logging handler as the `logging` phase
+        """
+        handle = handler.handle
+
+        def timed_handle(record):
+            with phase("logging"):
+                return handle(record)
+
+        handler.handle = timed_handle
+
+    def close(self):
+        """
+        Stop profiling and write the profile and the report
+        """
+        threading.setprofile(None)
+        elapsed = time.perf_counter() - self.__started
+
+        with self.__lock:
+            profiles = list(self.__profiles)
+            phases = dict(self.__phases)
+        for profile in profiles:
+            profile.disable()
+
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(f"{self.prefix}.pstats")
+
+        with open(f"{self.prefix}.txt", "w") as f:
+            f.write(self.__get_report(stats, phases, elapsed))
+
+    def __enable(self):
+        profile = cProfile.Profile()
+        with self.__lock:
+            self.__profiles.append(profile)
+        profile.enable()
+
+    def __start_thread(self, frame, event, arg):
+        # Called once by each new thread, replace this hook with a profile
+        sys.setprofile(None)
+        self.__enable()
+
+    def __get_report(
+        self, stats: pstats.Stats, phases: Dict[str, List[float]], elapsed: float
+    ) -> str:
+        """
+        Phases sorted by time, then the top functions by cumulative time
+        """
+        report = io.StringIO()
+        report.write(f"Wall clock: {elapsed:.3f}s\n\n")
+        report.write("Phases (summed over threads, calls in flight overlap):\n")
+        report.write(f"{'phase':<16}{'seconds':>12}{'count':>10}{'avg ms':>12}\n")
+        for name, (seconds, count) in sorted(
+            phases.items(), key=lambda item: item[1][0], reverse=True
+        ):
+            report.write(
+                f"{name:<16}{seconds:>12.3f}{count:>10}{seconds / count * 1000:>12.3f}\n"
+            )
+        report.write("\n")
+
+        stats.stream = report
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+        return report.getvalue()
+
+
+_profiler: Optional[Profiler] = None
+
+
+def set_profiler(profiler: Optional[Profiler]):
+    """
+    Enable profiling with a given profiler, or disable it with None
+    """
+    global _profiler
+    _profiler = profiler
+
+
+@contextmanager
+def phase(name: str):
+    """
+    Count the wall-clock time of the block in a given phase. Does nothing if
+    profiling is disabled.
+    """
+    profiler = _profiler
+    if profiler is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.add_phase(name, time.perf_counter() - started)
@@ -0,0 +1,119 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import sys
+import time
+from collections import deque
+from threading import Event, Lock, Thread
+from typing import Deque, Literal, TextIO
+
+
+# Items kept for the rolling latency and the current rate
+LATENCY_WINDOW = 1000
+RATE_WINDOW = 10.0
+
+# Seconds between two lines when the stream is not a terminal
+PLAIN_INTERVAL = 10.0
+
+
+class Progress:
+    def __init__(self, total: int = None, stream: TextIO = None, interval: float = 0.5):
+        """
+        Progress of a run, drawn on one terminal line by a background thread.
+        If the stream is not a terminal, a line is printed every 10 seconds.
+        """
+        self.total = total
+        self.succeeded = 0
+        self.failed = 0
+        self.skipped = 0
+        self.__stream = stream if stream is not None else sys.stderr
+        self.__tty = self.__stream.isatty()
+        self.__interval = interval if self.__tty else PLAIN_INTERVAL
+        self.__latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.__finished: Deque[float] = deque()
+        self.__started = time.monotonic()
+        self.__lock = Lock()
+        self.__stopped = Event()
+        self.__thread: Thread = None
+
+    def start(self):
+        self.__thread = Thread(target=self.__draw, name="progress", daemon=True)
+        self.__thread.start()
+
+    def add(
+        self,
+        status: Literal["succeeded", "failed", "skipped"],
+        latency: float = None,
+    ):
+        """
+        Count one finished item, with the seconds it took if it was processed
+        """
+        now = time.monotonic()
+        with self.__lock:
+            setattr(self, status, getattr(self, status) + 1)
+            if latency is not None:
+                self.__latencies.append(latency)
+            self.__finished.append(now)
+            while self.__finished and self.__finished[0] < now - RATE_WINDOW:
+                self.__finished.popleft()
+
+    def stop(self):
+        """
+        Stop drawing and print the final line
+        """
+        self.__stopped.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        self.__write(self.get_line(), final=True)
+
+    def get_line(self) -> str:
+        """
+        Counts, current rate, rolling latency and ETA as one line
+        """
+        now = time.monotonic()
+        with self.__lock:
+            done = self.succeeded + self.failed + self.skipped
+            counts = (
+                f"{self.succeeded} succeeded, {self.failed} failed, "
+                f"{self.skipped} skipped"
+            )
+            window = min(RATE_WINDOW, now - self.__started)
+            recent = sum(1 for t in self.__finished if t >= now - window)
+            latencies = sorted(self.__latencies)
+
+        rate = recent / window if window > 0 else 0.0
+        parts = [
+            f"{done}/{self.total}" if self.total is not None else f"{done}",
+            counts,
+            f"{rate:.1f} items/s",
+        ]
+        if latencies:
+            p50 = self.__percentile(latencies, 0.5)
+            p95 = self.__percentile(latencies, 0.95)
+            parts.append(f"p50 {p50 * 1000:.0f}ms p95 {p95 * 1000:.0f}ms")
+        if self.total is not None and rate > 0:
+            parts.append(f"ETA {self.__format_duration((self.total - done) / rate)}")
+        return " | ".join(parts)
+
+    def __draw(self):
+        while not self.__stopped.wait(self.__interval):
+            self.__write(self.get_line())
+
+    def __write(self, line: str, final: bool = False):
+        if self.__tty:
+            # Redraw the same line, log lines clear it before they are written
+            self.__stream.write(f"\r\033[K{line}" + ("\n" if final else ""))
+        else:
+            self.__stream.write(f"{line}\n")
+        self.__stream.flush()
+
+    def __percentile(self, values, q: float) -> float:
+        return values[min(len(values) - 1, int(len(values) * q))]
+
+    def __format_duration(self, seconds: float) -> str:
+        minutes, seconds = divmod(int(seconds), 60)
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
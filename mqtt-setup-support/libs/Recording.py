@@ -0,0 +1,338 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import asyncio
+import base64
+import hashlib
+import json
+import pickle
+import time
+from collections import deque
+from threading import Lock
+from typing import Any, Callable, Deque, Dict, Tuple
+from urllib.parse import urlsplit
+from models.Authentications import TIME_SUFFIX
+
+
+# Response headers kept in a recording, the values of the others are secrets
+# such as the SDP token or do not matter
+KEPT_HEADERS = {"content-type"}
+
+
+def get_call_key(name: str, *parts) -> str:
+    """
+    Key of a call by its name and arguments. Only a hash of the arguments is
+    kept, they can hold secrets such as the password of the SDP token.
+    """
+    text = json.dumps(parts, sort_keys=True, default=_get_key_part)
+    digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    return f"{name} {digest}"
+
+
+def _get_key_part(value):
+    # The repr of SDK models has their address, their content is stable
+    if hasattr(value, "as_dict"):
+        return value.as_dict()
+    return str(value)
+
+
+def _get_recorded_result(result):
+    # A pager of the GCP client holds its channel, only its first page is
+    # kept, so paged listings must be read with one call per page
+    if hasattr(result, "pages") and hasattr(result, "_response"):
+        return result._response
+    return result
+
+
+class CallRecorder:
+    def __init__(self, filename: str):
+        """
+        Record the calls to the SDP API and the cloud clients with their
+        latency, one JSON line per call, to replay them with `CallReplayer`
+        """
+        self.filename = filename
+        self.__file = open(filename, "w")
+        self.__lock = Lock()
+
+    def wrap_transport(self, transport):
+        return RecordingTransport(transport, self)
+
+    def wrap_client(
+        self,
+        backend: str,
+        create: Callable,
+        is_async: bool = False,
+        target: str = None,
+    ):
+        return RecordingClient(create(), backend, self, target=target)
+
+    def record(
+        self,
+        backend: str,
+        key: str,
+        latency: float,
+        result: Any = None,
+        error: BaseException = None,
+    ):
+        line = {"backend": backend, "key": key, "latency": round(latency, 6)}
+        if error is not None:
+            line["error"] = str(error)
+        else:
+            line["result"] = base64.b64encode(pickle.dumps(result)).decode("ascii")
+        text = json.dumps(line)
+        with self.__lock:
+            self.__file.write(text + "\n")
+
+    def close(self):
+        with self.__lock:
+            self.__file.close()
+
+
+class CallReplayer:
+    def __init__(self, filename: str, latency_scale: float = 1.0):
+        """
+        Answer the calls with the results of a recording instead of the
+        network, after the recorded latency times `latency_scale`. Calls with
+        the same key are answered in the recorded order.
+
+        Recordings are unpickled, only replay files recorded by yourself.
+        """
+        if latency_scale < 0:
+            raise Exception(f"Invalid latency scale {latency_scale}")
+        self.filename = filename
+        self.latency_scale = latency_scale
+        self.__calls: Dict[Tuple[str, str], Deque[Dict]] = {}
+        self.__lock = Lock()
+        with open(filename, "r") as f:
+            for line in f:
+                if line.strip():
+                    call = json.loads(line)
+                    self.__calls.setdefault(
+                        (call["backend"], call["key"]), deque()
+                    ).append(call)
+
+    def wrap_transport(self, transport):
+        return ReplayTransport(self)
+
+    def wrap_client(
+        self,
+        backend: str,
+        create: Callable,
+        is_async: bool = False,
+        target: str = None,
+    ):
+        # No real client is created, it would need credentials
+        return ReplayClient(backend, self, is_async=is_async, target=target)
+
+    def take(self, backend: str, key: str) -> Tuple[float, Callable]:
+        """
+        Get the scaled latency of the next recorded call with a given key, and
+        a function returning its result or raising its error
+        """
+        with self.__lock:
+            calls = self.__calls.get((backend, key))
+            if not calls:
+                raise Exception(f"No recorded {backend} call {key}")
+            call = calls.popleft()
+
+        def answer():
+            if "error" in call:
+                raise Exception(call["error"])
+            return pickle.loads(base64.b64decode(call["result"]))
+
+        return call["latency"] * self.latency_scale, answer
+
+    def replay(self, backend: str, key: str):
+        latency, answer = self.take(backend, key)
+        time.sleep(latency)
+        return answer()
+
+    async def replay_async(self, backend: str, key: str):
+        latency, answer = self.take(backend, key)
+        await asyncio.sleep(latency)
+        return answer()
+
+
+class ReplayResponse:
+    def __init__(self, status_code: int, text: str, headers: Dict[str, str]):
+        """
+        The parts of a `requests.Response` read by the SDP client
+        """
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers
+
+
+def _get_request_key(method: str, url: str, kwargs: Dict) -> str:
+    # The password of the token request and the token header are not part
+    # of the key, they change between runs
+    parts = urlsplit(url)
+    return get_call_key(
+        f"{method} {parts.path}",
+        parts.netloc,
+        sorted((kwargs.get("params") or {}).items()),
+        _get_request_body(kwargs.get("data"))
+        if kwargs.get("headers", {}).get("X-Auth-Token")
+        else None,
+    )
+
+
+def _get_request_body(data):
+    # The name of a created authentication ends with the minute it was sent
+    try:
+        body = json.loads(data)
+    except (TypeError, ValueError):
+        return data
+    if isinstance(body, dict) and isinstance(body.get("name"), str):
+        body["name"] = TIME_SUFFIX.sub("", body["name"])
+    return body
+
+
+class RecordingTransport:
+    def __init__(self, transport, recorder: CallRecorder):
+        self.__transport = transport
+        self.__recorder = recorder
+
+    def request(self, method: str, url: str, **kwargs):
+        key = _get_request_key(method, url, kwargs)
+        started = time.perf_counter()
+        try:
+            resp = self.__transport.request(method, url, **kwargs)
+        except Exception as ex:
+            self.__recorder.record("sdp", key, time.perf_counter() - started, error=ex)
+            raise
+        self.__recorder.record(
+            "sdp",
+            key,
+            time.perf_counter() - started,
+            result=ReplayResponse(
+                resp.status_code,
+                resp.text,
+                {
+                    name: value if name.lower() in KEPT_HEADERS else "recorded"
+                    for name, value in resp.headers.items()
+                },
+            ),
+        )
+        return resp
+
+
+class ReplayTransport:
+    def __init__(self, replayer: CallReplayer):
+        self.__replayer = replayer
+
+    def request(self, method: str, url: str, **kwargs):
+        return self.__replayer.replay("sdp", _get_request_key(method, url, kwargs))
+
+
+def _get_client_call_key(name: str, target: str, args, kwargs: Dict) -> str:
+    # Timeouts are settings of the run, not of the call
+    return get_call_key(
+        name,
+        target,
+        args,
+        sorted((k, v) for k, v in kwargs.items() if k != "timeout"),
+    )
+
+
+class RecordingClient:
+    def __init__(
+        self, client, backend: str, recorder: CallRecorder, target: str = None
+    ):
+        """
+        Record the method calls of a cloud client, sync or async. The `target`
+        of a client bound to one IoT Hub is part of the keys, the same device
+        ID on two hubs is two calls.
+        """
+        self.__client = client
+        self.__backend = backend
+        self.__recorder = recorder
+        self.__target = target
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.__client, name)
+        if not callable(attr):
+            return attr
+        backend, recorder, target = self.__backend, self.__recorder, self.__target
+
+        if asyncio.iscoroutinefunction(attr):
+
+            async def call_async(*args, **kwargs):
+                key = _get_client_call_key(name, target, args, kwargs)
+                started = time.perf_counter()
+                try:
+                    result = await attr(*args, **kwargs)
+                except Exception as ex:
+                    recorder.record(
+                        backend, key, time.perf_counter() - started, error=ex
+                    )
+                    raise
+                recorder.record(
+                    backend,
+                    key,
+                    time.perf_counter() - started,
+                    result=_get_recorded_result(result),
+                )
+                return result
+
+            return call_async
+
+        def call(*args, **kwargs):
+            key = _get_client_call_key(name, target, args, kwargs)
+            started = time.perf_counter()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception as ex:
+                recorder.record(backend, key, time.perf_counter() - started, error=ex)
+                raise
+            recorder.record(
+                backend,
+                key,
+                time.perf_counter() - started,
+                result=_get_recorded_result(result),
+            )
+            return result
+
+        return call
+
+
+class ReplayClient:
+    # There is no connection to close
+    transport = None
+
+    def __init__(
+        self,
+        backend: str,
+        replayer: CallReplayer,
+        is_async: bool = False,
+        target: str = None,
+    ):
+        """
+        Answer the method calls of a cloud client from a recording, with
+        coroutines if the client is async
+        """
+        self.__backend = backend
+        self.__replayer = replayer
+        self.__is_async = is_async
+        self.__target = target
+
+    def __getattr__(self, name: str):
+        backend, replayer, target = self.__backend, self.__replayer, self.__target
+
+        if self.__is_async:
+
+            async def call_async(*args, **kwargs):
+                return await replayer.replay_async(
+                    backend, _get_client_call_key(name, target, args, kwargs)
+                )
+
+            return call_async
+
+        def call(*args, **kwargs):
+            return replayer.replay(
+                backend, _get_client_call_key(name, target, args, kwargs)
+            )
+
+        return call
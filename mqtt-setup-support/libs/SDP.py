@@ -9,25 +9,48 @@ from models.Authentications import (
     CreateAzureAuthenticationRequest,
     CreateGCPAuthenticationRequest,
 )
+from libs.Hedger import hedged
+from libs.Profiler import phase
+from libs.Timeouts import Operation, Timeouts
+from libs.Tracer import KIND_CLIENT, span
 import requests
 import urllib3
-from typing import Union, Optional
+from typing import Dict, Union, Optional
 
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 
 class SDP:
-    def __init__(self, endpoint: str, version: str = "v1") -> None:
+    def __init__(
+        self,
+        endpoint: str,
+        version: str = "v1",
+        pool_size: int = 10,
+        timeouts: Timeouts = None,
+        transport=None,
+    ) -> None:
         """
-        Constructor of ICGW API Service
+        Constructor of ICGW API Service. `transport` sends the HTTP requests,
+        an object with the `request` method of `requests.Session`, the session
+        of the client by default
         """
         self._endpoint: str = endpoint
+        self._timeouts: Timeouts = timeouts if timeouts is not None else Timeouts()
         self._version: str = version
         self._auth: bool = False
         self._tenant_id: str = None
         self._auth_token: str = None
 
+        # Keep connections alive, one per concurrent call
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=2, pool_maxsize=max(pool_size, 1)
+        )
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self.transport = transport if transport is not None else self._session
+
     # Generate Token
 
     def generate_token(self, name: str, password: str, tenant_id: str):
@@ -64,22 +87,27 @@ class SDP:
 
     # Group
 
-    def get_groups(self):
+    def get_groups(self, page: int = None, pageSize: int = None):
         """
         Get Groups
         """
         url = f"groups"
-        _, res = self.__execute_api(url, method="GET")
+        _, res = self.__execute_api(
+            url, method="GET", params=self.__get_page_params(page, pageSize)
+        )
         return res
 
     # SIM
 
-    def get_sims(self):
+    def get_sims(self, page: int = None, pageSize: int = None, groupId: str = None):
         """
-        Get Sims
+        Get Sims, only the SIMs of a group if `groupId` is given
         """
         url = f"sims"
-        _, res = self.__execute_api(url, method="GET")
+        params = self.__get_page_params(page, pageSize)
+        if groupId:
+            params["groupId"] = groupId
+        _, res = self.__execute_api(url, method="GET", params=params)
         return res
 
     def get_sim(self, imsi: str):
@@ -87,7 +115,7 @@ class SDP:
         Get Sim
         """
         url = f"sims/{imsi}"
-        _, res = self.__execute_api(url, method="GET")
+        _, res = hedged("sdp.get_sim", self.__execute_api, url, method="GET")
         return res
 
     def update_sim(self, imsi: str, req: UpdateSIMRequest):
@@ -112,7 +140,13 @@ class SDP:
             params["name"] = name
         params["page"] = page
         params["pageSize"] = pageSize
-        _, res = self.__execute_api(url, method="GET", params=params)
+        _, res = hedged(
+            "sdp.get_authentications",
+            self.__execute_api,
+            url,
+            method="GET",
+            params=params,
+        )
         return res
 
     def get_authentication(self, type: str, name: str):
@@ -144,6 +178,14 @@ class SDP:
 
     # PRIVATE
 
+    def __get_page_params(self, page: int = None, pageSize: int = None) -> Dict:
+        params: Dict = {}
+        if page is not None:
+            params["page"] = page
+        if pageSize is not None:
+            params["pageSize"] = pageSize
+        return params
+
     def __execute_api(
         self,
         api_url: str,
@@ -171,11 +213,26 @@ class SDP:
         if payload is not None:
             headers["Content-Type"] = "application/json"
 
-        resp: requests.Response = requests.request(
-            method, url, headers=headers, data=payload, verify=False, params=params
+        operation: Operation = (
+            "auth" if not with_auth_token else "read" if method == "GET" else "write"
         )
-        if resp.status_code >= 400:
-            raise Exception(resp.text)
+
+        with span(
+            "sdp.request", kind=KIND_CLIENT, **{"http.method": method, "http.url": url}
+        ) as s:
+            with phase("network"):
+                resp: requests.Response = self.transport.request(
+                    method,
+                    url,
+                    headers=headers,
+                    data=payload,
+                    verify=False,
+                    params=params,
+                    timeout=self._timeouts.get(operation).to_requests(),
+                )
+            s.set_attribute("http.status_code", resp.status_code)
+            if resp.status_code >= 400:
+                raise requests.HTTPError(resp.text, response=resp)
 
         response_text = (
             json.loads(resp.text) if resp.text is not None and resp.text != "" else None
@@ -0,0 +1,614 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import asyncio
+import contextvars
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
+from contextvars import ContextVar
+from threading import Condition, Lock, Semaphore, Thread, Timer
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+from libs.CircuitBreaker import BreakerPolicy, CircuitBreaker, State
+
+
+DEFAULT_LIMITS = {"sdp": 4, "azure": 8, "gcp": 8}
+
+_current_lane: ContextVar = ContextVar("lane", default=None)
+
+
+class BackendLimit:
+    def __init__(self, concurrency: int, rate: float = None):
+        """
+        Concurrency and rate (calls per second, None for unlimited) of one backend
+        """
+        if concurrency < 1:
+            raise Exception(f"Invalid concurrency {concurrency}")
+        if rate is not None and rate <= 0:
+            raise Exception(f"Invalid rate {rate}")
+        self.concurrency = concurrency
+        self.rate = rate
+
+    @staticmethod
+    def parse(value: str):
+        """
+        Parse `TARGET=CONCURRENCY[:RATE]`, e.g. `sdp=4`, `azure=16:50` or
+        `gcp:my-project/asia-east1/my-registry=8:10`
+        """
+        if "=" not in value:
+            raise Exception(
+                f"Invalid limit {value}, expected TARGET=CONCURRENCY[:RATE]"
+            )
+        target, limit = value.rsplit("=", 1)
+        concurrency, _, rate = limit.partition(":")
+        try:
+            return target.strip(), BackendLimit(
+                concurrency=int(concurrency), rate=float(rate) if rate else None
+            )
+        except ValueError:
+            raise Exception(
+                f"Invalid limit {value}, expected TARGET=CONCURRENCY[:RATE]"
+            )
+
+
+class RateLimiter:
+    def __init__(self, rate: float):
+        self.__interval = 1.0 / rate
+        self.__next = 0.0
+        self.__lock = Lock()
+
+    def acquire(self):
+        """
+        Block until the next call is allowed
+        """
+        with self.__lock:
+            now = time.monotonic()
+            wait = self.__next - now
+            self.__next = max(now, self.__next) + self.__interval
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """
+        Wait without blocking the event loop until the next call is allowed
+        """
+        with self.__lock:
+            now = time.monotonic()
+            wait = self.__next - now
+            self.__next = max(now, self.__next) + self.__interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class LaneFuture(Future):
+    def __init__(self):
+        """
+        Future of a task of a target with a circuit breaker, the task is
+        deferred while the circuit is open
+        """
+        super().__init__()
+        self.__deferred = False
+        self.__callbacks: List[Callable] = []
+        self.__defer_lock = Lock()
+
+    def add_defer_callback(self, fn: Callable):
+        """
+        Call `fn(deferred)` when the task is deferred and when it is resumed
+        """
+        with self.__defer_lock:
+            self.__callbacks.append(fn)
+            if self.__deferred:
+                fn(True)
+
+    def set_deferred(self, deferred: bool):
+        with self.__defer_lock:
+            if self.__deferred == deferred:
+                return
+            self.__deferred = deferred
+            for fn in self.__callbacks:
+                fn(deferred)
+
+
+class LaneTask:
+    def __init__(self, fn: Callable, args, kwargs):
+        # Run in a copy of the caller's context, e.g. to keep the current span
+        self.context = contextvars.copy_context()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = LaneFuture()
+        self.probe = False
+
+
+class DeferredQueue:
+    def __init__(self, breaker: CircuitBreaker, start: Callable[[LaneTask], None]):
+        """
+        Tasks of a lane waiting for the circuit of its target. They are kept
+        here instead of the workers while the circuit is open, one of them is
+        started as the probe once the cooldown ends, and all of them are
+        started again when the circuit closes or the target is down.
+        """
+        self.__breaker = breaker
+        self.__start = start
+        self.__tasks: Deque[LaneTask] = deque()
+        self.__lock = Lock()
+        self.__timer: Timer = None
+        self.__closed = False
+        breaker.add_listener(self.__on_state)
+
+    def submit(self, task: LaneTask):
+        if self.__breaker.state == "open":
+            self.__defer(task)
+        else:
+            self.__start(task)
+
+    def before_run(self, task: LaneTask) -> bool:
+        """
+        Check if a started task may run, otherwise defer it
+        """
+        if self.__breaker.try_probe():
+            task.probe = True
+            return True
+        if self.__breaker.is_deferring():
+            self.__defer(task)
+            return False
+        return True
+
+    def after_run(self, task: LaneTask):
+        # A probe that failed before any call, e.g. on its input, says
+        # nothing about the target
+        if task.probe and self.__breaker.state == "half-open":
+            self.__breaker.release_probe()
+            self.__resume(1)
+
+    def shutdown(self):
+        with self.__lock:
+            self.__closed = True
+            tasks, self.__tasks = list(self.__tasks), deque()
+            timer, self.__timer = self.__timer, None
+        if timer is not None:
+            timer.cancel()
+        for task in tasks:
+            task.future.set_exception(
+                Exception(f"Shut down while {self.__breaker.target} was deferred")
+            )
+
+    def __defer(self, task: LaneTask):
+        with self.__lock:
+            self.__tasks.append(task)
+        task.future.set_deferred(True)
+        # The circuit may have changed while the task was added
+        if not self.__breaker.is_deferring():
+            self.__resume()
+        elif self.__breaker.state == "half-open" and not self.__breaker.is_probing():
+            self.__resume(1)
+
+    def __resume(self, count: int = None):
+        with self.__lock:
+            if self.__closed:
+                return
+            tasks = []
+            while self.__tasks and (count is None or len(tasks) < count):
+                tasks.append(self.__tasks.popleft())
+        for task in tasks:
+            task.future.set_deferred(False)
+            self.__start(task)
+
+    def __on_state(self, breaker: CircuitBreaker, state: State):
+        if state == "open":
+            with self.__lock:
+                if self.__closed:
+                    return
+                self.__timer = Timer(breaker.get_cooldown(), breaker.half_open)
+                self.__timer.daemon = True
+                self.__timer.start()
+        elif state == "half-open":
+            self.__resume(1)
+        else:
+            self.__resume()
+
+
+class Lane:
+    def __init__(
+        self, target: str, limit: BackendLimit, breaker: CircuitBreaker = None
+    ):
+        """
+        Worker queue of one backend target with its own concurrency and rate,
+        and the deferred tasks of its circuit breaker if it has one
+        """
+        self.target = target
+        self.limit = limit
+        self.__limiter = RateLimiter(limit.rate) if limit.rate else None
+        self.__executor = ThreadPoolExecutor(
+            max_workers=limit.concurrency, thread_name_prefix=target.split(":")[0]
+        )
+        # Slots of the running tasks and of the extra attempts of hedged calls
+        self.__slots = Semaphore(limit.concurrency)
+        self.__deferred = (
+            DeferredQueue(breaker, self.__start) if breaker is not None else None
+        )
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        if self.__deferred is not None:
+            task = LaneTask(fn, args, kwargs)
+            self.__deferred.submit(task)
+            return task.future
+
+        # Run in a copy of the caller's context, e.g. to keep the current span
+        context = contextvars.copy_context()
+        return self.__executor.submit(context.run, self.__run, fn, *args, **kwargs)
+
+    def try_acquire_slot(self) -> bool:
+        """
+        Take a slot for an extra call of a running task without waiting, False
+        if the lane is at its concurrency
+        """
+        return self.__slots.acquire(blocking=False)
+
+    def release_slot(self):
+        self.__slots.release()
+
+    def acquire_rate(self):
+        """
+        Block until the rate of the lane allows an extra call
+        """
+        if self.__limiter is not None:
+            self.__limiter.acquire()
+
+    def shutdown(self):
+        if self.__deferred is not None:
+            self.__deferred.shutdown()
+        self.__executor.shutdown(wait=True)
+
+    def __start(self, task: LaneTask):
+        self.__executor.submit(task.context.run, self.__run_task, task)
+
+    def __run_task(self, task: LaneTask):
+        if not self.__deferred.before_run(task):
+            return
+        try:
+            result = self.__run(task.fn, *task.args, **task.kwargs)
+        except BaseException as ex:
+            task.future.set_exception(ex)
+        else:
+            task.future.set_result(result)
+        finally:
+            self.__deferred.after_run(task)
+
+    def __run(self, fn: Callable, *args, **kwargs):
+        with self.__slots:
+            if self.__limiter is not None:
+                self.__limiter.acquire()
+            token = _current_lane.set(self)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _current_lane.reset(token)
+
+
+class AsyncLane:
+    def __init__(
+        self,
+        target: str,
+        limit: BackendLimit,
+        loop: asyncio.AbstractEventLoop,
+        breaker: CircuitBreaker = None,
+    ):
+        """
+        Queue of coroutines of one backend target, at most `concurrency` of them
+        are awaited at the same time on the shared event loop
+        """
+        self.target = target
+        self.limit = limit
+        self.__limiter = RateLimiter(limit.rate) if limit.rate else None
+        self.__loop = loop
+        self.__semaphore: asyncio.Semaphore = None
+        self.__deferred = (
+            DeferredQueue(breaker, self.__start) if breaker is not None else None
+        )
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        if self.__deferred is not None:
+            task = LaneTask(fn, args, kwargs)
+            self.__deferred.submit(task)
+            return task.future
+
+        context = contextvars.copy_context()
+        return asyncio.run_coroutine_threadsafe(
+            self.__run(context, fn, *args, **kwargs), self.__loop
+        )
+
+    def shutdown(self):
+        if self.__deferred is not None:
+            self.__deferred.shutdown()
+
+    async def try_acquire_slot_async(self) -> bool:
+        """
+        Take a slot for an extra call of a running task without waiting, False
+        if the lane is at its concurrency
+        """
+        if self.__semaphore is None or self.__semaphore.locked():
+            return False
+        # Does not wait, the semaphore is not locked
+        return await self.__semaphore.acquire()
+
+    def release_slot(self):
+        self.__semaphore.release()
+
+    async def acquire_rate_async(self):
+        """
+        Wait until the rate of the lane allows an extra call
+        """
+        if self.__limiter is not None:
+            await self.__limiter.acquire_async()
+
+    def __start(self, task: LaneTask):
+        asyncio.run_coroutine_threadsafe(self.__run_task(task), self.__loop)
+
+    async def __run_task(self, task: LaneTask):
+        if not self.__deferred.before_run(task):
+            return
+        try:
+            result = await self.__run(task.context, task.fn, *task.args, **task.kwargs)
+        except BaseException as ex:
+            task.future.set_exception(ex)
+        else:
+            task.future.set_result(result)
+        finally:
+            self.__deferred.after_run(task)
+
+    async def __run(self, context: contextvars.Context, fn: Callable, *args, **kwargs):
+        # The task runs in its own context, copy the caller's values into it
+        for var, value in context.items():
+            var.set(value)
+
+        if self.__semaphore is None:
+            self.__semaphore = asyncio.Semaphore(self.limit.concurrency)
+        async with self.__semaphore:
+            if self.__limiter is not None:
+                await self.__limiter.acquire_async()
+            _current_lane.set(self)
+            return await fn(*args, **kwargs)
+
+
+def get_current_lane():
+    """
+    Get the lane running the current task, None outside of any lane
+    """
+    return _current_lane.get()
+
+
+class Scheduler:
+    def __init__(
+        self, limits: Dict[str, BackendLimit] = None, breaker: BreakerPolicy = None
+    ):
+        """
+        Run work on separate queues per backend target.
+
+        A target is `<kind>:<name>`, e.g. `sdp:<tenant id>`, `azure:<hub host name>`
+        or `gcp:<project>/<region>/<registry>`. The limit of a target is looked up
+        by the full target first, then by its kind.
+
+        Coroutine functions are run on one event loop in a background thread
+        instead of the worker threads of the target.
+
+        With a `breaker` policy, every target has a circuit breaker. The tasks
+        report their calls with `guard`, and the tasks of a target whose
+        circuit is open are deferred while the other targets keep running.
+        """
+        self.__limits: Dict[str, BackendLimit] = {
+            kind: BackendLimit(concurrency)
+            for kind, concurrency in DEFAULT_LIMITS.items()
+        }
+        self.__limits.update(limits or {})
+        self.__lanes: Dict[Tuple[str, bool], Lane] = {}
+        self.__lock = Lock()
+        self.__loop: asyncio.AbstractEventLoop = None
+        self.__loop_thread: Thread = None
+        self.__shutdown_hooks: List[Callable] = []
+        self.__breaker_policy = breaker
+        self.__breakers: Dict[str, CircuitBreaker] = {}
+        self.__breaker_listeners: List[Callable] = []
+
+    def get_limit(self, target: str) -> BackendLimit:
+        """
+        Get the limit of a given target
+        """
+        if target in self.__limits:
+            return self.__limits[target]
+        kind = target.split(":")[0]
+        if kind in self.__limits:
+            return self.__limits[kind]
+        return BackendLimit(concurrency=1)
+
+    def submit(self, target: str, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Queue a call on the lane of a given target
+        """
+        return self.__get_lane(target, asyncio.iscoroutinefunction(fn)).submit(
+            fn, *args, **kwargs
+        )
+
+    def get_breaker(self, target: str) -> Optional[CircuitBreaker]:
+        """
+        Get the circuit breaker of a given target, None without a policy
+        """
+        with self.__lock:
+            return self.__get_breaker(target)
+
+    def guard(self, target: str):
+        """
+        Count the calls in the `with` block for the circuit of a given target,
+        raise at once if the target is down
+        """
+        breaker = self.get_breaker(target)
+        return breaker.guard() if breaker is not None else nullcontext()
+
+    def add_breaker_listener(self, fn: Callable):
+        """
+        Add a function called with the breaker and its new state when the
+        circuit of any target changes
+        """
+        with self.__lock:
+            self.__breaker_listeners.append(fn)
+            for breaker in self.__breakers.values():
+                breaker.add_listener(fn)
+
+    def group(self, max_pending: int = None):
+        """
+        Create a task group, leaving the `with` block waits for all of its tasks
+        """
+        return TaskGroup(self, max_pending=max_pending)
+
+    def add_shutdown_hook(self, fn: Callable):
+        """
+        Add a coroutine function that is awaited on the event loop before it is
+        stopped, e.g. to close clients created on the loop
+        """
+        with self.__lock:
+            self.__shutdown_hooks.append(fn)
+
+    def shutdown(self):
+        with self.__lock:
+            lanes = list(self.__lanes.values())
+            self.__lanes = {}
+            loop, loop_thread = self.__loop, self.__loop_thread
+            self.__loop, self.__loop_thread = None, None
+            hooks = list(self.__shutdown_hooks)
+        for lane in lanes:
+            lane.shutdown()
+        if loop is not None:
+            for hook in hooks:
+                asyncio.run_coroutine_threadsafe(hook(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            loop_thread.join()
+            loop.close()
+
+    def __get_lane(self, target: str, is_async: bool = False):
+        with self.__lock:
+            key = (target, is_async)
+            if key not in self.__lanes:
+                breaker = self.__get_breaker(target)
+                if is_async:
+                    self.__lanes[key] = AsyncLane(
+                        target, self.get_limit(target), self.__get_loop(), breaker
+                    )
+                else:
+                    self.__lanes[key] = Lane(target, self.get_limit(target), breaker)
+            return self.__lanes[key]
+
+    def __get_breaker(self, target: str) -> Optional[CircuitBreaker]:
+        if self.__breaker_policy is None:
+            return None
+        if target not in self.__breakers:
+            breaker = CircuitBreaker(target, self.__breaker_policy)
+            for fn in self.__breaker_listeners:
+                breaker.add_listener(fn)
+            self.__breakers[target] = breaker
+        return self.__breakers[target]
+
+    def __get_loop(self) -> asyncio.AbstractEventLoop:
+        """
+        Start the event loop of the async lanes on first use
+        """
+        if self.__loop is None:
+            self.__loop = asyncio.new_event_loop()
+            self.__loop_thread = Thread(
+                target=self.__loop.run_forever, name="scheduler-loop", daemon=True
+            )
+            self.__loop_thread.start()
+        return self.__loop
+
+
+class TaskGroup:
+    def __init__(self, scheduler: Scheduler, max_pending: int = None):
+        """
+        Track the tasks of one run, including tasks submitted by other tasks.
+        The first error raised by a task is raised again by `join`.
+
+        With `max_pending`, `submit` blocks while that many tasks are queued or
+        running, so a producer cannot run ahead of the workers. Tasks deferred
+        by a circuit breaker do not count, so the tasks of the other targets
+        keep coming. Tasks must not submit to such a group, they would wait
+        for themselves.
+        """
+        if max_pending is not None and max_pending < 1:
+            raise Exception(f"Invalid max pending {max_pending}")
+        self.__scheduler = scheduler
+        self.__max_pending = max_pending
+        self.__count = 0
+        self.__deferred = 0
+        self.__condition = Condition()
+        self.__error: BaseException = None
+
+    def submit(self, target: str, fn: Callable, *args, **kwargs) -> Future:
+        with self.__condition:
+            if self.__max_pending is not None:
+                self.__condition.wait_for(
+                    lambda: self.__count - self.__deferred < self.__max_pending
+                )
+            self.__count += 1
+        run = self.__run_async if asyncio.iscoroutinefunction(fn) else self.__run
+        try:
+            future = self.__scheduler.submit(target, run, fn, *args, **kwargs)
+        except Exception:
+            self.__done()
+            raise
+        if isinstance(future, LaneFuture):
+            future.add_defer_callback(self.__on_deferred)
+        return future
+
+    def join(self):
+        with self.__condition:
+            self.__condition.wait_for(lambda: self.__count == 0)
+            error, self.__error = self.__error, None
+        if error is not None:
+            raise error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.join()
+
+    def __run(self, fn: Callable, *args, **kwargs):
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as ex:
+            self.__done(ex)
+            raise
+        self.__done()
+        return result
+
+    async def __run_async(self, fn: Callable, *args, **kwargs):
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException as ex:
+            self.__done(ex)
+            raise
+        self.__done()
+        return result
+
+    def __on_deferred(self, deferred: bool):
+        with self.__condition:
+            self.__deferred += 1 if deferred else -1
+            self.__condition.notify_all()
+
+    def __done(self, error: BaseException = None):
+        with self.__condition:
+            self.__count -= 1
+            if error is not None and self.__error is None:
+                self.__error = error
+            self.__condition.notify_all()
+
+
+def parse_limits(values) -> Optional[Dict[str, BackendLimit]]:
+    """
+    Parse a list of `TARGET=CONCURRENCY[:RATE]` values
+    """
+    if not values:
+        return None
+    return dict(BackendLimit.parse(value) for value in values)
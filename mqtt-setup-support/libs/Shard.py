@@ -0,0 +1,39 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import hashlib
+
+
+class Shard:
+    def __init__(self, index: int, count: int):
+        """
+        One of `count` disjoint parts of the input, `index` starts from 0
+        """
+        if count < 1 or index < 0 or index >= count:
+            raise Exception(f"Invalid shard {index}/{count}")
+        self.index = index
+        self.count = count
+
+    @staticmethod
+    def parse(value: str):
+        """
+        Parse `i/N`, e.g. `0/4` is the first of 4 shards
+        """
+        index, _, count = value.partition("/")
+        try:
+            return Shard(index=int(index), count=int(count))
+        except ValueError:
+            raise Exception(f"Invalid shard {value}, expected i/N")
+
+    def contains(self, key) -> bool:
+        """
+        Check if a key belongs to the shard. The hash does not depend on the
+        process, so every worker gets the same partition from the same files.
+        """
+        digest = hashlib.sha1(str(key).encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big") % self.count == self.index
+
+    def __str__(self) -> str:
+        return f"{self.index}/{self.count}"
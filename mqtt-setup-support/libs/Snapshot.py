@@ -0,0 +1,165 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import hashlib
+import json
+import sqlite3
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sims (
+    imsi TEXT PRIMARY KEY,
+    groupId TEXT,
+    deviceName TEXT,
+    azureDeviceId TEXT,
+    gcpDeviceId TEXT,
+    data TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    refreshedAt TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sims_groupId ON sims (groupId);
+CREATE INDEX IF NOT EXISTS sims_azureDeviceId ON sims (azureDeviceId);
+CREATE INDEX IF NOT EXISTS sims_gcpDeviceId ON sims (gcpDeviceId);
+CREATE TABLE IF NOT EXISTS groups (
+    groupId TEXT PRIMARY KEY,
+    name TEXT,
+    data TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    refreshedAt TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class Snapshot:
+    def __init__(self, filename: str):
+        """
+        SIMs and groups of a tenant in a local SQLite file. A refresh only
+        writes the rows whose content changed and removes the rows that are
+        gone, the file can be queried with any SQLite client.
+        """
+        self.filename = filename
+        self.__db = sqlite3.connect(filename, check_same_thread=False)
+        self.__db.row_factory = sqlite3.Row
+        self.__db.executescript(SCHEMA)
+
+    def close(self):
+        self.__db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def refresh_sims(self, sims: Iterable[Dict]) -> Dict[str, int]:
+        """
+        Replace the SIMs with given ones, return the number of added, changed,
+        removed and unchanged SIMs
+        """
+        return self.__refresh(
+            "sims",
+            "imsi",
+            [
+                (
+                    str(sim["imsi"]),
+                    {
+                        "groupId": sim.get("groupId"),
+                        "deviceName": sim.get("deviceName"),
+                        "azureDeviceId": sim.get("azureDeviceId"),
+                        "gcpDeviceId": sim.get("gcpDeviceId"),
+                    },
+                    sim,
+                )
+                for sim in sims
+            ],
+        )
+
+    def refresh_groups(self, groups: Iterable[Dict]) -> Dict[str, int]:
+        """
+        Replace the groups with given ones, return the number of added,
+        changed, removed and unchanged groups
+        """
+        return self.__refresh(
+            "groups",
+            "groupId",
+            [
+                (str(group["groupId"]), {"name": group.get("name")}, group)
+                for group in groups
+            ],
+        )
+
+    def get_sim(self, imsi: str) -> Optional[Dict]:
+        """
+        Get a SIM as returned by the SDP API, None if it is not in the snapshot
+        """
+        row = self.__db.execute(
+            "SELECT data FROM sims WHERE imsi = ?", (str(imsi),)
+        ).fetchone()
+        return json.loads(row["data"]) if row is not None else None
+
+    def get_sims_in_group(self, group_id: str) -> List[Dict]:
+        """
+        Get the SIMs of a group
+        """
+        rows = self.__db.execute(
+            "SELECT data FROM sims WHERE groupId = ? ORDER BY imsi", (str(group_id),)
+        ).fetchall()
+        return [json.loads(row["data"]) for row in rows]
+
+    def get_groups(self) -> List[Dict]:
+        """
+        Get all groups
+        """
+        rows = self.__db.execute("SELECT data FROM groups ORDER BY groupId").fetchall()
+        return [json.loads(row["data"]) for row in rows]
+
+    def get_refreshed_at(self) -> Optional[str]:
+        row = self.__db.execute(
+            "SELECT value FROM meta WHERE key = 'refreshedAt'"
+        ).fetchone()
+        return row["value"] if row is not None else None
+
+    def __refresh(self, table: str, key: str, rows: List) -> Dict[str, int]:
+        now = datetime.now(timezone.utc).isoformat()
+        hashes = {
+            row[key]: row["hash"]
+            for row in self.__db.execute(f"SELECT {key}, hash FROM {table}")
+        }
+        counts = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0}
+        seen = set()
+
+        with self.__db:
+            for row_id, columns, data in rows:
+                seen.add(row_id)
+                text = json.dumps(data, sort_keys=True, default=str)
+                digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+                if hashes.get(row_id) == digest:
+                    counts["unchanged"] += 1
+                    continue
+
+                counts["changed" if row_id in hashes else "added"] += 1
+                names = [key, *columns.keys(), "data", "hash", "refreshedAt"]
+                self.__db.execute(
+                    f"INSERT OR REPLACE INTO {table} ({', '.join(names)}) "
+                    f"VALUES ({', '.join('?' * len(names))})",
+                    [row_id, *columns.values(), text, digest, now],
+                )
+
+            removed = [(row_id,) for row_id in hashes if row_id not in seen]
+            self.__db.executemany(f"DELETE FROM {table} WHERE {key} = ?", removed)
+            counts["removed"] = len(removed)
+
+            self.__db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('refreshedAt', ?)",
+                (now,),
+            )
+
+        return counts
@@ -0,0 +1,75 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+from typing import Dict, Literal, Tuple
+
+
+# Connect and read seconds of each operation type
+DEFAULT_TIMEOUTS = {"auth": (5.0, 30.0), "read": (5.0, 30.0), "write": (5.0, 60.0)}
+
+Operation = Literal["auth", "read", "write"]
+
+
+class Timeout:
+    def __init__(self, connect: float, read: float):
+        """
+        Seconds to wait for a connection and then for each read of the reply
+        """
+        if connect <= 0 or read <= 0:
+            raise Exception(f"Invalid timeout {connect}:{read}")
+        self.connect = connect
+        self.read = read
+
+    @property
+    def total(self) -> float:
+        """
+        Deadline of a whole call, for clients that only take one value
+        """
+        return self.connect + self.read
+
+    def to_requests(self) -> Tuple[float, float]:
+        return (self.connect, self.read)
+
+
+class Timeouts:
+    def __init__(self, timeouts: Dict[str, Timeout] = None):
+        """
+        Timeouts per operation type: `auth` for the token, `read` for GET calls
+        and `write` for calls that create or update
+        """
+        self.__timeouts: Dict[str, Timeout] = {
+            operation: Timeout(connect, read)
+            for operation, (connect, read) in DEFAULT_TIMEOUTS.items()
+        }
+        self.__timeouts.update(timeouts or {})
+
+    def get(self, operation: Operation) -> Timeout:
+        return self.__timeouts[operation]
+
+    @staticmethod
+    def parse(values) -> "Timeouts":
+        """
+        Parse a list of `OPERATION=CONNECT[:READ]` values, e.g. `read=3:10`.
+        The read timeout is the connect one if it is not given
+        """
+        timeouts: Dict[str, Timeout] = {}
+        for value in values or []:
+            operation, _, timeout = value.partition("=")
+            operation = operation.strip()
+            if operation not in DEFAULT_TIMEOUTS:
+                raise Exception(
+                    f"Invalid timeout {value}, the operation is one of "
+                    f"{', '.join(DEFAULT_TIMEOUTS)}"
+                )
+            connect, _, read = timeout.partition(":")
+            try:
+                timeouts[operation] = Timeout(
+                    float(connect), float(read) if read else float(connect)
+                )
+            except ValueError:
+                raise Exception(
+                    f"Invalid timeout {value}, expected OPERATION=CONNECT[:READ]"
+                )
+        return Timeouts(timeouts)
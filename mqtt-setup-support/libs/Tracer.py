@@ -0,0 +1,180 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import json
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from typing import Dict, List, Optional
+
+
+SERVICE_NAME = "mqtt-setup-support"
+
+# OTLP span kinds
+KIND_INTERNAL = 1
+KIND_CLIENT = 3
+
+# OTLP status codes
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+class Span:
+    def __init__(
+        self,
+        name: str,
+        parent: "Span" = None,
+        kind: int = KIND_INTERNAL,
+        attributes: Dict = None,
+    ):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.start = time.time_ns()
+        self.end: int = None
+        self.error: str = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def set_error(self, error: str):
+        """
+        Mark the span as failed when the error is handled inside the span
+        """
+        self.error = error
+
+    def to_otlp(self) -> Dict:
+        """
+        Convert to a span of the OTLP JSON format
+        """
+        res = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end),
+            "attributes": [
+                {"key": k, "value": _to_otlp_value(v)}
+                for k, v in self.attributes.items()
+                if v is not None
+            ],
+            "status": {"code": STATUS_OK}
+            if self.error is None
+            else {"code": STATUS_ERROR, "message": self.error},
+        }
+        if self.parent_id is not None:
+            res["parentSpanId"] = self.parent_id
+        return res
+
+
+class _NoopSpan:
+    def set_attribute(self, key: str, value):
+        pass
+
+    def set_error(self, error: str):
+        pass
+
+
+class Tracer:
+    def __init__(self, filename: str, batch_size: int = 1000):
+        """
+        Record spans and write them to a file, one OTLP `ExportTraceServiceRequest`
+        JSON per line (the format of the OpenTelemetry Collector file exporter)
+        """
+        self.filename = filename
+        self.__batch_size = batch_size
+        self.__spans: List[Span] = []
+        self.__lock = Lock()
+        self.__file = open(filename, "w")
+
+    def record(self, span: Span):
+        with self.__lock:
+            self.__spans.append(span)
+            if len(self.__spans) >= self.__batch_size:
+                self.__flush()
+
+    def close(self):
+        with self.__lock:
+            self.__flush()
+            self.__file.close()
+
+    def __flush(self):
+        if not self.__spans:
+            return
+        request = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {
+                                "key": "service.name",
+                                "value": {"stringValue": SERVICE_NAME},
+                            }
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": SERVICE_NAME},
+                            "spans": [s.to_otlp() for s in self.__spans],
+                        }
+                    ],
+                }
+            ]
+        }
+        self.__file.write(json.dumps(request) + "\n")
+        self.__file.flush()
+        self.__spans = []
+
+
+_tracer: Optional[Tracer] = None
+_current: ContextVar[Optional[Span]] = ContextVar("span", default=None)
+
+
+def set_tracer(tracer: Optional[Tracer]):
+    """
+    Enable tracing with a given tracer, or disable it with None
+    """
+    global _tracer
+    _tracer = tracer
+
+
+@contextmanager
+def span(name: str, kind: int = KIND_INTERNAL, **attributes):
+    """
+    Record the block as a span, child of the current span. Does nothing if
+    tracing is disabled.
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield _NoopSpan()
+        return
+
+    s = Span(name, parent=_current.get(), kind=kind, attributes=attributes)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as ex:
+        s.error = str(ex) or type(ex).__name__
+        raise
+    finally:
+        _current.reset(token)
+        s.end = time.time_ns()
+        tracer.record(s)
+
+
+def _to_otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
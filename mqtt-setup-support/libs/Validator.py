@@ -0,0 +1,323 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import os
+import yaml
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+AZURE_AUTH_TYPES = {
+    "SAS": ["primary_key", "secondary_key"],
+    "X509": ["primary_thumbprint", "secondary_thumbprint"],
+    "CA": [],
+}
+GCP_KEY_FORMATS = {"RSA_PEM", "RSA_X509_PEM", "ES256_PEM", "ES256_X509_PEM", ""}
+GCP_ALGORITHMS = {"RS256", "ES256"}
+
+# Sections of a settings block read by each action
+SECTIONS = {
+    "update-sims": {"devices", "groups"},
+    "add-devices": {"devices", "options"},
+    "add-authentications": {"authentications"},
+    "apply": {"devices", "options", "groups", "authentications"},
+    "watch": {"devices", "options", "groups", "authentications"},
+    "verify": {"devices", "options", "groups", "authentications"},
+}
+
+# Keys of a settings block needed to send the entries of a section
+REQUIRED_SETTINGS = {
+    "azure": {"devices": ["connectionString"]},
+    "gcp": {
+        "devices": ["projectId", "region", "registryId"],
+        "authentications": ["projectId", "region", "registryId"],
+    },
+}
+
+
+class ValidationError:
+    def __init__(self, filename: str, line: int, message: str):
+        self.filename = filename
+        self.line = line
+        self.message = message
+
+    def __str__(self) -> str:
+        return f"{self.filename}:{self.line}: {self.message}"
+
+
+class Validator:
+    def __init__(self, action: str = "apply"):
+        """
+        Check yaml files against the rules of the README before anything is
+        sent, every error is reported with its file and line. The checks of an
+        action are built once and run on the node tree of each file.
+        """
+        self.action = action
+        sections = SECTIONS.get(action, SECTIONS["apply"])
+        self.__checks: List[Callable] = [
+            check
+            for section, check in [
+                ("devices", self.__check_devices),
+                ("groups", self.__check_groups),
+                ("authentications", self.__check_authentications),
+            ]
+            if section in sections
+        ]
+        self.__needs_imsi = "groups" in sections
+        self.__checks_options = "options" in sections
+        # Devices are only sent to the cloud when their options are read,
+        # update-sims takes their IMSI and ID alone
+        self.__sent_sections = sections & {"authentications"}
+        if self.__checks_options:
+            self.__sent_sections.add("devices")
+
+    def validate_files(self, filenames: List[str]) -> List[ValidationError]:
+        errors: List[ValidationError] = []
+        for filename in filenames:
+            errors += self.validate_file(filename)
+        return errors
+
+    def validate_file(self, filename: str) -> List[ValidationError]:
+        errors, _ = self.__load(filename, construct=False)
+        return errors
+
+    def load_file(self, filename: str) -> Tuple[List[ValidationError], Any]:
+        """
+        Validate a file and get its content, None if it has errors. The yaml is
+        parsed once for both.
+        """
+        return self.__load(filename, construct=True)
+
+    def __load(self, filename: str, construct: bool):
+        content = None
+        try:
+            with open(filename, "r") as f:
+                loader = Loader(f)
+                try:
+                    node = loader.get_single_node()
+                    errors = self.validate_node(filename, node)
+                    if construct and not errors:
+                        content = loader.construct_document(node)
+                finally:
+                    loader.dispose()
+        except yaml.MarkedYAMLError as ex:
+            mark = ex.problem_mark or ex.context_mark
+            return [
+                ValidationError(
+                    filename,
+                    mark.line + 1 if mark else 0,
+                    f"Invalid yaml: {ex.problem}",
+                )
+            ], None
+        except (OSError, yaml.YAMLError) as ex:
+            return [ValidationError(filename, 0, str(ex))], None
+        return errors, content
+
+    def validate_node(self, filename: str, node: yaml.Node) -> List[ValidationError]:
+        errors: List[ValidationError] = []
+
+        def error(node: yaml.Node, message: str):
+            errors.append(ValidationError(filename, node.start_mark.line + 1, message))
+
+        root = self.__mapping(node, error, "The file")
+        if root is None:
+            return errors
+
+        if "azureSettings" in root:
+            device_type = "azure"
+        elif "gcpSettings" in root:
+            device_type = "gcp"
+        else:
+            error(node, "Invalid yaml format, azureSettings or gcpSettings is required")
+            return errors
+
+        _, settings_node = root[f"{device_type}Settings"]
+        settings = self.__mapping(settings_node, error, f"{device_type}Settings")
+        if settings is None:
+            return errors
+
+        required: List[str] = []
+        for section, keys in REQUIRED_SETTINGS[device_type].items():
+            if section in self.__sent_sections and self.__has_entries(
+                settings, section
+            ):
+                required += [key for key in keys if key not in required]
+        self.__check_required(settings_node, settings, required, error)
+        if "serviceAccount" in settings:
+            self.__check_file(settings["serviceAccount"][1], error)
+
+        global_options = self.__options(settings.get("options"), error) or {}
+        for check in self.__checks:
+            check(device_type, settings, global_options, error)
+
+        return errors
+
+    # Sections
+
+    def __check_devices(self, device_type, settings, global_options, error):
+        for device_node, device in self.__entries(settings, "devices", error):
+            required = ["imsi", "deviceId"] if self.__needs_imsi else ["deviceId"]
+            self.__check_required(device_node, device, required, error)
+
+            if not self.__checks_options:
+                continue
+            options = dict(global_options)
+            options.update(self.__options(device.get("options"), error) or {})
+            if device_type == "azure":
+                self.__check_azure_options(device_node, options, error)
+            else:
+                self.__check_gcp_options(device_node, options, error)
+
+    def __check_groups(self, device_type, settings, global_options, error):
+        for group_node, group in self.__entries(settings, "groups", error):
+            self.__check_required(group_node, group, ["deviceIdTemplate"], error)
+            if "groupId" not in group and "name" not in group:
+                error(group_node, "groupId or name is required")
+
+    def __check_authentications(self, device_type, settings, global_options, error):
+        for auth_node, auth in self.__entries(settings, "authentications", error):
+            if device_type == "azure":
+                self.__check_required(
+                    auth_node, auth, ["name", "sharedAccessKey", "deviceId"], error
+                )
+                continue
+
+            self.__check_required(
+                auth_node, auth, ["name", "algorithm", "privateKey", "deviceId"], error
+            )
+            if "algorithm" in auth:
+                value_node = auth["algorithm"][1]
+                if str(self.__value(value_node)).upper() not in GCP_ALGORITHMS:
+                    error(
+                        value_node,
+                        f"Invalid algorithm {self.__value(value_node)}, "
+                        f"expected one of {', '.join(sorted(GCP_ALGORITHMS))}",
+                    )
+            if "privateKey" in auth:
+                self.__check_file(auth["privateKey"][1], error)
+
+    # Options
+
+    def __check_azure_options(self, device_node, options, error):
+        if "type" not in options:
+            error(device_node, "Option type is required")
+            return
+
+        value_node = options["type"]
+        auth_type = str(self.__value(value_node)).upper()
+        if auth_type not in AZURE_AUTH_TYPES:
+            error(
+                value_node,
+                f"Invalid auth type {self.__value(value_node)}, "
+                f"expected one of {', '.join(AZURE_AUTH_TYPES)}",
+            )
+            return
+
+        for name in AZURE_AUTH_TYPES[auth_type]:
+            if name not in options:
+                error(device_node, f"Option {name} is required for type {auth_type}")
+
+    def __check_gcp_options(self, device_node, options, error):
+        if "format" not in options:
+            return
+
+        value_node = options["format"]
+        key_format = str(self.__value(value_node) or "").upper().strip()
+        if key_format not in GCP_KEY_FORMATS:
+            error(
+                value_node,
+                f"Invalid Public Key Format {self.__value(value_node)}, "
+                f"expected one of {', '.join(sorted(GCP_KEY_FORMATS - {''}))}",
+            )
+            return
+
+        if key_format != "":
+            if "public_key" not in options:
+                error(
+                    device_node,
+                    f"Option public_key is required for format {key_format}",
+                )
+            else:
+                self.__check_file(options["public_key"], error)
+
+    def __options(self, node: Optional[Tuple], error) -> Optional[Dict[str, yaml.Node]]:
+        """
+        Get the value nodes of a list of `name`/`value` options by name
+        """
+        if node is None:
+            return None
+        _, options_node = node
+        if self.__is_null(options_node):
+            return {}
+        if not isinstance(options_node, yaml.SequenceNode):
+            error(options_node, "options must be a list")
+            return None
+
+        options: Dict[str, yaml.Node] = {}
+        for option_node in options_node.value:
+            option = self.__mapping(option_node, error, "An option")
+            if option is None:
+                continue
+            if not self.__check_required(option_node, option, ["name", "value"], error):
+                continue
+            options[str(self.__value(option["name"][1]))] = option["value"][1]
+        return options
+
+    # Nodes
+
+    def __entries(self, settings, section: str, error):
+        """
+        Yield the node and the mapping of each entry of a list section
+        """
+        if section not in settings:
+            return
+        _, section_node = settings[section]
+        if self.__is_null(section_node):
+            return
+        if not isinstance(section_node, yaml.SequenceNode):
+            error(section_node, f"{section} must be a list")
+            return
+        for entry_node in section_node.value:
+            entry = self.__mapping(entry_node, error, f"An entry of {section}")
+            if entry is not None:
+                yield entry_node, entry
+
+    def __has_entries(self, settings, section: str) -> bool:
+        if section not in settings:
+            return False
+        _, section_node = settings[section]
+        return isinstance(section_node, yaml.SequenceNode) and bool(section_node.value)
+
+    def __mapping(
+        self, node: yaml.Node, error, name: str
+    ) -> Optional[Dict[str, Tuple[yaml.Node, yaml.Node]]]:
+        if not isinstance(node, yaml.MappingNode):
+            error(node, f"{name} must be a mapping")
+            return None
+        return {str(key.value): (key, value) for key, value in node.value}
+
+    def __check_required(self, node, mapping, keys: List[str], error) -> bool:
+        valid = True
+        for key in keys:
+            if key not in mapping or self.__value(mapping[key][1]) in (None, ""):
+                error(node, f"{key} is required")
+                valid = False
+        return valid
+
+    def __check_file(self, node: yaml.Node, error):
+        path = self.__value(node)
+        if isinstance(path, str) and path and not os.path.isfile(path):
+            error(node, f"File {path} does not exist")
+
+    def __value(self, node: yaml.Node):
+        if not isinstance(node, yaml.ScalarNode):
+            return node
+        if self.__is_null(node):
+            return None
+        return node.value
+
+    def __is_null(self, node: yaml.Node) -> bool:
+        return node.tag == "tag:yaml.org,2002:null"
@@ -3,27 +3,198 @@
 ## This software is released under the MIT License.
 ## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
 
+import os
 from argparse import ArgumentParser
-from services.main_service import MainService
+from libs.CircuitBreaker import BreakerPolicy
+from libs.FileCache import FileCache
+from libs.Profiler import Profiler, phase, set_profiler
+from libs.Recording import CallRecorder, CallReplayer
+from libs.Scheduler import parse_limits
+from libs.Shard import Shard
+from libs.Timeouts import Timeouts
+from libs.Tracer import Tracer, set_tracer
+from models.Summary import RunSummary
 
 
 __version__ = "1.0.0"
 
+ACTIONS = [
+    "update-sims",
+    "add-devices",
+    "add-authentications",
+    "apply",
+    "merge-summaries",
+    "snapshot",
+    "watch",
+    "serve",
+    "verify",
+]
+
 
 if __name__ == "__main__":
 
+    tracer = None
+    profiler = None
+    calls = None
+
     try:
         parser = ArgumentParser(description="MQTTv2 transfer tool")
         parser.add_argument(
             "action",
-            help="Current valid actions: 'update-sims', 'add-devices', 'add-authentications'",
+            help="Current valid actions: {}".format(
+                ", ".join(f"'{a}'" for a in ACTIONS)
+            ),
             type=str,
         )
         parser.add_argument(
             "files",
-            help="The file path of the data file, you can specify multiple files by using space between files",
+            help="The file path of the data file, you can specify multiple files by using space between files. "
+            "For 'snapshot', the SQLite file to write. For 'serve', the Unix socket to accept jobs on",
             nargs="+",
         )
+        parser.add_argument(
+            "--limit",
+            help="Concurrency and rate (calls per second) of a backend as TARGET=CONCURRENCY[:RATE]. "
+            "TARGET is 'sdp', 'azure', 'gcp' or a single target such as 'azure:<HUB HOST NAME>' "
+            "or 'gcp:<PROJECT>/<REGION>/<REGISTRY>'. Can be given multiple times",
+            action="append",
+            default=[],
+        )
+        parser.add_argument(
+            "--timeout",
+            help="Connect and read timeouts in seconds of an operation type as OPERATION=CONNECT[:READ]. "
+            "OPERATION is 'auth' (the SDP token), 'read' or 'write'. Can be given multiple times",
+            action="append",
+            default=[],
+        )
+        parser.add_argument(
+            "--hedge",
+            help="Send a second attempt of a read (get SIM, list authentications, get Azure or GCP device) "
+            "when the first one is slower than this percentile of the recent reads, e.g. '--hedge 95'",
+            metavar="PERCENTILE",
+            type=float,
+        )
+        parser.add_argument(
+            "--breaker",
+            help="Defer the items of a backend target after this many consecutive failed calls "
+            "(no reply, timeout, 429 or 5xx) and probe it after COOLDOWN seconds "
+            "(default: 10:5), '0' to never defer",
+            metavar="FAILURES[:COOLDOWN]",
+            type=BreakerPolicy.parse,
+            default="10",
+        )
+        parser.add_argument(
+            "--gcp-async",
+            help="Add GCP devices with the async client, use with a high GCP concurrency, e.g. '--limit gcp=500'",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--shard",
+            help="Only process shard i of N (i starts from 0) of the input, e.g. '--shard 0/4'",
+            type=Shard.parse,
+        )
+        parser.add_argument(
+            "--summary",
+            help="Write the run summary as JSON to this file. For 'merge-summaries', the merged summary",
+            type=str,
+        )
+        parser.add_argument(
+            "--failures",
+            help="Write the failed and skipped entries to this directory as yaml files, "
+            "one per action to rerun them with and per settings",
+            metavar="DIR",
+            type=str,
+        )
+        parser.add_argument(
+            "--trace",
+            help="Record a span per item and per API call and write them to this file as OTLP JSON lines",
+            type=str,
+        )
+        parser.add_argument(
+            "--record",
+            help="Record the SDP and cloud API calls with their results and latencies to this file",
+            metavar="FILE",
+            type=str,
+        )
+        parser.add_argument(
+            "--replay",
+            help="Answer the SDP and cloud API calls from a file written with '--record' "
+            "instead of the network",
+            metavar="FILE",
+            type=str,
+        )
+        parser.add_argument(
+            "--replay-latency-scale",
+            help="With '--replay', wait the recorded latency of a call times this factor, "
+            "0 to answer at once (default: 1)",
+            metavar="X",
+            type=float,
+            default=1.0,
+        )
+        parser.add_argument(
+            "--interval",
+            help="For 'watch', seconds between two checks of the files",
+            type=float,
+            default=2.0,
+        )
+        parser.add_argument(
+            "--snapshot",
+            help="For 'update-sims', check the SIMs against this snapshot file written by "
+            "the 'snapshot' action first. SIMs that do not exist fail and unchanged SIMs "
+            "are skipped without API calls",
+            metavar="DB",
+            type=str,
+        )
+        parser.add_argument(
+            "--dry-run",
+            help="With '--snapshot', only log the changes of every SIM without any update",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--parse-workers",
+            help="Number of processes parsing the input files, 1 to parse them in the main process "
+            "(default: the number of CPUs)",
+            type=int,
+        )
+        parser.add_argument(
+            "--cache",
+            help="Directory of the parsed input files, a file is not parsed again while it "
+            "and the tool version are unchanged",
+            metavar="DIR",
+            type=str,
+            default=os.path.join(
+                os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+                "mqtt-setup-support",
+            ),
+        )
+        parser.add_argument(
+            "--no-cache",
+            help="Always parse the input files",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--skip-validation",
+            help="Do not check the input files before the run",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--skip-existing",
+            help="Do not create an authentication if one with the same type, name "
+            "(without the time suffix) and device ID exists",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--quiet",
+            help="Do not log every item, only failures, skipped items and the progress",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--profile",
+            help="Profile the run and write PREFIX.pstats and a report of the phases "
+            "and the top functions to PREFIX.txt",
+            metavar="PREFIX",
+            type=str,
+        )
         parser.add_argument(
             "-v",
             "--version",
@@ -33,25 +204,90 @@ if __name__ == "__main__":
         )
         args = parser.parse_args()
 
-        if (
-            args.action != "update-sims"
-            and args.action != "add-devices"
-            and args.action != "add-authentications"
-        ):
+        if args.action not in ACTIONS:
             exit(
-                "Invalid action, current valid actions: 'update-sims', 'add-devices', 'add-authentications'"
+                "Invalid action, current valid actions: {}".format(
+                    ", ".join(f"'{a}'" for a in ACTIONS)
+                )
             )
 
-        main = MainService()
+        if args.record is not None and args.replay is not None:
+            exit("Cannot both record and replay")
+
+        summary: RunSummary = None
+
+        if args.profile is not None:
+            profiler = Profiler(args.profile)
+            set_profiler(profiler)
+            profiler.start()
+
+        if args.trace is not None:
+            tracer = Tracer(args.trace)
+            set_tracer(tracer)
+
+        if args.action == "merge-summaries":
+            summary = RunSummary.merge([RunSummary.load(f) for f in args.files])
+            if args.summary is None:
+                print(summary.toJSON())
+        else:
+            # Load the services only when needed, they require the environment variables
+            with phase("settings"):
+                import settings
+            with phase("imports"):
+                from services.main_service import MainService, stream
+                from services.job_server import JobServer
+
+            if profiler is not None:
+                # The queue handler only enqueues, the listener thread writes
+                profiler.wrap_handler(stream)
 
-        if args.action == "update-sims":
-            main.batch_update_sims(*args.files)
+            if args.record is not None:
+                calls = CallRecorder(args.record)
+            elif args.replay is not None:
+                calls = CallReplayer(
+                    args.replay, latency_scale=args.replay_latency_scale
+                )
 
-        if args.action == "add-devices":
-            main.add_devices(*args.files)
+            with MainService(
+                limits=parse_limits(args.limit),
+                gcp_async=args.gcp_async,
+                shard=args.shard,
+                progress=args.action != "serve",
+                quiet=args.quiet,
+                failures_dir=args.failures,
+                skip_existing=args.skip_existing,
+                snapshot=args.snapshot,
+                dry_run=args.dry_run,
+                validate=not args.skip_validation,
+                timeouts=Timeouts.parse(args.timeout),
+                hedge=args.hedge,
+                parse_workers=args.parse_workers,
+                cache=(
+                    FileCache(args.cache, version=__version__)
+                    if not args.no_cache
+                    else None
+                ),
+                calls=calls,
+                breaker=args.breaker,
+            ) as main:
+                if args.action == "serve":
+                    JobServer(main, args.files[0]).serve()
+                else:
+                    result = main.run(args.action, *args.files, interval=args.interval)
+                    if isinstance(result, RunSummary):
+                        summary = result
 
-        if args.action == "add-authentications":
-            main.add_authentications(*args.files)
+        if args.summary is not None and summary is not None:
+            with phase("summary"), open(args.summary, "w") as f:
+                f.write(summary.toJSON())
 
     except Exception as ex:
         exit(str(ex))
+    finally:
+        if isinstance(calls, CallRecorder):
+            calls.close()
+        if tracer is not None:
+            tracer.close()
+        if profiler is not None:
+            set_profiler(None)
+            profiler.close()
@@ -4,10 +4,26 @@
 ## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
 
 import json
-from typing import List
+import re
+from typing import List, Tuple
 import io
 from datetime import datetime
 
+# Suffix added to the name of every created authentication, see `__add_time_suffix`
+TIME_SUFFIX = re.compile(r"_\d{12}$")
+
+
+def get_index_key(auth: dict) -> Tuple[str, str, str]:
+    """
+    Get the key of an authentication listed by the SDP API, the type, the name
+    without the time suffix and the device ID
+    """
+    return (
+        auth.get("type", ""),
+        TIME_SUFFIX.sub("", auth.get("name", "")),
+        auth.get("deviceId", ""),
+    )
+
 
 class CreateAzureAuthenticationRequest:
     def __init__(
@@ -58,6 +74,8 @@ class CreateGCPAuthenticationRequest:
 
 
 class GCPAuthentication:
+    device_type = "gcp"
+
     def __init__(
         self,
         name: str = "",
@@ -92,6 +110,37 @@ class GCPAuthentication:
             privateKey=self.__load_private_key(),
         )
 
+    def get_type(self) -> str:
+        return self.__type
+
+    def get_index_key(self) -> Tuple[str, str, str]:
+        """
+        Get the key of the authentication once it is created, see `get_index_key`
+        """
+        return (self.__type, self.name, self.deviceId)
+
+    def get_yaml_settings(self) -> dict:
+        """
+        Get the settings of the yaml file the authentication is read from
+        """
+        return {
+            "projectId": self.projectId,
+            "region": self.region,
+            "registryId": self.registryId,
+        }
+
+    def to_yaml(self) -> dict:
+        """
+        Get the authentication entry of the yaml file
+        """
+        return {
+            "name": self.name,
+            "algorithm": self.algorithm,
+            "privateKey": self.privateKey,
+            "deviceId": self.deviceId,
+            "description": self.description,
+        }
+
     def toJSON(self) -> str:
         return json.dumps(self, default=lambda o: o.__dict__, sort_keys=True, indent=4)
 
@@ -112,6 +161,8 @@ class GCPAuthentication:
 
 
 class AzureAuthentication:
+    device_type = "azure"
+
     def __init__(
         self,
         name: str = "",
@@ -134,6 +185,33 @@ class AzureAuthentication:
             deviceId=self.deviceId,
         )
 
+    def get_type(self) -> str:
+        return self.__type
+
+    def get_index_key(self) -> Tuple[str, str, str]:
+        """
+        Get the key of the authentication once it is created, see `get_index_key`
+        """
+        return (self.__type, self.name, self.deviceId)
+
+    def get_yaml_settings(self) -> dict:
+        """
+        Get the settings of the yaml file the authentication is read from,
+        Azure authentications do not use any
+        """
+        return {}
+
+    def to_yaml(self) -> dict:
+        """
+        Get the authentication entry of the yaml file
+        """
+        return {
+            "name": self.name,
+            "sharedAccessKey": self.sharedAccessKey,
+            "deviceId": self.deviceId,
+            "description": self.description,
+        }
+
     def toJSON(self) -> str:
         return json.dumps(self, default=lambda o: o.__dict__, sort_keys=True, indent=4)
 
@@ -0,0 +1,39 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+
+class SDPCredentials:
+    def __init__(self, host: str, tenant_id: str, key: str, secret: str):
+        """
+        SDP API host and the API key of a tenant
+        """
+        for name, value in [
+            ("host", host),
+            ("tenant_id", tenant_id),
+            ("key", key),
+            ("secret", secret),
+        ]:
+            if not value:
+                raise Exception(f"SDP credentials have no {name}")
+        self.host = host
+        self.tenant_id = tenant_id
+        self.key = key
+        self.secret = secret
+
+    @staticmethod
+    def from_env() -> "SDPCredentials":
+        """
+        Read the credentials from the environment variables and the `.env`
+        file, raise if one is missing
+        """
+        # Only load settings.py when needed, it requires the environment variables
+        import settings
+
+        return SDPCredentials(
+            host=settings.SDP_API_HOST,
+            tenant_id=settings.SDP_API_TENANT_ID,
+            key=settings.SDP_API_KEY,
+            secret=settings.SDP_API_SECRET,
+        )
@@ -0,0 +1,112 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+
+# Kinds of the values of a column, yaml gives IMSIs as numbers or strings
+KIND_NONE = 0
+KIND_STR = 1
+KIND_INT = 2
+
+
+class ValueColumn:
+    def __init__(self):
+        """
+        Strings and integers packed into one UTF-8 buffer with their end
+        offsets, instead of one Python object per value
+        """
+        self.__data = bytearray()
+        self.__ends = array("Q")
+        self.__kinds = array("B")
+
+    def append(self, value: Union[str, int, None]):
+        if value is None:
+            self.__kinds.append(KIND_NONE)
+        elif isinstance(value, int) and not isinstance(value, bool):
+            self.__kinds.append(KIND_INT)
+            self.__data += str(value).encode("utf-8")
+        else:
+            self.__kinds.append(KIND_STR)
+            self.__data += str(value).encode("utf-8")
+        self.__ends.append(len(self.__data))
+
+    def __len__(self) -> int:
+        return len(self.__kinds)
+
+    def __getitem__(self, index: int) -> Union[str, int, None]:
+        kind = self.__kinds[index]
+        if kind == KIND_NONE:
+            return None
+        start = self.__ends[index - 1] if index > 0 else 0
+        text = self.__data[start : self.__ends[index]].decode("utf-8")
+        return int(text) if kind == KIND_INT else text
+
+
+class DeviceTable:
+    def __init__(self, global_options: Dict = None):
+        """
+        The devices of one settings block. Device IDs and IMSIs are kept in
+        packed columns, and each device points at an option template. The
+        first template is the merged global options, a device with own options
+        points at the template of its merged options, which is shared by all
+        devices with the same ones.
+        """
+        self.__device_ids = ValueColumn()
+        self.__imsis = ValueColumn()
+        self.__template_ids = array("I")
+        self.__templates: List[Dict] = [global_options or {}]
+        self.__template_index: Optional[Dict[str, int]] = None
+
+    def append(self, device_id: str, imsi=None, options: Dict = None):
+        """
+        Add a device, `options` are its merged options or None if it has no
+        own options
+        """
+        self.__device_ids.append(device_id)
+        self.__imsis.append(imsi)
+        self.__template_ids.append(
+            0 if options is None else self.__intern_template(options)
+        )
+
+    def __len__(self) -> int:
+        return len(self.__template_ids)
+
+    def __iter__(self) -> Iterator[Tuple[str, Union[str, int, None], Dict]]:
+        """
+        Yield the device ID, the IMSI and the shared merged options of every
+        device, the options must not be changed
+        """
+        for index in range(len(self)):
+            yield self[index]
+
+    def __getitem__(self, index: int) -> Tuple[str, Union[str, int, None], Dict]:
+        return (
+            self.__device_ids[index],
+            self.__imsis[index],
+            self.__templates[self.__template_ids[index]],
+        )
+
+    def get_templates(self) -> List[Dict]:
+        return list(self.__templates)
+
+    def __getstate__(self):
+        # The index is only needed while devices are added
+        state = self.__dict__.copy()
+        state["_DeviceTable__template_index"] = None
+        return state
+
+    def __intern_template(self, options: Dict) -> int:
+        if self.__template_index is None:
+            self.__template_index = {
+                repr(sorted(t.items(), key=str)): i
+                for i, t in enumerate(self.__templates)
+            }
+        key = repr(sorted(options.items(), key=str))
+        if key not in self.__template_index:
+            self.__template_index[key] = len(self.__templates)
+            self.__templates.append(options)
+        return self.__template_index[key]
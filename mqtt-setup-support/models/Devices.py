@@ -3,30 +3,129 @@
 ## This software is released under the MIT License.
 ## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
 
+import asyncio
+import hashlib
 import io
 import requests
+from libs.Hedger import hedged, hedged_async
+from libs.Timeouts import Operation, Timeouts
+from libs.Tracer import KIND_CLIENT, span
 from azure.iot.hub import IoTHubRegistryManager
+from azure.iot.hub.models import QuerySpecification
 from google.cloud import iot_v1
 from google.cloud.iot_v1.types import resources
 from google.protobuf import field_mask_pb2 as gp_field_mask
 from google.oauth2 import service_account
 from msrest.exceptions import HttpOperationError
-from typing import List, Literal
+from threading import Lock
+from typing import Dict, List, Literal, Optional
+
+
+# Authentication types of the yaml file as reported by the IoT Hub twins
+AZURE_AUTH_TYPES = {"SAS": "sas", "X509": "selfSigned", "CA": "certificateAuthority"}
+
+
+def get_key_fingerprint(key: str) -> str:
+    """
+    Short fingerprint of a public key, the key itself is not reported
+    """
+    return hashlib.sha256(key.strip().encode("utf-8")).hexdigest()[:16]
 
 
 class CloudSetting:
+    device_type = None
+    device_id = None
+    imsi = None
+    options = None
+
     def add(self):
         pass
 
+    def get_yaml_settings(self) -> Dict:
+        """
+        Get the settings of the yaml file the device is read from, without the
+        global options
+        """
+        pass
+
+    def to_yaml(self) -> Dict:
+        """
+        Get the device entry of the yaml file, with the merged options
+        """
+        device = {} if self.imsi is None else {"imsi": self.imsi}
+        device["deviceId"] = self.device_id
+        device["options"] = [
+            {"name": name, "value": value}
+            for name, value in (self.options or {}).items()
+        ]
+        return device
+
     def get_info(self) -> str:
         pass
 
+    def get_target(self) -> str:
+        """
+        Get the backend target the device is sent to, used to schedule the work
+        """
+        pass
+
+    def list_devices(self, page_size: int) -> Dict[str, Dict]:
+        """
+        List all devices of the target of the setting page by page, get the
+        state of each device by its ID in the format of `get_expected`
+        """
+        pass
+
+    def get_expected(self) -> Dict:
+        """
+        Get the state of the device once the setting is added
+        """
+        pass
+
+    def get_drift(self, live: Optional[Dict]) -> List[str]:
+        """
+        Get the differences between the live state of the device, None if it
+        does not exist, and the setting
+        """
+        if live is None:
+            return ["Not found"]
+        return [
+            f"{field}: {live.get(field)} -> {value}"
+            for field, value in self.get_expected().items()
+            if live.get(field) != value
+        ]
+
 
 class AzureSetting(CloudSetting):
-    def __init__(self, connection_string: str, device_id: str, options: dict = None):
+    device_type = "azure"
+
+    def __init__(
+        self,
+        connection_string: str,
+        device_id: str,
+        options: dict = None,
+        imsi: str = None,
+        clients: "CloudClients" = None,
+    ):
+        self.__connection_string = connection_string
+        self.__clients = clients
+        self.__registry_manager: IoTHubRegistryManager = None
         self.device_id = device_id
         self.options = options
-        self.iothub_registry_manager = IoTHubRegistryManager(connection_string)
+        self.imsi = imsi
+        self.host_name = _get_host_name(connection_string)
+
+    @property
+    def iothub_registry_manager(self) -> IoTHubRegistryManager:
+        """
+        Registry manager of the IoT Hub, shared through `clients` if given,
+        otherwise created on first use
+        """
+        if self.__clients is not None:
+            return self.__clients.azure(self.__connection_string)
+        if self.__registry_manager is None:
+            self.__registry_manager = IoTHubRegistryManager(self.__connection_string)
+        return self.__registry_manager
 
     def add(self):
         """
@@ -37,18 +136,25 @@ class AzureSetting(CloudSetting):
         status = self.__get_status()
 
         # Check if device is created or not
-        device = self.__get_device()
+        with span("azure.get_device", kind=KIND_CLIENT, **self.__span_attributes()):
+            device = self.__get_device()
 
         try:
             if device is None:
-                return self.__create_device(auth_type=auth_type, status=status)
+                with span(
+                    "azure.create_device", kind=KIND_CLIENT, **self.__span_attributes()
+                ):
+                    return self.__create_device(auth_type=auth_type, status=status)
             else:
-                return self.__update_device(
-                    etag=device.etag, auth_type=auth_type, status=status
-                )
+                with span(
+                    "azure.update_device", kind=KIND_CLIENT, **self.__span_attributes()
+                ):
+                    return self.__update_device(
+                        etag=device.etag, auth_type=auth_type, status=status
+                    )
         except HttpOperationError as ex:
             response: requests.Response = ex.response
-            raise Exception(response.json())
+            raise Exception(response.json()) from ex
 
     def get_info(self):
         """
@@ -56,6 +162,64 @@ class AzureSetting(CloudSetting):
         """
         return f"Cloud Service: Azure IoT, Device ID: {self.device_id}"
 
+    def get_target(self):
+        """
+        Get the IoT Hub of the setting
+        """
+        return f"azure:{self.host_name}"
+
+    def get_yaml_settings(self):
+        return {"connectionString": self.__connection_string}
+
+    def list_devices(self, page_size: int) -> Dict[str, Dict]:
+        """
+        List the devices of the IoT Hub with twin queries, the twins have no
+        SAS keys so only the thumbprints of X509 devices are compared
+        """
+        devices: Dict[str, Dict] = {}
+        query = QuerySpecification(query="SELECT * FROM devices")
+        continuation_token = None
+        while True:
+            with span(
+                "azure.query_devices",
+                kind=KIND_CLIENT,
+                **{"backend.target": self.get_target()},
+            ):
+                result = self.iothub_registry_manager.query_iot_hub(
+                    query, continuation_token, page_size
+                )
+            for twin in result.items or []:
+                thumbprint = twin.x509_thumbprint
+                devices[twin.device_id] = {
+                    "authType": twin.authentication_type,
+                    "status": twin.status,
+                    "thumbprints": None
+                    if thumbprint is None or twin.authentication_type != "selfSigned"
+                    else [
+                        thumbprint.primary_thumbprint,
+                        thumbprint.secondary_thumbprint,
+                    ],
+                }
+            continuation_token = result.continuation_token
+            if not continuation_token:
+                return devices
+
+    def get_expected(self) -> Dict:
+        auth_type = self.__get_auth_type()
+        return {
+            "authType": AZURE_AUTH_TYPES[auth_type],
+            "status": self.__get_status(),
+            "thumbprints": [
+                self.options["primary_thumbprint"],
+                self.options["secondary_thumbprint"],
+            ]
+            if auth_type == "X509"
+            else None,
+        }
+
+    def __span_attributes(self):
+        return {"device.id": self.device_id, "backend.target": self.get_target()}
+
     def __create_device(
         self,
         auth_type: Literal["SAS", "CA", "X509"],
@@ -122,7 +286,11 @@ class AzureSetting(CloudSetting):
         Check and get device is created in cloud
         """
         try:
-            return self.iothub_registry_manager.get_device(self.device_id)
+            return hedged(
+                "azure.get_device",
+                self.iothub_registry_manager.get_device,
+                self.device_id,
+            )
         except Exception:
             return None
 
@@ -151,6 +319,8 @@ class AzureSetting(CloudSetting):
 
 
 class GcpSetting(CloudSetting):
+    device_type = "gcp"
+
     def __init__(
         self,
         project_id: str,
@@ -159,18 +329,32 @@ class GcpSetting(CloudSetting):
         device_id: str,
         options: dict = None,
         sa_path: str = None,
+        imsi: str = None,
+        clients: "CloudClients" = None,
     ):
-        # If service account is provided, use that
-        credentials: service_account.Credentials = None
-        if sa_path is not None:
-            credentials = service_account.Credentials.from_service_account_file(sa_path)
-
-        self.client = iot_v1.DeviceManagerClient(credentials=credentials)
+        self.__client: iot_v1.DeviceManagerClient = None
+        self.__clients = clients
         self.project_id = project_id
         self.region = region
         self.registry_id = registry_id
         self.device_id = device_id
         self.options = options
+        self.sa_path = sa_path
+        self.imsi = imsi
+
+    @property
+    def client(self) -> iot_v1.DeviceManagerClient:
+        """
+        Synchronous client, shared through `clients` if given, otherwise
+        created on first use
+        """
+        if self.__clients is not None:
+            return self.__clients.gcp(self.sa_path)
+        if self.__client is None:
+            self.__client = iot_v1.DeviceManagerClient(
+                credentials=_get_gcp_credentials(self.sa_path)
+            )
+        return self.__client
 
     def add(self):
         """
@@ -178,27 +362,183 @@ class GcpSetting(CloudSetting):
         """
 
         # Check if device is created or not
-        device = self.__get_device()
+        with span("gcp.get_device", kind=KIND_CLIENT, **self.__span_attributes()):
+            device = self.__get_device()
 
         try:
             if device is None:
-                return self.__create_device()
+                with span(
+                    "gcp.create_device", kind=KIND_CLIENT, **self.__span_attributes()
+                ):
+                    return self.__create_device()
             else:
-                return self.__update_device(device=device)
+                with span(
+                    "gcp.update_device", kind=KIND_CLIENT, **self.__span_attributes()
+                ):
+                    return self.__update_device(device=device)
         except Exception as ex:
             raise ex
 
+    async def add_async(self, clients: "GcpAsyncClients"):
+        """
+        Add GCP Device to GCP IoT with the async client shared by all settings
+        with the same service account
+        """
+        client = clients.get(self.sa_path)
+        loop = asyncio.get_running_loop()
+
+        # Check if device is created or not
+        with span("gcp.get_device", kind=KIND_CLIENT, **self.__span_attributes()):
+            try:
+                device = await hedged_async(
+                    "gcp.get_device",
+                    client.get_device,
+                    request=self.__get_device_request(),
+                    **self.__timeout("read"),
+                )
+            except Exception:
+                device = None
+
+        # Requests read the public key file, do not block the event loop with it
+        if device is None:
+            request = await loop.run_in_executor(None, self.__create_device_request)
+            with span(
+                "gcp.create_device", kind=KIND_CLIENT, **self.__span_attributes()
+            ):
+                return await client.create_device(
+                    request=request, **self.__timeout("write")
+                )
+        else:
+            request = await loop.run_in_executor(
+                None, self.__update_device_request, device
+            )
+            with span(
+                "gcp.update_device", kind=KIND_CLIENT, **self.__span_attributes()
+            ):
+                return await client.update_device(
+                    request=request, **self.__timeout("write")
+                )
+
     def get_info(self):
         """
         Get the information of the setting
         """
         return f"Cloud Service: GCP IoT, Device ID: {self.device_id}"
 
+    def get_target(self):
+        """
+        Get the IoT Core registry of the setting
+        """
+        return f"gcp:{self.project_id}/{self.region}/{self.registry_id}"
+
+    def get_yaml_settings(self):
+        settings = {} if self.sa_path is None else {"serviceAccount": self.sa_path}
+        settings["projectId"] = self.project_id
+        settings["region"] = self.region
+        settings["registryId"] = self.registry_id
+        return settings
+
+    def list_devices(self, page_size: int) -> Dict[str, Dict]:
+        """
+        List the devices of the registry with their credentials only, one
+        call per page
+        """
+        devices: Dict[str, Dict] = {}
+        request = {
+            "parent": iot_v1.DeviceManagerClient.registry_path(
+                self.project_id, self.region, self.registry_id
+            ),
+            "field_mask": gp_field_mask.FieldMask(paths=["credentials"]),
+            "page_size": page_size,
+        }
+        while True:
+            with span(
+                "gcp.list_devices",
+                kind=KIND_CLIENT,
+                **{"backend.target": self.get_target()},
+            ):
+                page = self.client.list_devices(
+                    request=request, **self.__timeout("read")
+                )
+            for device in page.devices:
+                devices[device.id] = {
+                    "keys": [
+                        f"{iot_v1.PublicKeyFormat(c.public_key.format).name}:"
+                        + get_key_fingerprint(c.public_key.key)
+                        for c in device.credentials
+                    ]
+                }
+            if not page.next_page_token:
+                return devices
+            request = {**request, "page_token": page.next_page_token}
+
+    def get_expected(self) -> Dict:
+        key_format = self.__get_key_format()
+        if key_format is None:
+            return {"keys": []}
+        return {
+            "keys": [
+                f"{key_format.name}:{get_key_fingerprint(self.__load_public_key())}"
+            ]
+        }
+
+    def __span_attributes(self):
+        return {"device.id": self.device_id, "backend.target": self.get_target()}
+
+    def __timeout(self, operation: Operation) -> Dict:
+        """
+        Timeout argument of a call, the client default is kept without shared
+        clients or timeouts
+        """
+        if self.__clients is None or self.__clients.timeouts is None:
+            return {}
+        return {"timeout": self.__clients.timeouts.get(operation).total}
+
     def __create_device(self):
         """
         Create GCP Device
         """
-        parent = self.client.registry_path(
+        return self.client.create_device(
+            request=self.__create_device_request(), **self.__timeout("write")
+        )
+
+    def __update_device(self, device: resources.Device):
+        """
+        Update GCP Device
+        """
+        return self.client.update_device(
+            request=self.__update_device_request(device=device),
+            **self.__timeout("write"),
+        )
+
+    def __get_device(self):
+        """
+        Check and get device is created in cloud
+        """
+        try:
+            return hedged(
+                "gcp.get_device",
+                self.client.get_device,
+                request=self.__get_device_request(),
+                **self.__timeout("read"),
+            )
+        except Exception:
+            return None
+
+    def __get_device_request(self):
+        """
+        Build the request to get GCP Device
+        """
+        device_path = iot_v1.DeviceManagerClient.device_path(
+            self.project_id, self.region, self.registry_id, self.device_id
+        )
+        return {"name": device_path}
+
+    def __create_device_request(self):
+        """
+        Build the request to create GCP Device
+        """
+        parent = iot_v1.DeviceManagerClient.registry_path(
             self.project_id, self.region, self.registry_id
         )
         device_template = {"id": self.device_id}
@@ -218,13 +558,11 @@ class GcpSetting(CloudSetting):
                 }
             ]
 
-        return self.client.create_device(
-            request={"parent": parent, "device": device_template}
-        )
+        return {"parent": parent, "device": device_template}
 
-    def __update_device(self, device: resources.Device):
+    def __update_device_request(self, device: resources.Device):
         """
-        Update GCP Device
+        Build the request to update GCP Device
         """
         # Get Key Format
         key_format = self.__get_key_format()
@@ -247,21 +585,7 @@ class GcpSetting(CloudSetting):
             device.num_id = 0
             device.credentials = None
 
-        return self.client.update_device(
-            request={"device": device, "update_mask": mask}
-        )
-
-    def __get_device(self):
-        """
-        Check and get device is created in cloud
-        """
-        try:
-            device_path = self.client.device_path(
-                self.project_id, self.region, self.registry_id, self.device_id
-            )
-            return self.client.get_device(request={"name": device_path})
-        except Exception:
-            return None
+        return {"device": device, "update_mask": mask}
 
     def __get_key_format(self):
         """
@@ -298,3 +622,118 @@ class GcpSetting(CloudSetting):
                 "Unable to load public key {}".format(self.options["public_key"])
             )
         return certificate
+
+
+def _get_host_name(connection_string: str) -> str:
+    """
+    Get the IoT Hub host name from the connection string
+    """
+    for part in connection_string.split(";"):
+        key, _, value = part.partition("=")
+        if key.strip() == "HostName":
+            return value.strip()
+    return connection_string
+
+
+def _get_gcp_credentials(sa_path: str = None) -> service_account.Credentials:
+    """
+    Load the service account if it is provided, otherwise use the default credentials
+    """
+    if sa_path is None:
+        return None
+    return service_account.Credentials.from_service_account_file(sa_path)
+
+
+class CloudClients:
+    def __init__(self, timeouts: Timeouts = None, calls=None):
+        """
+        Synchronous clients shared by all settings of a run, one per IoT Hub
+        connection string and one per GCP service account. With `calls`, a
+        `CallRecorder` or `CallReplayer`, their calls are recorded or replayed.
+        """
+        self.timeouts = timeouts
+        self.calls = calls
+        self.__azure: Dict[str, IoTHubRegistryManager] = {}
+        self.__gcp: Dict[str, iot_v1.DeviceManagerClient] = {}
+        self.__lock = Lock()
+
+    def azure(self, connection_string: str) -> IoTHubRegistryManager:
+        """
+        Get the registry manager of a connection string, created on first use
+        """
+        with self.__lock:
+            if connection_string not in self.__azure:
+                self.__azure[connection_string] = self.__wrap(
+                    "azure",
+                    lambda: self.__create_azure(connection_string),
+                    target=_get_host_name(connection_string),
+                )
+            return self.__azure[connection_string]
+
+    def gcp(self, sa_path: str = None) -> iot_v1.DeviceManagerClient:
+        """
+        Get the client of a service account, created on first use
+        """
+        with self.__lock:
+            if sa_path not in self.__gcp:
+                self.__gcp[sa_path] = self.__wrap(
+                    "gcp",
+                    lambda: iot_v1.DeviceManagerClient(
+                        credentials=_get_gcp_credentials(sa_path)
+                    ),
+                )
+            return self.__gcp[sa_path]
+
+    def __create_azure(self, connection_string: str) -> IoTHubRegistryManager:
+        manager = IoTHubRegistryManager(connection_string)
+        if self.timeouts is not None:
+            # The registry manager has no timeout per call, its calls
+            # wait as long as the slowest operation type
+            manager.protocol.config.connection.timeout = self.timeouts.get(
+                "write"
+            ).to_requests()
+        return manager
+
+    def __wrap(self, backend: str, create, target: str = None):
+        if self.calls is None:
+            return create()
+        return self.calls.wrap_client(backend, create, target=target)
+
+
+class GcpAsyncClients:
+    def __init__(self, calls=None):
+        """
+        Async clients of GCP IoT, one per service account. All requests of a
+        client are multiplexed over its single gRPC channel. The clients are
+        bound to the event loop they are created on, so `get` and `close` must
+        be called on that loop.
+        """
+        self.__clients: Dict[str, iot_v1.DeviceManagerAsyncClient] = {}
+        self.__calls = calls
+
+    def get(self, sa_path: str = None) -> iot_v1.DeviceManagerAsyncClient:
+        """
+        Get the client of a service account, created on first use
+        """
+        if sa_path not in self.__clients:
+
+            def create():
+                return iot_v1.DeviceManagerAsyncClient(
+                    credentials=_get_gcp_credentials(sa_path)
+                )
+
+            self.__clients[sa_path] = (
+                create()
+                if self.__calls is None
+                else self.__calls.wrap_client("gcp", create, is_async=True)
+            )
+        return self.__clients[sa_path]
+
+    async def close(self):
+        """
+        Close the gRPC channels of all clients
+        """
+        clients, self.__clients = list(self.__clients.values()), {}
+        for client in clients:
+            if client.transport is not None:
+                await client.transport.close()
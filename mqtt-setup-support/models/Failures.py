@@ -0,0 +1,105 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import json
+import os
+import yaml
+from threading import Lock
+from typing import Dict, List, Literal
+
+
+class RunFailures:
+    def __init__(self):
+        """
+        Failed and skipped entries of a run in the yaml format of the input,
+        grouped by the action to rerun them with and by their settings
+        """
+        self.__groups: Dict[str, Dict] = {}
+        self.__lock = Lock()
+
+    def add(self, kind: Literal["sim", "device", "authentication"], item):
+        """
+        Keep the entry of a failed item, `item` is the `UpdateSIMRecord`,
+        `CloudSetting` or authentication of the item
+        """
+        if kind == "sim":
+            for device_type, device_id in [
+                ("azure", item.azure_device_id),
+                ("gcp", item.gcp_device_id),
+            ]:
+                if device_id is not None:
+                    self.__add(
+                        "update-sims",
+                        device_type,
+                        {},
+                        "devices",
+                        {"imsi": item.imsi, "deviceId": device_id},
+                    )
+        elif kind == "device":
+            self.__add(
+                "add-devices",
+                item.device_type,
+                item.get_yaml_settings(),
+                "devices",
+                item.to_yaml(),
+            )
+        elif kind == "authentication":
+            self.__add(
+                "add-authentications",
+                item.device_type,
+                item.get_yaml_settings(),
+                "authentications",
+                item.to_yaml(),
+            )
+        else:
+            raise Exception(f"Unknown kind {kind}")
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return sum(len(group["entries"]) for group in self.__groups.values())
+
+    def write(self, directory: str) -> List[str]:
+        """
+        Write one yaml file per group, named `<action>-<type>-<n>.yaml`, and
+        return the file names
+        """
+        os.makedirs(directory, exist_ok=True)
+        with self.__lock:
+            groups = list(self.__groups.values())
+
+        filenames: List[str] = []
+        counts: Dict[str, int] = {}
+        for group in groups:
+            prefix = f"{group['action']}-{group['type']}"
+            counts[prefix] = counts.get(prefix, 0) + 1
+            filename = os.path.join(directory, f"{prefix}-{counts[prefix]}.yaml")
+            content = {
+                group["type"]
+                + "Settings": {**group["settings"], group["section"]: group["entries"]}
+            }
+            with open(filename, "w") as f:
+                yaml.safe_dump(content, f, sort_keys=False, allow_unicode=True)
+            filenames.append(filename)
+        return filenames
+
+    def __add(
+        self,
+        action: str,
+        device_type: str,
+        settings: Dict,
+        section: Literal["devices", "authentications"],
+        entry: Dict,
+    ):
+        key = json.dumps([action, device_type, settings], sort_keys=True)
+        with self.__lock:
+            if key not in self.__groups:
+                self.__groups[key] = {
+                    "action": action,
+                    "type": device_type,
+                    "settings": settings,
+                    "section": section,
+                    "entries": [],
+                }
+            self.__groups[key]["entries"].append(entry)
@@ -0,0 +1,177 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import yaml
+from libs.Profiler import phase
+from libs.Validator import ValidationError, Validator
+from models.DeviceTable import DeviceTable
+from typing import Dict, List, Literal, Optional, Set, Tuple
+
+
+Section = Literal["sims", "devices", "groups", "authentications"]
+
+# Sections of the input files read by each action
+SECTIONS: Dict[str, Set[Section]] = {
+    "update-sims": {"sims", "groups"},
+    "add-devices": {"devices"},
+    "add-authentications": {"authentications"},
+    "apply": {"sims", "devices", "groups", "authentications"},
+    "watch": {"sims", "devices", "groups", "authentications"},
+    "verify": {"sims", "devices", "groups", "authentications"},
+}
+
+# Version of the parsed entries in the cache, bump it when they change
+CACHE_FORMAT = 3
+
+# Keys of the settings block kept for the cloud settings of the devices
+SETTING_KEYS = {
+    "azure": ["connectionString"],
+    "gcp": ["projectId", "region", "registryId", "serviceAccount"],
+}
+
+
+def get_file_type(content) -> str:
+    """
+    Check and get the cloud type of a loaded yaml file
+    """
+    if "azureSettings" in content:
+        return "azure"
+    elif "gcpSettings" in content:
+        return "gcp"
+    else:
+        raise Exception("Invalid yaml format")
+
+
+def merge_options(
+    global_options: List[dict], device_options: List[dict] = None
+) -> Dict:
+    """
+    Merge global options and device options, the device options win
+    """
+    option_dict = {}
+
+    with phase("option merge"):
+        if global_options is not None:
+            for option in global_options:
+                option_dict[option["name"]] = option["value"]
+
+        if device_options is not None:
+            for option in device_options:
+                option_dict[option["name"]] = option["value"]
+
+    return option_dict
+
+
+class InputFile:
+    def __init__(
+        self,
+        device_type: str,
+        settings: Dict = None,
+        sims: List[Tuple] = None,
+        devices: DeviceTable = None,
+        groups: List[Dict] = None,
+        authentications: List[Dict] = None,
+    ):
+        """
+        The entries of one yaml file read by an action, without the yaml tree:
+
+        - `sims`, the `(imsi, deviceId)` pairs of the devices
+        - `devices`, the table of the `(deviceId, imsi, options)` of the
+          devices with their merged options
+        - `groups` and `authentications`, the entries as in the file, GCP
+          authentications with the registry of the file
+        """
+        self.device_type = device_type
+        self.settings = settings or {}
+        self.sims = sims or []
+        self.devices = devices if devices is not None else DeviceTable()
+        self.groups = groups or []
+        self.authentications = authentications or []
+
+    @staticmethod
+    def load(
+        filename: str, sections: Set[Section], action: str = None
+    ) -> Tuple[List[ValidationError], Optional["InputFile"]]:
+        """
+        Read a yaml file, used by the parsing processes. With an action, the
+        file is validated for it while it is parsed, and its entries are None
+        if it has errors.
+        """
+        if action is not None:
+            errors, content = Validator(action).load_file(filename)
+            if errors:
+                return errors, None
+        else:
+            with open(filename, "r") as yml:
+                try:
+                    content = yaml.safe_load(yml)
+                except yaml.YAMLError as ex:
+                    # Errors with marks cannot be sent back from a process
+                    raise Exception(str(ex))
+        return [], InputFile.parse(content, sections)
+
+    @staticmethod
+    def parse(content, sections: Set[Section]) -> "InputFile":
+        """
+        Take the given sections of a loaded yaml file
+        """
+        device_type = get_file_type(content)
+        yml_settings: Dict = content[device_type + "Settings"]
+        devices: List[dict] = yml_settings.get("devices") or []
+
+        sims: List[Tuple] = None
+        if "sims" in sections:
+            sims = [(device["imsi"], device["deviceId"]) for device in devices]
+
+        device_table: DeviceTable = None
+        if "devices" in sections:
+            options: List[dict] = yml_settings.get("options", [])
+            device_table = DeviceTable(merge_options(options))
+            for device in devices:
+                device_table.append(
+                    device["deviceId"],
+                    device.get("imsi"),
+                    None
+                    if "options" not in device
+                    else merge_options(options, device["options"]),
+                )
+
+        groups: List[Dict] = None
+        if "groups" in sections:
+            groups = list(yml_settings.get("groups") or [])
+
+        authentications: List[Dict] = None
+        if "authentications" in sections:
+            authentications = []
+            for auth in yml_settings.get("authentications") or []:
+                auth = dict(auth)
+                if device_type == "gcp":
+                    auth["projectId"] = yml_settings["projectId"]
+                    auth["region"] = yml_settings["region"]
+                    auth["registryId"] = yml_settings["registryId"]
+                authentications.append(auth)
+
+        return InputFile(
+            device_type,
+            settings={
+                key: yml_settings[key]
+                for key in SETTING_KEYS[device_type]
+                if key in yml_settings
+            },
+            sims=sims,
+            devices=device_table,
+            groups=groups,
+            authentications=authentications,
+        )
+
+    def get_setting(self, key: str) -> Optional[str]:
+        """
+        Get a key of the settings block, raise if a required one is missing
+        """
+        if key == "serviceAccount":
+            return self.settings.get(key)
+        if key not in self.settings:
+            raise Exception(f"{self.device_type}Settings has no {key}")
+        return self.settings[key]
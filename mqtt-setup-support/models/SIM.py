@@ -4,16 +4,52 @@
 ## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
 
 import json
-from typing import List
+from typing import Dict, List, Optional
+
+
+# Fields of a SIM that can be updated
+UPDATE_FIELDS = [
+    "imei",
+    "msisdn",
+    "deviceName",
+    "groupId",
+    "systemId",
+    "mqttClientId",
+    "azureDeviceId",
+    "gcpDeviceId",
+    "optionData1",
+    "optionData2",
+    "optionData3",
+]
+
+
+def get_changed_fields(sim: Dict, fields: Dict) -> Dict:
+    """
+    Get the given fields that differ from the fields of a SIM. None is not set
+    and an empty string clears a field, an empty field and a missing field are
+    the same.
+    """
+    return {
+        field: value
+        for field, value in fields.items()
+        if value is not None and (value or None) != (sim.get(field) or None)
+    }
 
 
 class UpdateSIMRecord:
     def __init__(
-        self, imsi: str, azure_device_id: str = None, gcp_device_id: str = None
+        self,
+        imsi: str,
+        azure_device_id: str = None,
+        gcp_device_id: str = None,
+        error: str = None,
     ):
         self.imsi = imsi
         self.azure_device_id = azure_device_id
         self.gcp_device_id = gcp_device_id
+        # Why the record cannot be applied, e.g. the device ID template of its group
+        # does not fit the SIM
+        self.error = error
 
     def toJSON(self):
         return json.dumps(self, default=lambda o: o.__dict__, sort_keys=True, indent=4)
@@ -69,6 +105,21 @@ class SIM:
             optionData3=self.optionData3,
         )
 
+    def get_update_request(self, **fields) -> Optional["UpdateSIMRequest"]:
+        """
+        Get the request setting the given fields with only the fields that
+        differ from the SIM, fields of other systems are left as they are.
+        None is not set and an empty string clears a field. Return None if
+        nothing changes.
+        """
+        for field in fields:
+            if field not in UPDATE_FIELDS:
+                raise Exception(f"Cannot update {field} of a SIM")
+        changes = get_changed_fields(vars(self), fields)
+        if not changes:
+            return None
+        return UpdateSIMRequest(**changes)
+
     def toJSON(self):
         return json.dumps(self, default=lambda o: o.__dict__, sort_keys=True, indent=4)
 
@@ -101,5 +152,11 @@ class UpdateSIMRequest:
         self.optionData3 = optionData3
 
     def toJSON(self):
-        original = json.loads(json.dumps(self, default=lambda o: o.__dict__))
-        return json.dumps({k: v for k, v in original.items() if v is not None})
+        # Unset fields are left out, empty strings clear the field
+        return json.dumps(
+            {
+                k: (None if v == "" else v)
+                for k, v in vars(self).items()
+                if v is not None
+            }
+        )
@@ -0,0 +1,105 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import json
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Dict, List, Literal
+
+
+class RunSummary:
+    def __init__(
+        self,
+        action: str = "",
+        shards: List[str] = None,
+        succeeded: int = 0,
+        failed: int = 0,
+        skipped: int = 0,
+        failures: List[Dict] = None,
+        startedAt: str = None,
+        finishedAt: str = None,
+    ):
+        self.action = action
+        self.shards = shards if shards is not None else []
+        self.succeeded = succeeded
+        self.failed = failed
+        self.skipped = skipped
+        self.failures = failures if failures is not None else []
+        self.startedAt = startedAt or self.__now()
+        self.finishedAt = finishedAt
+        self.__lock = Lock()
+
+    def add(
+        self,
+        kind: Literal["sim", "device", "authentication"],
+        key: str,
+        status: Literal["succeeded", "failed", "skipped"],
+        error: str = None,
+    ):
+        """
+        Count the result of one item, failed and skipped items are kept with their error
+        """
+        with self.__lock:
+            setattr(self, status, getattr(self, status) + 1)
+            if status != "succeeded":
+                self.failures.append(
+                    {"kind": kind, "key": str(key), "status": status, "error": error}
+                )
+
+    def finish(self):
+        self.finishedAt = self.__now()
+        return self
+
+    def get_info(self) -> str:
+        return (
+            f"{self.succeeded} succeeded, {self.failed} failed, {self.skipped} skipped."
+        )
+
+    def to_dict(self) -> Dict:
+        with self.__lock:
+            return {
+                "action": self.action,
+                "shards": list(self.shards),
+                "startedAt": self.startedAt,
+                "finishedAt": self.finishedAt,
+                "succeeded": self.succeeded,
+                "failed": self.failed,
+                "skipped": self.skipped,
+                "failures": list(self.failures),
+            }
+
+    def toJSON(self) -> str:
+        return json.dumps(self.to_dict(), indent=4)
+
+    @staticmethod
+    def load(filename: str):
+        """
+        Load a summary written by `toJSON`
+        """
+        with open(filename, "r") as f:
+            return RunSummary(**json.load(f))
+
+    @staticmethod
+    def merge(summaries: List["RunSummary"]):
+        """
+        Combine the summaries of the shards of one run
+        """
+        actions = sorted({s.action for s in summaries})
+        merged = RunSummary(
+            action=actions[0] if len(actions) == 1 else ",".join(actions),
+            shards=sorted({shard for s in summaries for shard in s.shards}),
+            startedAt=min(s.startedAt for s in summaries),
+        )
+        for s in summaries:
+            merged.succeeded += s.succeeded
+            merged.failed += s.failed
+            merged.skipped += s.skipped
+            merged.failures += s.failures
+        finished = [s.finishedAt for s in summaries if s.finishedAt]
+        merged.finishedAt = max(finished) if finished else None
+        return merged
+
+    def __now(self) -> str:
+        return datetime.now(timezone.utc).isoformat()
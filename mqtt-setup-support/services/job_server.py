@@ -0,0 +1,133 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import json
+import os
+import socketserver
+import stat
+import time
+from threading import Event, Lock, Thread
+from typing import Dict
+from models.Summary import RunSummary
+from services.main_service import MainService, log
+
+
+# Actions a job can run, `watch` never returns
+JOB_ACTIONS = [
+    "update-sims",
+    "add-devices",
+    "add-authentications",
+    "apply",
+    "snapshot",
+    "verify",
+]
+
+
+class JobServer:
+    def __init__(self, service: MainService, path: str):
+        """
+        Run jobs of a long-lived service sent over a local Unix socket, so the
+        SDP token, the HTTP pool and the cloud clients stay warm between jobs.
+
+        A client sends one JSON object per line, e.g.
+        `{"id": 1, "action": "apply", "files": ["devices.yaml"]}`, and gets one
+        JSON line back, `{"id": 1, "ok": true, "result": {...}}` or
+        `{"id": 1, "ok": false, "error": "..."}`. Jobs run one at a time, in
+        the order they arrive.
+        """
+        self.service = service
+        self.path = path
+        self.__lock = Lock()
+
+    def serve(self, stop: Event = None):
+        """
+        Accept jobs until `stop` is set or the process is interrupted
+        """
+        stop = stop if stop is not None else Event()
+
+        # A socket left by a server that was killed
+        if os.path.exists(self.path) and stat.S_ISSOCK(os.stat(self.path).st_mode):
+            os.remove(self.path)
+
+        server = _UnixServer(self.path, _JobHandler)
+        server.jobs = self
+        # Only the user of the server can send jobs
+        os.chmod(self.path, 0o600)
+        thread = Thread(target=server.serve_forever, name="server", daemon=True)
+        thread.start()
+
+        log.info(f"Serving jobs on {self.path}...")
+        try:
+            while not stop.wait(1.0):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+            os.remove(self.path)
+        log.info("Stopped serving.")
+
+    def handle(self, request) -> Dict:
+        """
+        Run the job of a request and return the reply
+        """
+        started = time.perf_counter()
+        reply: Dict = {}
+        try:
+            if not isinstance(request, dict):
+                raise Exception("A job must be a JSON object")
+            if "id" in request:
+                reply["id"] = request["id"]
+
+            action = request.get("action")
+            if action == "ping":
+                result = None
+            elif action in JOB_ACTIONS:
+                files = request.get("files")
+                if (
+                    not isinstance(files, list)
+                    or not files
+                    or not all(isinstance(f, str) for f in files)
+                ):
+                    raise Exception("files must be a list of file paths")
+                with self.__lock:
+                    result = self.service.run(action, *files)
+            else:
+                raise Exception(
+                    f"Invalid action {action}, valid actions: "
+                    + ", ".join(f"'{a}'" for a in ["ping", *JOB_ACTIONS])
+                )
+
+            reply["ok"] = True
+            reply["result"] = (
+                result.to_dict() if isinstance(result, RunSummary) else result
+            )
+        except Exception as ex:
+            reply["ok"] = False
+            reply["error"] = str(ex)
+        reply["elapsedMs"] = round((time.perf_counter() - started) * 1000, 1)
+        return reply
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    jobs: JobServer = None
+
+
+class _JobHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as ex:
+                reply = {"ok": False, "error": f"Invalid JSON: {ex}"}
+            else:
+                reply = self.server.jobs.handle(request)
+            self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+            self.wfile.flush()
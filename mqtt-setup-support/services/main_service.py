@@ -3,315 +3,1514 @@
 ## This software is released under the MIT License.
 ## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
 
-from typing import Dict, List
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from string import Formatter
+from threading import Event, Lock
+from typing import Deque, Dict, Iterator, List, Optional, Set, Tuple, Union
+from libs.CircuitBreaker import BreakerPolicy, CircuitBreaker, State
+from libs.FileCache import FileCache
+from libs.Hedger import Hedger, set_hedger
+from libs.Recording import CallRecorder, CallReplayer
 from libs.SDP import SDP
-from models.Devices import AzureSetting, CloudSetting, GcpSetting
-from models.SIM import SIM, UpdateSIMRecord
-from models.Authentications import AzureAuthentication, GCPAuthentication
-from settings import SDP_API_HOST, SDP_API_KEY, SDP_API_SECRET, SDP_API_TENANT_ID
+from libs.Scheduler import BackendLimit, Scheduler
+from libs.Shard import Shard
+from libs.Snapshot import Snapshot
+from libs.Timeouts import Timeouts
+from libs.Profiler import phase
+from libs.Progress import Progress
+from libs.Tracer import span
+from libs.Validator import ValidationError, Validator
+from models.Devices import (
+    AzureSetting,
+    CloudClients,
+    CloudSetting,
+    GcpAsyncClients,
+    GcpSetting,
+)
+from models.SIM import SIM, UpdateSIMRecord, get_changed_fields
+from models.Authentications import (
+    AzureAuthentication,
+    GCPAuthentication,
+    get_index_key,
+)
+from models.Credentials import SDPCredentials
+from models.Failures import RunFailures
+from models.InputFile import CACHE_FORMAT, SECTIONS, InputFile, get_file_type
+from models.Summary import RunSummary
+import hashlib
+import json
 import logging
+import multiprocessing
+import os
+import time
 import yaml
 
+# Workers only put the records on a queue, a listener thread writes them
 stream = logging.StreamHandler()
 stream.setLevel(logging.INFO)
+log_queue = SimpleQueue()
+log_listener = QueueListener(log_queue, stream, respect_handler_level=True)
 log = logging.getLogger("pythonConfig")
 log.setLevel(logging.INFO)
-log.addHandler(stream)
+log.addHandler(QueueHandler(log_queue))
+
+_log_listener_users = 0
+_log_listener_lock = Lock()
+
+
+def _start_log_listener():
+    """
+    Start writing the queued log records, the listener is shared by all services
+    """
+    global _log_listener_users
+    with _log_listener_lock:
+        if _log_listener_users == 0:
+            log_listener.start()
+        _log_listener_users += 1
+
+
+def _stop_log_listener():
+    """
+    Stop the listener after the last service is closed, queued records are written first
+    """
+    global _log_listener_users
+    with _log_listener_lock:
+        _log_listener_users -= 1
+        if _log_listener_users == 0:
+            log_listener.stop()
+
+
+# Devices queued or running at the same time while `add-devices` reads the files
+DEVICE_BUFFER_SIZE = 1000
+
+# Page size of the authentications listed to skip existing ones
+AUTHENTICATION_PAGE_SIZE = 100
+
+# Seconds a SDP token is reused by the next actions of the same service, e.g.
+# the changes of `watch` or the jobs of `serve`
+TOKEN_LIFETIME = 600
+
+# Page size of the SIMs and groups listed from the SDP API
+LISTING_PAGE_SIZE = 100
+
+# Page size of the devices listed from the IoT Hubs and registries by `verify`
+DEVICE_PAGE_SIZE = 100
 
 
 class MainService:
-    def __init__(self) -> None:
-        self.sdp = SDP(endpoint=SDP_API_HOST)
+    def __init__(
+        self,
+        limits: Dict[str, BackendLimit] = None,
+        gcp_async: bool = False,
+        shard: Shard = None,
+        progress: bool = False,
+        quiet: bool = False,
+        failures_dir: str = None,
+        skip_existing: bool = False,
+        snapshot: str = None,
+        dry_run: bool = False,
+        validate: bool = True,
+        timeouts: Timeouts = None,
+        hedge: float = None,
+        parse_workers: int = None,
+        cache: FileCache = None,
+        credentials: SDPCredentials = None,
+        calls: Union[CallRecorder, CallReplayer] = None,
+        breaker: BreakerPolicy = None,
+    ) -> None:
+        self.credentials = (
+            credentials if credentials is not None else SDPCredentials.from_env()
+        )
+        self.scheduler = Scheduler(limits=limits, breaker=breaker)
+        self.scheduler.add_breaker_listener(self.__on_breaker_state)
+        self.gcp_async = gcp_async
+        self.timeouts = timeouts if timeouts is not None else Timeouts()
+        self.calls = calls
+        self.cloud_clients = CloudClients(timeouts=self.timeouts, calls=calls)
+        self.gcp_clients = GcpAsyncClients(calls=calls)
+        self.scheduler.add_shutdown_hook(self.gcp_clients.close)
+        self.shard = shard
+        self.sdp = SDP(
+            endpoint=self.credentials.host,
+            pool_size=self.scheduler.get_limit(self.__sdp_target()).concurrency,
+            timeouts=self.timeouts,
+        )
+        if calls is not None:
+            self.sdp.transport = calls.wrap_transport(self.sdp.transport)
+
+        # At most one second attempt per running call
+        self.hedger: Hedger = None
+        if hedge is not None:
+            self.hedger = Hedger(
+                percentile=hedge,
+                max_workers=2
+                * sum(
+                    self.scheduler.get_limit(kind).concurrency
+                    for kind in ["sdp", "azure", "gcp"]
+                ),
+            )
+            set_hedger(self.hedger)
+        self.show_progress = progress
+        self.progress: Progress = None
+        self.failures_dir = failures_dir
+        self.failures: RunFailures = None
+        self.skip_existing = skip_existing
+        self.snapshot = snapshot
+        self.dry_run = dry_run
+        self.validate = validate
+        self.parse_workers = (
+            parse_workers if parse_workers is not None else os.cpu_count() or 1
+        )
+        self.cache = cache
+        if dry_run and snapshot is None:
+            raise Exception("A dry run needs a snapshot")
+        self.__closed = False
+        self.__token_generated_at: float = None
+
+        # Only warnings and errors are written in quiet mode, log lines clear
+        # the progress line before they are written on a terminal
+        stream.setLevel(logging.WARNING if quiet else logging.INFO)
+        stream.setFormatter(
+            logging.Formatter(
+                "\r\033[K%(message)s"
+                if progress and stream.stream.isatty()
+                else "%(message)s"
+            )
+        )
+        _start_log_listener()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Stop the worker threads and the event loop of the scheduler, then
+        write the queued log records
+        """
+        if self.__closed:
+            return
+        self.__closed = True
+        self.scheduler.shutdown()
+        if self.hedger is not None:
+            set_hedger(None)
+            self.hedger.shutdown()
+        _stop_log_listener()
 
     def batch_update_sims(self, *args):
         """
         Batch update SIMs with adding `azureDeviceId` and `gcpDeviceId` to current SIM records.
         """
 
-        # Generate Token as SDP API is needed
-        self.sdp.generate_token(
-            name=SDP_API_KEY, password=SDP_API_SECRET, tenant_id=SDP_API_TENANT_ID
-        )
+        # Load data from given yaml files, they are validated before any API call
+        data = {
+            imsi: record
+            for imsi, record in self.__load_batch_update_sims_from_files(*args).items()
+            if self.__in_shard(imsi)
+        }
 
-        # Load data from given yaml files
-        data = self.__load_batch_update_sims_from_files(*args)
+        # Generate Token as SDP API is needed
+        self.__generate_token()
+
+        summary = self.__create_summary("update-sims", total=len(data))
+
+        # Check the records against the snapshot first, only the SIMs that
+        # exist and would change are sent to the API
+        if self.snapshot is not None:
+            with Snapshot(self.snapshot) as snapshot:
+                data = {
+                    imsi: update_record
+                    for imsi, update_record in data.items()
+                    if self.__check_sim_in_snapshot(
+                        snapshot, imsi, update_record, summary
+                    )
+                }
 
         # Loop all IMSI
-        for imsi, update_record in data.items():
+        with self.scheduler.group() as group:
+            for imsi, update_record in data.items():
+                group.submit(
+                    self.__sdp_target(),
+                    self.__update_sim,
+                    imsi,
+                    update_record,
+                    summary,
+                )
 
-            try:
-                # Get the SIM object from API
-                sim = SIM(**self.sdp.get_sim(imsi=imsi))
+        return self.__finish_summary(summary)
 
-                # Set azure if it is set in yaml
-                if update_record.azure_device_id is not None:
-                    sim.azureDeviceId = update_record.azure_device_id
+    def snapshot_sims(self, filename: str) -> Dict[str, Dict[str, int]]:
+        """
+        Save all SIMs and groups of the tenant to a local SQLite file. An
+        existing file is refreshed, only changed rows are written.
+        """
 
-                # Set gcp if it is set in yaml
-                if update_record.gcp_device_id is not None:
-                    sim.gcpDeviceId = update_record.gcp_device_id
+        # Generate Token as SDP API is needed
+        self.__generate_token()
 
-                # Update SIM by API
-                res = self.sdp.update_sim(imsi=imsi, req=sim.to_update_request())
+        groups = self.__list_all(self.sdp.get_groups, "groups", LISTING_PAGE_SIZE)
+        sims = self.__list_all(self.sdp.get_sims, "sims", LISTING_PAGE_SIZE)
 
-                log.info(f"[\033[92m SUCCESS \033[0m] IMSI [{imsi}].")
-            except Exception as e:
-                log.error(f"[\033[91m FAILED \033[0m] IMSI [{imsi}]. Response: {e}")
+        with Snapshot(filename) as snapshot:
+            counts = {
+                "groups": snapshot.refresh_groups(groups),
+                "sims": snapshot.refresh_sims(sims),
+            }
+
+        for name, count in counts.items():
+            log.info(
+                f"Snapshot {name}: {count['added']} added, {count['changed']} changed, "
+                f"{count['removed']} removed, {count['unchanged']} unchanged."
+            )
+        return counts
 
     def add_authentications(self, *args):
         """
         Add authentications for Azure IoT and GCP IoT services.
         """
 
+        # Load data from given yaml files, they are validated before any API call
+        auths = [
+            auth
+            for auth in self.__load_batch_create_authentications_from_files(*args)
+            if self.__in_shard(auth.name)
+        ]
+
         # Generate Token as SDP API is needed
-        self.sdp.generate_token(
-            name=SDP_API_KEY, password=SDP_API_SECRET, tenant_id=SDP_API_TENANT_ID
-        )
+        self.__generate_token()
 
-        # Load data from given yaml files
-        auths = self.__load_batch_create_authentications_from_files(*args)
+        summary = self.__create_summary("add-authentications", total=len(auths))
 
         # Loop all Authentications
-        for auth in auths:
-            try:
-                res = self.sdp.create_authentication(req=auth.to_create_request())
-                log.info(
-                    f"[\033[92m SUCCESS \033[0m] Add Authentication [{res['name']}]."
-                )
-            except Exception as e:
-                log.error(
-                    f"[\033[91m FAILED \033[0m] Add Authentication [{res['name']}]. Response: {e}"
-                )
+        with self.scheduler.group() as group:
+            self.__submit_authentications(group, auths, summary)
+
+        return self.__finish_summary(summary)
 
     def add_devices(self, *args):
         """
         Add devices to Azure IoT and GCP IoT services.
+
+        Devices are streamed from the files to the workers, a setting is only
+        built when there is room in the buffer, so the memory does not grow with
+        the number of devices and the first device is added right away.
         """
 
-        try:
-            settings = self.__load_add_devices_from_files(*args)
+        self.__validate("add-devices", args)
 
-            for s in settings:
+        summary = self.__create_summary("add-devices")
+
+        # A broken file stops the run like the other actions, devices of the
+        # files before it have been added already
+        with self.scheduler.group(max_pending=DEVICE_BUFFER_SIZE) as group:
+            for s in self.__iter_add_devices_from_files(*args):
+                if self.__in_shard(self.__get_device_key(s)):
+                    group.submit(s.get_target(), self.__get_add_device(s), s, summary)
+
+        return self.__finish_summary(summary)
+
+    def apply(self, *args):
+        """
+        Add devices, update SIMs and add authentications from given yaml files in one run.
+
+        Each file is read once. A SIM is only updated after every cloud device with
+        the same IMSI has been added, authentications do not depend on anything.
+        SDP calls and cloud calls run on separate queues of the scheduler.
+        """
+
+        # Load all data from given yaml files at once, devices and SIMs are
+        # sharded by IMSI so a SIM is in the same shard as its devices
+        files = self.__load_files(args, "apply")
+
+        # Generate Token as SDP API is needed
+        self.__generate_token()
+
+        settings = [
+            s
+            for s in self.__load_add_devices_from_inputs(files)
+            if self.__in_shard(self.__get_device_key(s))
+        ]
+        records = {
+            imsi: record
+            for imsi, record in self.__load_batch_update_sims_from_inputs(files).items()
+            if self.__in_shard(imsi)
+        }
+        auths = [
+            auth
+            for auth in self.__load_batch_create_authentications_from_inputs(files)
+            if self.__in_shard(auth.name)
+        ]
+
+        return self.__apply("apply", settings, records, auths)
+
+    def verify(self, *args):
+        """
+        Compare the SIMs, cloud devices and authentications of given yaml files
+        with the live state and report the drift, nothing is changed.
+
+        The live state is read with paged listings instead of one read per
+        entry: all SIMs of the tenant, all devices of every IoT Hub and
+        registry in the files, and the authentications of the types in the
+        files. An entry that drifts fails, so `--failures` writes the entries
+        to rerun.
+        """
+
+        files = self.__load_files(args, "verify")
+
+        # Generate Token as SDP API is needed
+        self.__generate_token()
+
+        settings = [
+            s
+            for s in self.__load_add_devices_from_inputs(files)
+            if self.__in_shard(self.__get_device_key(s))
+        ]
+        records = {
+            imsi: record
+            for imsi, record in self.__load_batch_update_sims_from_inputs(files).items()
+            if self.__in_shard(imsi)
+        }
+        auths = [
+            auth
+            for auth in self.__load_batch_create_authentications_from_inputs(files)
+            if self.__in_shard(auth.name)
+        ]
+
+        summary = self.__create_summary(
+            "verify", total=len(settings) + len(records) + len(auths)
+        )
+
+        # Every IoT Hub and registry is listed once, all of them concurrently
+        targets: Dict[str, CloudSetting] = {}
+        for setting in settings:
+            targets.setdefault(setting.get_target(), setting)
+        with self.scheduler.group() as group:
+            listings = {
+                target: group.submit(target, self.__list_target_devices, setting)
+                for target, setting in targets.items()
+            }
+
+        sims: Dict[str, Dict] = {}
+        if records:
+            sims = {
+                str(sim["imsi"]): sim
+                for sim in self.__list_all(self.sdp.get_sims, "sims", LISTING_PAGE_SIZE)
+            }
+        existing = self.__index_authentications(auths) if auths else set()
+
+        for setting in settings:
+            devices, error = listings[setting.get_target()].result()
+            if error is None:
                 try:
-                    res = s.add()
-                    log.info(f"[\033[92m SUCCESS \033[0m] Add Device [{s.get_info()}].")
+                    drift = setting.get_drift(devices.get(setting.device_id))
                 except Exception as e:
-                    log.error(
-                        f"[\033[91m FAILED \033[0m] Add Device [{s.get_info()}]. Response: {e}"
-                    )
-        except Exception as e:
-            log.error(f"[\033[91m FAILED \033[0m] Fatal Error: {e}")
+                    error = str(e)
+            self.__report_drift(
+                summary,
+                "device",
+                f"{setting.get_target()}/{setting.device_id}",
+                setting,
+                f"Device [{setting.get_info()}]",
+                None if error is not None else drift,
+                error,
+            )
 
-    # PRIVATE FUNCTIONS
+        for imsi, record in records.items():
+            sim = sims.get(str(imsi))
+            self.__report_drift(
+                summary,
+                "sim",
+                imsi,
+                record,
+                f"IMSI [{imsi}]",
+                ["Not found"] if sim is None else self.__get_sim_changes(sim, record),
+                record.error,
+            )
 
-    def __load_batch_update_sims_from_files(self, *args):
+        for auth in auths:
+            self.__report_drift(
+                summary,
+                "authentication",
+                auth.name,
+                auth,
+                f"Authentication [{auth.name}]",
+                [] if auth.get_index_key() in existing else ["Not found"],
+            )
+
+        return self.__finish_summary(summary)
+
+    def watch(self, *args, interval: float = 2.0, stop: Event = None) -> RunSummary:
         """
-        Load update records from given yaml files
+        Watch given yaml files or directories of yaml files and apply the
+        entries that changed since the last pass, until `stop` is set or the
+        process is interrupted.
+
+        Every entry (device, SIM, authentication) is kept with a hash of its
+        content, the first pass applies all of them. Entries that failed are
+        applied again on the next change. The SDP token, the HTTP pool and the
+        cloud clients are kept between changes.
         """
-        data: Dict[str, UpdateSIMRecord] = {}
+        stop = stop if stop is not None else Event()
+        state: Dict[str, Dict[str, str]] = {
+            "device": {},
+            "sim": {},
+            "authentication": {},
+        }
+        stamps: Dict[str, Tuple[int, int]] = {}
+        files: Dict[str, InputFile] = {}
+        summaries: List[RunSummary] = []
+
+        log.info(f"Watching {', '.join(args)}...")
+        while True:
+            if self.__reload_changed_files(args, stamps, files):
+                self.__generate_token()
+                summary = self.__apply_changes(list(files.values()), state)
+                if summary is not None:
+                    summaries.append(summary)
 
-        for filename in args:
-            (device_type, res) = self.__load_device_id_from_yaml(filename=filename)
+            try:
+                if stop.wait(interval):
+                    break
+            except KeyboardInterrupt:
+                break
 
-            for imsi, device_id in res.items():
-                if not imsi in data.keys():
-                    rec = UpdateSIMRecord(imsi=imsi)
-                    data[imsi] = rec
+        log.info("Stopped watching.")
 
-                if device_type == "azure":
-                    data[imsi].azure_device_id = device_id
-                elif device_type == "gcp":
-                    data[imsi].gcp_device_id = device_id
+        if not summaries:
+            return self.__create_summary("watch").finish()
+        return RunSummary.merge(summaries)
 
-        return data
+    def run(self, action: str, *args, interval: float = 2.0):
+        """
+        Run an action on given files like main.py does and return its result,
+        the summary of the run or the counts of `snapshot`. Errors are raised,
+        the service can be used for more actions afterwards.
+        """
+        if action == "update-sims":
+            return self.batch_update_sims(*args)
+        if action == "add-devices":
+            return self.add_devices(*args)
+        if action == "add-authentications":
+            return self.add_authentications(*args)
+        if action == "apply":
+            return self.apply(*args)
+        if action == "snapshot":
+            return self.snapshot_sims(args[0])
+        if action == "verify":
+            return self.verify(*args)
+        if action == "watch":
+            return self.watch(*args, interval=interval)
+        raise Exception(f"Invalid action {action}")
 
-    def __load_device_id_from_yaml(self, filename):
+    # PRIVATE FUNCTIONS
+
+    def __apply(
+        self,
+        action: str,
+        settings: List[CloudSetting],
+        records: Dict[str, UpdateSIMRecord],
+        auths: List,
+    ) -> RunSummary:
         """
-        Load a given yaml file and return the imsi-deviceName dictionary
+        Add the devices, update the SIMs after their devices and add the
+        authentications
         """
-        res = {}
-        with open(filename, "r") as yml:
-            yml_content = yaml.safe_load(yml)
+        summary = self.__create_summary(
+            action, total=len(settings) + len(records) + len(auths)
+        )
 
-        device_type: str = self.__get_yaml_file_type(yml_content)
+        # Count the devices each SIM update has to wait for
+        waiting: Dict[str, int] = {}
+        for s in settings:
+            if s.imsi in records:
+                waiting[s.imsi] = waiting.get(s.imsi, 0) + 1
+        blocked = set()
+        lock = Lock()
 
-        devices = yml_content[device_type + "Settings"]["devices"]
+        group = self.scheduler.group()
 
-        for device in devices:
-            res[device["imsi"]] = device["deviceId"]
+        def on_device_added(setting: CloudSetting, success: bool):
+            if setting.imsi not in waiting:
+                return
 
-        return device_type, res
+            with lock:
+                waiting[setting.imsi] -= 1
+                if not success:
+                    blocked.add(setting.imsi)
+                ready = waiting[setting.imsi] == 0
 
-    def __load_batch_create_authentications_from_files(self, *args):
+            if not ready:
+                return
+
+            if setting.imsi in blocked:
+                log.warning(
+                    f"[\033[93m SKIPPED \033[0m] IMSI [{setting.imsi}]. Device was not added."
+                )
+                self.__record(
+                    summary,
+                    "sim",
+                    setting.imsi,
+                    records[setting.imsi],
+                    "skipped",
+                    "Device was not added",
+                )
+            else:
+                group.submit(
+                    self.__sdp_target(),
+                    self.__update_sim,
+                    setting.imsi,
+                    records[setting.imsi],
+                    summary,
+                )
+
+        def add_device(setting: CloudSetting):
+            on_device_added(setting, self.__add_device(setting, summary))
+
+        async def add_device_async(setting: GcpSetting):
+            on_device_added(setting, await self.__add_device_async(setting, summary))
+
+        with group:
+            self.__submit_authentications(group, auths, summary)
+
+            for imsi, update_record in records.items():
+                if imsi not in waiting:
+                    group.submit(
+                        self.__sdp_target(),
+                        self.__update_sim,
+                        imsi,
+                        update_record,
+                        summary,
+                    )
+
+            for s in settings:
+                if self.gcp_async and isinstance(s, GcpSetting):
+                    group.submit(s.get_target(), add_device_async, s)
+                else:
+                    group.submit(s.get_target(), add_device, s)
+
+        return self.__finish_summary(summary)
+
+    def __reload_changed_files(
+        self, paths, stamps: Dict[str, Tuple[int, int]], files: Dict[str, InputFile]
+    ) -> bool:
         """
-        Load create records from given yaml files
+        Load the watched files that are new or whose modification time or size
+        changed, forget the removed ones. A file that cannot be loaded keeps its
+        previous content until it is changed again. Return True if any content
+        changed.
         """
-        data: List = []
+        filenames = []
+        for path in paths:
+            if os.path.isdir(path):
+                filenames += sorted(
+                    os.path.join(path, name)
+                    for name in os.listdir(path)
+                    if name.endswith((".yaml", ".yml"))
+                )
+            else:
+                filenames.append(path)
 
-        for filename in args:
-            (device_type, res) = self.__load_authentications_from_yaml(
-                filename=filename
-            )
+        changed = False
+        for filename in set(files) - set(filenames):
+            log.info(f"File {filename} was removed.")
+            del files[filename]
+            del stamps[filename]
+            changed = True
 
-            for auth in res:
-                if device_type == "azure":
-                    data.append(AzureAuthentication(**auth))
-                elif device_type == "gcp":
-                    data.append(GCPAuthentication(**auth))
+        for filename in filenames:
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            if stamps.get(filename) == stamp:
+                continue
+
+            stamps[filename] = stamp
+            try:
+                if self.validate:
+                    errors = Validator("watch").validate_file(filename)
+                    if errors:
+                        raise Exception("\n".join(str(e) for e in errors))
+                file = InputFile.parse(self.__load_yaml(filename), SECTIONS["watch"])
+            except Exception as e:
+                log.error(f"[\033[91m FAILED \033[0m] Load file [{filename}]. {e}")
+                continue
 
-        return data
+            log.info(f"File {filename} was loaded.")
+            files[filename] = file
+            changed = True
+
+        return changed
 
-    def __load_authentications_from_yaml(self, filename):
+    def __apply_changes(
+        self, files: List[InputFile], state: Dict[str, Dict[str, str]]
+    ) -> Optional[RunSummary]:
         """
-        Load a given yaml file and return the authentications list
+        Apply the entries of parsed yaml files whose hash differs from the
+        state, then save the hashes of the applied entries in the state
         """
-        res: List = []
-        with open(filename, "r") as yml:
-            yml_content = yaml.safe_load(yml)
+        settings = {
+            f"{s.get_target()}/{s.device_id}": s
+            for s in self.__iter_add_devices_from_inputs(files)
+            if self.__in_shard(self.__get_device_key(s))
+        }
+        records = {
+            str(imsi): record
+            for imsi, record in self.__load_batch_update_sims_from_inputs(files).items()
+            if self.__in_shard(imsi)
+        }
+        auths = {
+            auth.name: auth
+            for auth in self.__load_batch_create_authentications_from_inputs(files)
+            if self.__in_shard(auth.name)
+        }
+
+        hashes = {
+            "device": {
+                key: self.__hash_entry(s.get_yaml_settings(), s.to_yaml())
+                for key, s in settings.items()
+            },
+            "sim": {
+                key: self.__hash_entry(r.azure_device_id, r.gcp_device_id, r.error)
+                for key, r in records.items()
+            },
+            "authentication": {
+                key: self.__hash_entry(a.get_type(), a.get_yaml_settings(), a.to_yaml())
+                for key, a in auths.items()
+            },
+        }
+        changed = {
+            kind: [key for key, h in entries.items() if state[kind].get(key) != h]
+            for kind, entries in hashes.items()
+        }
+        state.update(hashes)
+
+        if not any(changed.values()):
+            log.info("No entries changed.")
+            return None
+
+        summary = self.__apply(
+            "watch",
+            [settings[key] for key in changed["device"]],
+            {records[key].imsi: records[key] for key in changed["sim"]},
+            [auths[key] for key in changed["authentication"]],
+        )
 
-        device_type: str = self.__get_yaml_file_type(yml_content)
+        # Forget the failed entries so that they are applied again next time
+        for failure in summary.failures:
+            state[failure["kind"]].pop(str(failure["key"]), None)
+        return summary
 
-        auths = yml_content[device_type + "Settings"]["authentications"]
+    def __hash_entry(self, *parts) -> str:
+        return hashlib.sha1(
+            json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
 
-        for auth in auths:
-            if device_type == "azure":
-                ...
-            elif device_type == "gcp":
-                auth.update(self.__load_gcp_common_settings(yml_content))
-            else:
-                raise Exception(f"Unknown device type {device_type}")
-            res.append(auth)
+    def __validate(self, action: str, filenames):
+        """
+        Check all given files before any API call, raise all errors at once.
+        The files are validated by the parse workers, their entries are not
+        kept.
+        """
+        if not self.validate:
+            return
+
+        self.__raise_errors(
+            [
+                error
+                for errors, _ in self.__parse_files(filenames, action)
+                for error in errors
+            ]
+        )
 
-        return device_type, res
+    def __load_files(self, filenames, action: str) -> List[InputFile]:
+        """
+        Parse all given files read by an action. With validation, the files are
+        checked while they are parsed and all errors are raised at once,
+        before any API call.
+        """
+        errors: List[ValidationError] = []
+        files: List[InputFile] = []
+        for file_errors, file in self.__parse_files(filenames, action):
+            errors += file_errors
+            files.append(file)
+        self.__raise_errors(errors)
+        return files
+
+    def __raise_errors(self, errors: List[ValidationError]):
+        if errors:
+            raise Exception(
+                f"{len(errors)} errors in the input files:\n"
+                + "\n".join(str(e) for e in errors)
+            )
 
-    def __load_add_devices_from_files(self, *args) -> List[CloudSetting]:
+    def __generate_token(self):
         """
-        Load update records from given yaml files
+        Generate a SDP token unless the last one is recent enough
         """
-        settings: List[CloudSetting] = []
+        if (
+            self.__token_generated_at is not None
+            and time.monotonic() - self.__token_generated_at < TOKEN_LIFETIME
+        ):
+            return
+        self.sdp.generate_token(
+            name=self.credentials.key,
+            password=self.credentials.secret,
+            tenant_id=self.credentials.tenant_id,
+        )
+        self.__token_generated_at = time.monotonic()
 
-        for filename in args:
+    def __on_breaker_state(self, breaker: CircuitBreaker, state: State):
+        """
+        Log the changes of the circuit of a target
+        """
+        target = breaker.target
+        if state == "open":
+            reason = (
+                f"failed {breaker.failures} times in a row"
+                if breaker.probes == 0
+                else "failed the probe"
+            )
+            log.warning(
+                f"[\033[93m CIRCUIT OPEN \033[0m] [{target}] {reason}. "
+                f"Its items are deferred for {breaker.get_cooldown():g}s."
+            )
+        elif state == "half-open":
+            log.info(f"[\033[93m CIRCUIT PROBE \033[0m] [{target}].")
+        elif state == "closed":
+            log.info(
+                f"[\033[92m CIRCUIT CLOSED \033[0m] [{target}] recovered. "
+                "Its deferred items are resumed."
+            )
+        elif state == "down":
+            log.error(
+                f"[\033[91m CIRCUIT DOWN \033[0m] [{target}] failed {breaker.probes} "
+                "probes. Its remaining items fail without calls."
+            )
 
-            log.info(f"Loading file {filename}...")
+    def __sdp_target(self) -> str:
+        """
+        Get the scheduler target of the SDP tenant
+        """
+        return f"sdp:{self.credentials.tenant_id}"
 
-            with open(filename, "r") as yml:
-                yml_content = yaml.safe_load(yml)
+    def __create_summary(self, action: str, total: int = None) -> RunSummary:
+        """
+        Create the summary of a run and start its progress, `total` is None if
+        the number of items is not known before the run
+        """
+        if self.show_progress:
+            self.progress = Progress(total=total)
+            self.progress.start()
+        if self.failures_dir is not None:
+            self.failures = RunFailures()
+        return RunSummary(
+            action=action, shards=[str(self.shard)] if self.shard is not None else []
+        )
 
-            device_type: str = self.__get_yaml_file_type(yml_content)
+    def __finish_summary(self, summary: RunSummary) -> RunSummary:
+        """
+        Finish and log the summary of a run
+        """
+        summary.finish()
+        if self.progress is not None:
+            self.progress.stop()
+            self.progress = None
+        log.info(f"Done. {summary.get_info()}")
+        if self.hedger is not None:
+            log.info(f"Hedged reads: {self.hedger.get_info()}")
+        if self.failures is not None:
+            if len(self.failures) > 0:
+                for filename in self.failures.write(self.failures_dir):
+                    log.info(f"Failed entries written to {filename}")
+            self.failures = None
+        return summary
+
+    def __record(
+        self,
+        summary: RunSummary,
+        kind: str,
+        key: str,
+        item,
+        status: str,
+        error: str = None,
+        started: float = None,
+        rerun: bool = True,
+    ):
+        """
+        Count the result of one item in the summary and the progress and keep
+        the entry of a failed item unless `rerun` is False, `started` is the
+        `time.perf_counter()` when the item was started
+        """
+        summary.add(kind, key, status, error)
+        if status != "succeeded" and rerun and self.failures is not None:
+            self.failures.add(kind, item)
+        if self.progress is not None:
+            self.progress.add(
+                status, None if started is None else time.perf_counter() - started
+            )
 
-            if device_type == "azure":
-                settings += self.__load_azure_detail(yml_content)
-            elif device_type == "gcp":
-                settings += self.__load_gcp_detail(yml_content)
-            else:
-                raise Exception(f"Unknown device type {device_type}")
+    def __in_shard(self, key) -> bool:
+        """
+        Check if an item belongs to the shard of this worker
+        """
+        return self.shard is None or self.shard.contains(key)
 
-        log.info(f"All files loaded. There are {len(settings)} devices will be added.")
+    def __get_device_key(self, setting: CloudSetting) -> str:
+        """
+        Get the shard key of a device, the IMSI if it is set
+        """
+        if setting.imsi is not None:
+            return setting.imsi
+        return f"{setting.get_target()}/{setting.device_id}"
+
+    def __check_sim_in_snapshot(
+        self,
+        snapshot: Snapshot,
+        imsi: str,
+        update_record: UpdateSIMRecord,
+        summary: RunSummary,
+    ) -> bool:
+        """
+        Check if a SIM exists and would change, log the difference. Return True
+        if the SIM has to be updated through the API.
+        """
+        if update_record.error is not None:
+            return True
+
+        sim = snapshot.get_sim(imsi)
+        if sim is None:
+            log.error(f"[\033[91m FAILED \033[0m] IMSI [{imsi}]. Not in the snapshot.")
+            self.__record(
+                summary, "sim", imsi, update_record, "failed", "Not in the snapshot"
+            )
+            return False
 
-        return settings
+        changes = self.__get_sim_changes(sim, update_record)
+        if not changes:
+            log.info(f"[\033[93m SKIPPED \033[0m] IMSI [{imsi}]. Unchanged.")
+            self.__record(
+                summary, "sim", imsi, update_record, "skipped", "Unchanged", rerun=False
+            )
+            return False
 
-    def __get_yaml_file_type(self, content):
+        if self.dry_run:
+            log.info(f"[\033[93m DRY RUN \033[0m] IMSI [{imsi}]. {', '.join(changes)}")
+            self.__record(
+                summary, "sim", imsi, update_record, "skipped", "Dry run", rerun=False
+            )
+            return False
+
+        return True
+
+    def __get_sim_changes(self, sim: Dict, update_record: UpdateSIMRecord) -> List[str]:
         """
-        Check and get the cloud type of the yaml file
+        Get the device IDs of a SIM that an update record would change
         """
-        if "azureSettings" in content:
-            return "azure"
-        elif "gcpSettings" in content:
-            return "gcp"
-        else:
-            raise Exception("Invalid yaml format")
+        changes = get_changed_fields(
+            sim,
+            {
+                "azureDeviceId": update_record.azure_device_id,
+                "gcpDeviceId": update_record.gcp_device_id,
+            },
+        )
+        return [
+            f"{field}: {sim.get(field)} -> {value}" for field, value in changes.items()
+        ]
 
-    def __get_device_options(
-        self, global_options: List[dict], device_options: List[dict] = None
+    def __list_target_devices(
+        self, setting: CloudSetting
+    ) -> Tuple[Optional[Dict[str, Dict]], Optional[str]]:
+        """
+        List the devices of the target of a setting, get them or the error
+        """
+        target = setting.get_target()
+        try:
+            with phase("network"):
+                devices = setting.list_devices(DEVICE_PAGE_SIZE)
+        except Exception as e:
+            log.error(
+                f"[\033[91m FAILED \033[0m] List devices of [{target}]. Response: {e}"
+            )
+            return None, str(e)
+        log.info(f"[{target}] has {len(devices)} devices.")
+        return devices, None
+
+    def __report_drift(
+        self,
+        summary: RunSummary,
+        kind: str,
+        key: str,
+        item,
+        label: str,
+        drift: List[str] = None,
+        error: str = None,
     ):
         """
-        Merge global options and device options and return the string of all options
+        Log and count the result of verifying one entry, an entry that drifts
+        or cannot be verified fails
+        """
+        if error is not None:
+            log.error(f"[\033[91m FAILED \033[0m] {label}. Response: {error}")
+            self.__record(summary, kind, key, item, "failed", error)
+        elif drift:
+            log.error(f"[\033[91m DRIFT \033[0m] {label}. {', '.join(drift)}")
+            self.__record(
+                summary, kind, key, item, "failed", f"Drift: {', '.join(drift)}"
+            )
+        else:
+            log.info(f"[\033[92m MATCH \033[0m] {label}.")
+            self.__record(summary, kind, key, item, "succeeded")
+
+    def __update_sim(
+        self, imsi: str, update_record: UpdateSIMRecord, summary: RunSummary
+    ) -> bool:
+        """
+        Update the device IDs of one SIM and log the result
         """
+        started = time.perf_counter()
+        with span("sim.update", imsi=imsi) as s:
+            try:
+                if update_record.error is not None:
+                    raise Exception(update_record.error)
 
-        option_dict = {}
+                # Get the SIM object from API
+                with span("sim.get", imsi=imsi), self.scheduler.guard(
+                    self.__sdp_target()
+                ):
+                    sim = SIM(**self.sdp.get_sim(imsi=imsi))
+
+                # Only the device IDs set in yaml that differ are sent
+                with span("sim.merge", imsi=imsi):
+                    req = sim.get_update_request(
+                        azureDeviceId=update_record.azure_device_id,
+                        gcpDeviceId=update_record.gcp_device_id,
+                    )
 
-        if global_options is not None:
-            for option in global_options:
-                option_dict[option["name"]] = option["value"]
+                if req is None:
+                    log.info(f"[\033[93m SKIPPED \033[0m] IMSI [{imsi}]. Unchanged.")
+                    self.__record(
+                        summary,
+                        "sim",
+                        imsi,
+                        update_record,
+                        "skipped",
+                        "Unchanged",
+                        started,
+                        rerun=False,
+                    )
+                    return True
 
-        if device_options is not None:
-            for option in device_options:
-                option_dict[option["name"]] = option["value"]
+                # Update SIM by API
+                with span("sim.put", imsi=imsi), self.scheduler.guard(
+                    self.__sdp_target()
+                ):
+                    self.sdp.update_sim(imsi=imsi, req=req)
 
-        return option_dict
+                log.info(f"[\033[92m SUCCESS \033[0m] IMSI [{imsi}].")
+                self.__record(
+                    summary, "sim", imsi, update_record, "succeeded", started=started
+                )
+                return True
+            except Exception as e:
+                s.set_error(str(e))
+                log.error(f"[\033[91m FAILED \033[0m] IMSI [{imsi}]. Response: {e}")
+                self.__record(
+                    summary, "sim", imsi, update_record, "failed", str(e), started
+                )
+                return False
 
-    def __load_azure_detail(self, yml_content):
+    def __submit_authentications(self, group, auths: List, summary: RunSummary):
         """
-        Load Azure Setting from yaml content
+        Create the authentications concurrently. If existing ones are skipped,
+        the existing authentications are listed once and an authentication is
+        skipped if one with the same type, name and device ID exists or is
+        already in the input.
         """
-        settings: List[CloudSetting] = []
+        existing = self.__index_authentications(auths) if self.skip_existing else None
 
-        connection_string: str = yml_content["azureSettings"]["connectionString"]
-        options: List[dict] = (
-            yml_content["azureSettings"]["options"]
-            if "options" in yml_content["azureSettings"]
-            else []
-        )
+        for auth in auths:
+            if existing is not None:
+                key = auth.get_index_key()
+                if key in existing:
+                    log.info(
+                        f"[\033[93m SKIPPED \033[0m] Add Authentication [{auth.name}]. Already exists."
+                    )
+                    self.__record(
+                        summary,
+                        "authentication",
+                        auth.name,
+                        auth,
+                        "skipped",
+                        "Already exists",
+                        rerun=False,
+                    )
+                    continue
+                existing.add(key)
 
-        for device in yml_content["azureSettings"]["devices"]:
-            device_options: List[dict] = (
-                device["options"] if "options" in device else None
-            )
-            settings.append(
-                AzureSetting(
-                    connection_string=connection_string,
-                    device_id=device["deviceId"],
-                    options=self.__get_device_options(options, device_options),
+            group.submit(self.__sdp_target(), self.__add_authentication, auth, summary)
+
+    def __index_authentications(self, auths: List) -> Set[Tuple[str, str, str]]:
+        """
+        List the existing authentications of the types of given ones and get
+        their keys. The first page gives the number of pages, the other pages
+        are fetched concurrently.
+        """
+        index: Set[Tuple[str, str, str]] = set()
+
+        for auth_type in sorted({auth.get_type() for auth in auths}):
+            for existing in self.__list_all(
+                self.sdp.get_authentications,
+                "authentications",
+                AUTHENTICATION_PAGE_SIZE,
+                type=auth_type,
+            ):
+                index.add(get_index_key(existing))
+
+        log.info(f"{len(index)} existing authentications found.")
+        return index
+
+    def __list_all(self, get_page, key: str, page_size: int, **kwargs) -> List[Dict]:
+        """
+        Get all items of a paged SDP listing. The first page gives the number of
+        pages, the other pages are fetched concurrently. A listing that returns
+        a plain list is not paged.
+        """
+        first = get_page(page=1, pageSize=page_size, **kwargs)
+        if isinstance(first, list):
+            return first
+
+        with self.scheduler.group() as group:
+            futures = [
+                group.submit(
+                    self.__sdp_target(),
+                    get_page,
+                    page=page,
+                    pageSize=page_size,
+                    **kwargs,
                 )
-            )
+                for page in range(2, first.get("totalPages", 1) + 1)
+            ]
 
-        return settings
+        items = list(first[key])
+        for future in futures:
+            items += future.result()[key]
+        return items
+
+    def __add_authentication(self, auth, summary: RunSummary) -> bool:
+        """
+        Create one authentication and log the result
+        """
+        started = time.perf_counter()
+        with span("authentication.add", **{"authentication.name": auth.name}) as s:
+            try:
+                with self.scheduler.guard(self.__sdp_target()):
+                    res = self.sdp.create_authentication(req=auth.to_create_request())
+                log.info(
+                    f"[\033[92m SUCCESS \033[0m] Add Authentication [{res['name']}]."
+                )
+                self.__record(
+                    summary,
+                    "authentication",
+                    auth.name,
+                    auth,
+                    "succeeded",
+                    started=started,
+                )
+                return True
+            except Exception as e:
+                s.set_error(str(e))
+                log.error(
+                    f"[\033[91m FAILED \033[0m] Add Authentication [{auth.name}]. Response: {e}"
+                )
+                self.__record(
+                    summary,
+                    "authentication",
+                    auth.name,
+                    auth,
+                    "failed",
+                    str(e),
+                    started,
+                )
+                return False
 
-    def __load_gcp_detail(self, yml_content):
+    def __add_device(self, setting: CloudSetting, summary: RunSummary) -> bool:
         """
-        Load GCP Setting from yaml content
+        Add or update one cloud device and log the result
         """
-        settings: List[CloudSetting] = []
+        started = time.perf_counter()
+        with span("device.add", **self.__get_device_attributes(setting)) as s:
+            try:
+                with self.scheduler.guard(setting.get_target()), phase("network"):
+                    setting.add()
+            except Exception as e:
+                s.set_error(str(e))
+                return self.__report_device(setting, summary, started, e)
+            return self.__report_device(setting, summary, started)
 
-        project_id = yml_content["gcpSettings"]["projectId"]
-        region = yml_content["gcpSettings"]["region"]
-        registry_id = yml_content["gcpSettings"]["registryId"]
-        options: List[dict] = (
-            yml_content["gcpSettings"]["options"]
-            if "options" in yml_content["gcpSettings"]
-            else []
+    async def __add_device_async(
+        self, setting: GcpSetting, summary: RunSummary
+    ) -> bool:
+        """
+        Add or update one GCP device with the async client and log the result
+        """
+        started = time.perf_counter()
+        with span("device.add", **self.__get_device_attributes(setting)) as s:
+            try:
+                with self.scheduler.guard(setting.get_target()), phase("network"):
+                    await setting.add_async(self.gcp_clients)
+            except Exception as e:
+                s.set_error(str(e))
+                return self.__report_device(setting, summary, started, e)
+            return self.__report_device(setting, summary, started)
+
+    def __report_device(
+        self,
+        setting: CloudSetting,
+        summary: RunSummary,
+        started: float = None,
+        error: Exception = None,
+    ) -> bool:
+        """
+        Log and count the result of one device
+        """
+        key = f"{setting.get_target()}/{setting.device_id}"
+        if error is None:
+            log.info(f"[\033[92m SUCCESS \033[0m] Add Device [{setting.get_info()}].")
+            self.__record(summary, "device", key, setting, "succeeded", started=started)
+            return True
+
+        log.error(
+            f"[\033[91m FAILED \033[0m] Add Device [{setting.get_info()}]. Response: {error}"
         )
-        service_account = (
-            yml_content["gcpSettings"]["serviceAccount"]
-            if "serviceAccount" in yml_content["gcpSettings"]
-            else None
+        self.__record(summary, "device", key, setting, "failed", str(error), started)
+        return False
+
+    def __get_device_attributes(self, setting: CloudSetting) -> Dict:
+        """
+        Get the span attributes of a device
+        """
+        return {
+            "device.id": setting.device_id,
+            "backend.target": setting.get_target(),
+            "imsi": setting.imsi,
+        }
+
+    def __get_add_device(self, setting: CloudSetting):
+        """
+        Get the function to add a given setting, GCP devices use the async path if enabled
+        """
+        if self.gcp_async and isinstance(setting, GcpSetting):
+            return self.__add_device_async
+        return self.__add_device
+
+    def __load_yaml(self, filename):
+        """
+        Load a given yaml file
+        """
+        with span("load", file=filename), phase("yaml parse"):
+            with open(filename, "r") as yml:
+                return yaml.safe_load(yml)
+
+    def __parse_files(
+        self, filenames, action: str
+    ) -> Iterator[Tuple[List[ValidationError], Optional[InputFile]]]:
+        """
+        Yield the validation errors and the entries of given yaml files read by
+        an action, in order. With validation, a file is checked while it is
+        parsed, and its entries are None if it has errors.
+
+        With more than one file and parse worker, the files are validated and
+        parsed by a pool of processes that only send back the errors and the
+        compact entries, at most two files per worker ahead of the file being
+        taken. Files found in the cache are neither parsed nor validated, the
+        errors are cached with the entries.
+        """
+        sections = SECTIONS[action]
+        validate = action if self.validate else None
+        workers = min(self.parse_workers, len(filenames))
+        if workers <= 1:
+            for filename in filenames:
+                key, result = self.__get_cached_file(filename, sections, validate)
+                if result is None:
+                    if validate:
+                        with span("load", file=filename), phase("yaml parse"):
+                            result = InputFile.load(filename, sections, validate)
+                    else:
+                        result = [], InputFile.parse(
+                            self.__load_yaml(filename), sections
+                        )
+                    if key is not None:
+                        self.cache.put(key, result)
+                yield result
+            return
+
+        # Do not fork the threads of the scheduler and the log listener
+        pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
         )
+        try:
+            pending: Deque[Tuple[str, Optional[str], Future]] = deque()
+            for filename in filenames:
+                key, result = self.__get_cached_file(filename, sections, validate)
+                if result is None:
+                    future = pool.submit(InputFile.load, filename, sections, validate)
+                else:
+                    key, future = None, Future()
+                    future.set_result(result)
+                pending.append((filename, key, future))
+                if len(pending) >= 2 * workers:
+                    yield self.__get_parsed_file(*pending.popleft())
+            while pending:
+                yield self.__get_parsed_file(*pending.popleft())
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def __get_cached_file(
+        self, filename: str, sections, validate: Optional[str]
+    ) -> Tuple[Optional[str], Optional[Tuple]]:
+        """
+        Get the cache key of a file and its cached errors and entries, the key
+        is None without a cache or if the file cannot be read. Files are only
+        cached with the errors of the action they were validated for.
+        """
+        if self.cache is None:
+            return None, None
+        try:
+            key = self.cache.get_key(filename, CACHE_FORMAT, sorted(sections), validate)
+        except OSError:
+            return None, None
+        return key, self.cache.get(key)
+
+    def __get_parsed_file(
+        self, filename: str, key: Optional[str], future: Future
+    ) -> Tuple[List[ValidationError], Optional[InputFile]]:
+        with span("load", file=filename), phase("yaml parse"):
+            result = future.result()
+        if key is not None:
+            self.cache.put(key, result)
+        return result
 
-        for device in yml_content["gcpSettings"]["devices"]:
-            device_options: List[dict] = (
-                device["options"] if "options" in device else None
-            )
-            settings.append(
-                GcpSetting(
-                    project_id=project_id,
-                    region=region,
-                    registry_id=registry_id,
-                    device_id=device["deviceId"],
-                    options=self.__get_device_options(options, device_options),
-                    sa_path=service_account,
+    def __load_batch_update_sims_from_files(self, *args):
+        """
+        Load update records from given yaml files
+        """
+        return self.__load_batch_update_sims_from_inputs(
+            self.__load_files(args, "update-sims")
+        )
+
+    def __load_batch_update_sims_from_inputs(self, files: List[InputFile]):
+        """
+        Load update records from parsed yaml files, SIMs of the `groups` are
+        added with the device IDs of their template unless they are listed in
+        `devices`
+        """
+        data: Dict[str, UpdateSIMRecord] = {}
+
+        for file in files:
+            # The last device of a file with the same IMSI wins
+            res = dict(file.sims)
+
+            for imsi, device_id in res.items():
+                if not imsi in data.keys():
+                    rec = UpdateSIMRecord(imsi=imsi)
+                    data[imsi] = rec
+
+                if file.device_type == "azure":
+                    data[imsi].azure_device_id = device_id
+                elif file.device_type == "gcp":
+                    data[imsi].gcp_device_id = device_id
+
+        listed = {str(imsi): imsi for imsi in data.keys()}
+        for device_type, group, sim in self.__load_group_sims_from_inputs(files):
+            imsi = listed.get(str(sim["imsi"]), sim["imsi"])
+            if not imsi in data.keys():
+                data[imsi] = UpdateSIMRecord(imsi=imsi)
+            rec = data[imsi]
+
+            try:
+                device_id = self.__format_device_id(group["deviceIdTemplate"], sim)
+            except Exception as e:
+                rec.error = str(e)
+                continue
+
+            if device_type == "azure" and rec.azure_device_id is None:
+                rec.azure_device_id = device_id
+            elif device_type == "gcp" and rec.gcp_device_id is None:
+                rec.gcp_device_id = device_id
+
+        return data
+
+    def __load_group_sims_from_inputs(self, files: List[InputFile]):
+        """
+        Yield the device type, the group entry and every SIM of the `groups` of
+        parsed yaml files. A group is given by `groupId` or `name`, its SIMs
+        are listed by the SDP API or read from the snapshot if there is one.
+        """
+        groups = [(file.device_type, group) for file in files for group in file.groups]
+
+        if not groups:
+            return
+
+        snapshot = Snapshot(self.snapshot) if self.snapshot is not None else None
+        try:
+            group_ids: Dict[str, str] = None
+            for device_type, group in groups:
+                group_id = group.get("groupId")
+                if group_id is None:
+                    if group_ids is None:
+                        group_ids = {
+                            g.get("name"): g["groupId"]
+                            for g in (
+                                snapshot.get_groups()
+                                if snapshot is not None
+                                else self.__list_all(
+                                    self.sdp.get_groups, "groups", LISTING_PAGE_SIZE
+                                )
+                            )
+                        }
+                    if group.get("name") not in group_ids:
+                        raise Exception(f"Unknown group {group.get('name')}")
+                    group_id = group_ids[group["name"]]
+
+                sims = (
+                    snapshot.get_sims_in_group(group_id)
+                    if snapshot is not None
+                    else self.__list_all(
+                        self.sdp.get_sims, "sims", LISTING_PAGE_SIZE, groupId=group_id
+                    )
                 )
-            )
+                log.info(f"Group [{group_id}] has {len(sims)} SIMs.")
+                for sim in sims:
+                    yield device_type, group, sim
+        finally:
+            if snapshot is not None:
+                snapshot.close()
+
+    def __format_device_id(self, template: str, sim: Dict) -> str:
+        """
+        Fill a device ID template with the fields of a SIM, e.g. `{deviceName}`
+        or `device-{imsi}`
+        """
+        try:
+            for _, field, _, _ in Formatter().parse(template):
+                if field is not None and sim.get(field) in (None, ""):
+                    raise Exception(
+                        f"SIM has no {field} for deviceIdTemplate {template}"
+                    )
+            return template.format_map(sim)
+        except (KeyError, IndexError, ValueError) as e:
+            raise Exception(f"Invalid deviceIdTemplate {template}: {e}")
 
-        return settings
+    def __load_batch_create_authentications_from_files(self, *args):
+        """
+        Load create records from given yaml files
+        """
+        return self.__load_batch_create_authentications_from_inputs(
+            self.__load_files(args, "add-authentications")
+        )
+
+    def __load_batch_create_authentications_from_inputs(self, files: List[InputFile]):
+        """
+        Load create records from parsed yaml files
+        """
+        data: List = []
+
+        for file in files:
+            for auth in file.authentications:
+                if file.device_type == "azure":
+                    data.append(AzureAuthentication(**auth))
+                elif file.device_type == "gcp":
+                    data.append(GCPAuthentication(**auth))
 
-    def __load_gcp_common_settings(self, yml_content):
+        return data
+
+    def __iter_add_devices_from_files(self, *args) -> Iterator[CloudSetting]:
         """
-        Load GCP Project Detail from yaml content
+        Yield the settings of given yaml files, a file is only taken when the
+        settings of the files before it have been taken
         """
-        settings: Dict = {}
+        files = self.__parse_files(args, "add-devices")
+        for filename, (errors, file) in zip(args, files):
+            # Only if the file changed after it was validated
+            self.__raise_errors(errors)
+            log.info(f"Loading file {filename}...")
+            yield from self.__iter_add_devices_from_inputs([file])
 
-        settings["projectId"] = yml_content["gcpSettings"]["projectId"]
-        settings["region"] = yml_content["gcpSettings"]["region"]
-        settings["registryId"] = yml_content["gcpSettings"]["registryId"]
+    def __load_add_devices_from_inputs(
+        self, files: List[InputFile]
+    ) -> List[CloudSetting]:
+        """
+        Load the settings of parsed yaml files
+        """
+        settings = list(self.__iter_add_devices_from_inputs(files))
+
+        log.info(f"All files loaded. There are {len(settings)} devices will be added.")
 
         return settings
+
+    def __iter_add_devices_from_inputs(
+        self, files: List[InputFile]
+    ) -> Iterator[CloudSetting]:
+        """
+        Yield the settings of parsed yaml files
+        """
+        for file in files:
+            if file.device_type == "azure":
+                yield from self.__iter_azure_detail(file)
+            elif file.device_type == "gcp":
+                yield from self.__iter_gcp_detail(file)
+            else:
+                raise Exception(f"Unknown device type {file.device_type}")
+
+    def __get_yaml_file_type(self, content):
+        """
+        Check and get the cloud type of the yaml file
+        """
+        return get_file_type(content)
+
+    def __iter_azure_detail(self, file: InputFile) -> Iterator[CloudSetting]:
+        """
+        Yield Azure Settings from a parsed yaml file
+        """
+        if not file.devices:
+            return
+        connection_string: str = file.get_setting("connectionString")
+
+        for device_id, imsi, options in file.devices:
+            yield AzureSetting(
+                connection_string=connection_string,
+                device_id=device_id,
+                options=options,
+                imsi=imsi,
+                clients=self.cloud_clients,
+            )
+
+    def __iter_gcp_detail(self, file: InputFile) -> Iterator[CloudSetting]:
+        """
+        Yield GCP Settings from a parsed yaml file
+        """
+        if not file.devices:
+            return
+        project_id = file.get_setting("projectId")
+        region = file.get_setting("region")
+        registry_id = file.get_setting("registryId")
+        service_account = file.get_setting("serviceAccount")
+
+        for device_id, imsi, options in file.devices:
+            yield GcpSetting(
+                project_id=project_id,
+                region=region,
+                registry_id=registry_id,
+                device_id=device_id,
+                options=options,
+                sa_path=service_account,
+                imsi=imsi,
+                clients=self.cloud_clients,
+            )
@@ -0,0 +1,126 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import pytest
+import requests
+from google.api_core import exceptions as google_exceptions
+
+from libs.CircuitBreaker import BreakerPolicy, CircuitBreaker, is_backend_failure
+
+
+class TestCircuitBreaker:
+    @pytest.fixture(autouse=True)
+    def _setup(self):
+        """
+        Common setup
+        """
+        self.states = []
+        self.breaker = CircuitBreaker(
+            "azure:hub",
+            BreakerPolicy(failures=3, cooldown=1.0, max_cooldown=3.0, max_probes=3),
+        )
+        self.breaker.add_listener(lambda breaker, state: self.states.append(state))
+
+    def test_parse(self):
+        policy = BreakerPolicy.parse("20:10")
+
+        assert policy.failures == 20
+        assert policy.cooldown == 10.0
+        assert BreakerPolicy.parse("5").cooldown == 5.0
+        assert BreakerPolicy.parse("0") is None
+
+    @pytest.mark.parametrize("value", ["a", "5:a", "-1", "5:0"])
+    def test_parse_invalid(self, value):
+        with pytest.raises(Exception):
+            BreakerPolicy.parse(value)
+
+    def test_opens_after_consecutive_failures(self):
+        for success in [False, False, True, False, False]:
+            self.breaker.record(success)
+        assert self.breaker.state == "closed"
+
+        self.breaker.record(False)
+
+        assert self.breaker.state == "open"
+        assert self.breaker.is_deferring()
+        assert self.states == ["open"]
+
+    def test_client_errors_do_not_open_circuit(self):
+        response = requests.Response()
+        response.status_code = 404
+
+        for _ in range(5):
+            with pytest.raises(requests.HTTPError):
+                with self.breaker.guard():
+                    raise requests.HTTPError("Not Found", response=response)
+
+        assert self.breaker.state == "closed"
+        assert self.breaker.failures == 0
+
+    @pytest.mark.parametrize(
+        "error, failure",
+        [
+            (requests.ConnectionError("refused"), True),
+            (requests.Timeout("timed out"), True),
+            (google_exceptions.ServiceUnavailable("unavailable"), True),
+            (google_exceptions.TooManyRequests("throttled"), True),
+            (google_exceptions.NotFound("not found"), False),
+            (google_exceptions.AlreadyExists("exists"), False),
+            (Exception("Invalid key"), False),
+        ],
+    )
+    def test_is_backend_failure(self, error, failure):
+        assert is_backend_failure(error) == failure
+
+    @pytest.mark.parametrize(
+        "status, failure", [(409, False), (429, True), (500, True)]
+    )
+    def test_is_backend_failure_of_wrapped_error(self, status, failure):
+        response = requests.Response()
+        response.status_code = status
+        error = Exception({"Message": "error"})
+        error.__cause__ = requests.HTTPError(response=response)
+
+        assert is_backend_failure(error) == failure
+
+    def test_probe_closes_circuit(self):
+        self.__open()
+        self.breaker.half_open()
+
+        assert self.breaker.try_probe()
+        assert not self.breaker.try_probe()
+        with self.breaker.guard():
+            pass
+
+        assert self.breaker.state == "closed"
+        assert self.states == ["open", "half-open", "closed"]
+
+    def test_failed_probes_back_off_until_down(self):
+        self.__open()
+        cooldowns = [self.breaker.get_cooldown()]
+        for _ in range(3):
+            self.breaker.half_open()
+            self.breaker.try_probe()
+            with pytest.raises(Exception):
+                with self.breaker.guard():
+                    raise ConnectionError("Unavailable")
+            cooldowns.append(self.breaker.get_cooldown())
+
+        assert cooldowns[:3] == [1.0, 2.0, 3.0]
+        assert self.breaker.state == "down"
+        with pytest.raises(Exception, match="3 probes failed"):
+            with self.breaker.guard():
+                pass
+
+    def test_ignores_calls_running_when_opened(self):
+        self.__open()
+
+        self.breaker.record(True)
+
+        assert self.breaker.state == "open"
+
+    def __open(self):
+        for _ in range(3):
+            self.breaker.record(False)
@@ -0,0 +1,45 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import pickle
+
+from models.DeviceTable import DeviceTable
+
+
+class TestDeviceTable:
+    def test_devices_keep_their_values(self):
+        table = DeviceTable({"type": "CA"})
+        table.append("device1", "001")
+        table.append("device2", 440103000000002, {"type": "SAS"})
+        table.append(3)
+
+        assert list(table) == [
+            ("device1", "001", {"type": "CA"}),
+            ("device2", 440103000000002, {"type": "SAS"}),
+            (3, None, {"type": "CA"}),
+        ]
+        assert len(table) == 3
+
+    def test_options_are_interned(self):
+        table = DeviceTable({"type": "CA"})
+        for index in range(4):
+            table.append(f"device{index}", options={"type": "SAS", "status": "x"})
+        table.append("device4", options={"status": "x", "type": "SAS"})
+        table.append("device5", options={"type": "CA"})
+        table.append("device6")
+
+        assert table.get_templates() == [{"type": "CA"}, {"type": "SAS", "status": "x"}]
+        assert table[0][2] is table[4][2]
+        assert table[5][2] is table[6][2]
+
+    def test_pickled_table_can_grow(self):
+        table = DeviceTable({"type": "CA"})
+        table.append("device1", options={"type": "SAS"})
+
+        table = pickle.loads(pickle.dumps(table))
+        table.append("device2", options={"type": "SAS"})
+
+        assert len(table.get_templates()) == 2
+        assert table[1] == ("device2", None, {"type": "SAS"})
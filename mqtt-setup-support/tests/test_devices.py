@@ -0,0 +1,155 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import asyncio
+import pytest
+
+from google.cloud import iot_v1
+from models.Devices import AzureSetting, GcpAsyncClients, GcpSetting
+from unittest.mock import AsyncMock, Mock
+
+
+class TestGcpSetting:
+    @pytest.fixture(autouse=True)
+    def _setup(self, tmp_path):
+        """
+        Common setup
+        """
+        public_key = tmp_path / "public.pem"
+        public_key.write_text("PUBLIC KEY")
+
+        self.setting = GcpSetting(
+            project_id="project",
+            region="region",
+            registry_id="registry",
+            device_id="device1",
+            options={"format": "ES256_PEM", "public_key": str(public_key)},
+        )
+        self.client = AsyncMock()
+        self.clients = Mock()
+        self.clients.get.return_value = self.client
+
+    def test_add_async_creates_missing_device(self):
+        self.client.get_device.side_effect = Exception("Not Found")
+
+        asyncio.run(self.setting.add_async(self.clients))
+
+        self.client.get_device.assert_awaited_once_with(
+            request={
+                "name": "projects/project/locations/region/registries/registry/devices/device1"
+            }
+        )
+        request = self.client.create_device.call_args.kwargs["request"]
+        assert (
+            request["parent"] == "projects/project/locations/region/registries/registry"
+        )
+        assert request["device"]["id"] == "device1"
+        assert request["device"]["credentials"][0]["public_key"]["key"] == "PUBLIC KEY"
+        self.client.update_device.assert_not_called()
+
+    def test_add_async_updates_existing_device(self):
+        self.client.get_device.return_value = iot_v1.Device(id="device1", num_id=1)
+
+        asyncio.run(self.setting.add_async(self.clients))
+
+        request = self.client.update_device.call_args.kwargs["request"]
+        assert request["update_mask"].paths == ["credentials"]
+        assert request["device"].credentials[0].public_key.key == "PUBLIC KEY"
+        assert request["device"].num_id == 0
+        self.client.create_device.assert_not_called()
+
+    def test_list_devices_reads_pages_and_compares_keys(self, mocker):
+        client = Mock()
+        client.list_devices.side_effect = [
+            Mock(
+                devices=[
+                    iot_v1.Device(
+                        id="device1",
+                        credentials=[
+                            iot_v1.DeviceCredential(
+                                public_key=iot_v1.PublicKeyCredential(
+                                    format=iot_v1.PublicKeyFormat.ES256_PEM,
+                                    key="PUBLIC KEY\n",
+                                )
+                            )
+                        ],
+                    )
+                ],
+                next_page_token="page2",
+            ),
+            Mock(devices=[iot_v1.Device(id="device2")], next_page_token=""),
+        ]
+        mocker.patch.object(
+            GcpSetting, "client", new_callable=mocker.PropertyMock, return_value=client
+        )
+
+        devices = self.setting.list_devices(page_size=1)
+
+        assert sorted(devices) == ["device1", "device2"]
+        second_request = client.list_devices.call_args_list[1].kwargs["request"]
+        assert second_request["page_token"] == "page2"
+        assert self.setting.get_drift(devices["device1"]) == []
+        assert self.setting.get_drift(devices["device2"]) != []
+        assert self.setting.get_drift(None) == ["Not found"]
+
+
+class TestAzureSetting:
+    def test_list_devices_follows_continuation_token(self, mocker):
+        setting = AzureSetting(
+            connection_string="HostName=hub.azure-devices.net;SharedAccessKey=a2V5",
+            device_id="device1",
+            options={
+                "type": "X509",
+                "primary_thumbprint": "p",
+                "secondary_thumbprint": "s",
+            },
+        )
+        manager = Mock()
+        manager.query_iot_hub.side_effect = [
+            Mock(
+                items=[
+                    Mock(
+                        device_id="device1",
+                        authentication_type="selfSigned",
+                        status="disabled",
+                        x509_thumbprint=Mock(
+                            primary_thumbprint="p", secondary_thumbprint="s"
+                        ),
+                    )
+                ],
+                continuation_token="next",
+            ),
+            Mock(items=[], continuation_token=None),
+        ]
+        mocker.patch.object(
+            AzureSetting,
+            "iothub_registry_manager",
+            new_callable=mocker.PropertyMock,
+            return_value=manager,
+        )
+
+        devices = setting.list_devices(page_size=100)
+
+        assert manager.query_iot_hub.call_args_list[1].args[1:] == ("next", 100)
+        assert setting.get_drift(devices["device1"]) == ["status: disabled -> enabled"]
+
+
+class TestGcpAsyncClients:
+    def test_clients_are_shared_and_closed(self, mocker):
+        client_class = mocker.patch("models.Devices.iot_v1.DeviceManagerAsyncClient")
+        client_class.return_value.transport.close = AsyncMock()
+        clients = GcpAsyncClients()
+
+        async def run():
+            first = clients.get()
+            second = clients.get()
+            await clients.close()
+            return first, second
+
+        first, second = asyncio.run(run())
+
+        assert first is second
+        assert client_class.call_count == 1
+        first.transport.close.assert_awaited_once()
@@ -0,0 +1,88 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import os
+import yaml
+
+from libs.Validator import Validator
+from models.Authentications import AzureAuthentication, GCPAuthentication
+from models.Devices import GcpSetting
+from models.Failures import RunFailures
+from models.SIM import UpdateSIMRecord
+
+
+class TestRunFailures:
+    def test_groups_entries_by_action_and_settings(self, tmp_path):
+        failures = RunFailures()
+
+        failures.add(
+            "sim", UpdateSIMRecord(imsi="001", azure_device_id="a1", gcp_device_id="g1")
+        )
+        for registry_id in ["registry1", "registry2", "registry1"]:
+            failures.add(
+                "device",
+                GcpSetting(
+                    project_id="project",
+                    region="region",
+                    registry_id=registry_id,
+                    device_id="device1",
+                    options={"format": "ES256_PEM"},
+                ),
+            )
+        failures.add(
+            "authentication",
+            AzureAuthentication(name="auth1", sharedAccessKey="key", deviceId="a1"),
+        )
+        failures.add(
+            "authentication",
+            GCPAuthentication(
+                name="auth2",
+                projectId="project",
+                region="region",
+                registryId="registry1",
+                deviceId="device1",
+                algorithm="ES256",
+                privateKey="private.pem",
+            ),
+        )
+
+        filenames = failures.write(str(tmp_path))
+
+        assert len(failures) == 7
+        assert sorted(p.name for p in tmp_path.iterdir()) == sorted(
+            [
+                "update-sims-azure-1.yaml",
+                "update-sims-gcp-1.yaml",
+                "add-devices-gcp-1.yaml",
+                "add-devices-gcp-2.yaml",
+                "add-authentications-azure-1.yaml",
+                "add-authentications-gcp-1.yaml",
+            ]
+        )
+        assert len(filenames) == 6
+
+        with open(tmp_path / "add-devices-gcp-1.yaml") as f:
+            content = yaml.safe_load(f)["gcpSettings"]
+        assert content["registryId"] == "registry1"
+        assert len(content["devices"]) == 2
+
+        with open(tmp_path / "add-authentications-gcp-1.yaml") as f:
+            content = yaml.safe_load(f)["gcpSettings"]
+        assert content["registryId"] == "registry1"
+        assert content["authentications"][0]["name"] == "auth2"
+
+    def test_written_files_pass_validation_of_their_action(self, tmp_path):
+        failures = RunFailures()
+        failures.add(
+            "sim", UpdateSIMRecord(imsi="001", azure_device_id="a1", gcp_device_id="g1")
+        )
+        failures.add(
+            "authentication",
+            AzureAuthentication(name="auth1", sharedAccessKey="key", deviceId="a1"),
+        )
+
+        for filename in failures.write(str(tmp_path)):
+            action = os.path.basename(filename).rsplit("-", 2)[0]
+            assert Validator(action).validate_file(filename) == []
@@ -0,0 +1,51 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import os
+import pytest
+
+from libs.FileCache import FileCache
+
+
+class TestFileCache:
+    @pytest.fixture(autouse=True)
+    def _setup(self, tmp_path):
+        """
+        Common setup
+        """
+        self.directory = tmp_path / "cache"
+        self.cache = FileCache(str(self.directory), version="1.0.0")
+        self.filename = tmp_path / "azure.yaml"
+        self.filename.write_text("azureSettings: {}")
+
+    def test_reuses_value_of_unchanged_file(self):
+        key = self.cache.get_key(str(self.filename), "devices")
+        assert self.cache.get(key) is None
+
+        self.cache.put(key, {"devices": [("device1", "001", {})]})
+
+        assert self.cache.get_key(str(self.filename), "devices") == key
+        assert self.cache.get(key) == {"devices": [("device1", "001", {})]}
+        assert (self.cache.hits, self.cache.misses) == (1, 1)
+
+    def test_key_changes_with_content_version_and_parts(self):
+        key = self.cache.get_key(str(self.filename), "devices")
+
+        assert self.cache.get_key(str(self.filename), "sims") != key
+        assert (
+            FileCache(str(self.directory), "1.0.1").get_key(
+                str(self.filename), "devices"
+            )
+            != key
+        )
+        self.filename.write_text("gcpSettings: {}")
+        assert self.cache.get_key(str(self.filename), "devices") != key
+
+    def test_broken_entry_is_a_miss(self):
+        key = self.cache.get_key(str(self.filename))
+        (self.directory / f"{key}.pickle").write_bytes(b"broken")
+
+        assert self.cache.get(key) is None
+        assert os.listdir(self.directory) == [f"{key}.pickle"]
@@ -0,0 +1,114 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import asyncio
+import threading
+import time
+import pytest
+
+from libs.Hedger import MIN_SAMPLES, Hedger
+from libs.Scheduler import BackendLimit, Scheduler
+
+
+class TestHedger:
+    @pytest.fixture(autouse=True)
+    def _setup(self):
+        """
+        Common setup
+        """
+        self.hedger = Hedger(percentile=50)
+        yield
+        self.hedger.shutdown()
+
+    def __warm_up(self, operation: str):
+        for _ in range(MIN_SAMPLES):
+            self.hedger.call(operation, lambda: None)
+
+    def test_hedges_slow_read_and_keeps_first_reply(self):
+        self.__warm_up("read")
+        release = threading.Event()
+        attempts = []
+
+        def read():
+            attempts.append(len(attempts))
+            if len(attempts) == 1:
+                # The first attempt is stuck until the test ends
+                release.wait(5)
+                return "first"
+            return "second"
+
+        assert self.hedger.call("read", read) == "second"
+        release.set()
+
+        stats = self.hedger.get_stats()["read"]
+        assert stats["calls"] == MIN_SAMPLES + 1
+        assert stats["hedged"] == 1
+
+    def test_does_not_hedge_before_enough_latencies(self):
+        attempts = []
+
+        def read():
+            attempts.append(1)
+            time.sleep(0.01)
+            return "reply"
+
+        assert self.hedger.call("read", read) == "reply"
+        assert len(attempts) == 1
+        assert self.hedger.get_stats()["read"]["hedged"] == 0
+
+    def test_calls_inline_before_enough_latencies(self):
+        threads = []
+
+        self.hedger.call("read", lambda: threads.append(threading.current_thread()))
+
+        assert threads == [threading.current_thread()]
+
+    @pytest.mark.parametrize("concurrency, hedged", [(1, 0), (2, 1)])
+    def test_hedge_takes_a_free_slot_of_the_lane(self, concurrency, hedged):
+        self.__warm_up("read")
+        scheduler = Scheduler(limits={"sdp": BackendLimit(concurrency=concurrency)})
+        release = threading.Event()
+        attempts = []
+
+        def read():
+            attempts.append(len(attempts))
+            if len(attempts) == 1:
+                release.wait(0.2)
+                return "first"
+            return "second"
+
+        try:
+            scheduler.submit("sdp", self.hedger.call, "read", read).result()
+        finally:
+            release.set()
+            scheduler.shutdown()
+
+        assert len(attempts) == 1 + hedged
+        assert self.hedger.get_stats()["read"]["hedged"] == hedged
+
+    def test_raises_when_all_attempts_fail(self):
+        def read():
+            raise Exception("Not Found")
+
+        with pytest.raises(Exception, match="Not Found"):
+            self.hedger.call("read", read)
+
+    def test_hedges_slow_async_read(self):
+        attempts = []
+
+        async def read():
+            attempts.append(1)
+            if len(attempts) == MIN_SAMPLES + 1:
+                await asyncio.sleep(5)
+                return "first"
+            return "reply"
+
+        async def run():
+            for _ in range(MIN_SAMPLES):
+                await self.hedger.call_async("read", read)
+            return await self.hedger.call_async("read", read)
+
+        assert asyncio.run(run()) == "reply"
+        assert self.hedger.get_stats()["read"]["hedged"] == 1
@@ -0,0 +1,90 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import json
+import os
+import socket
+import threading
+import time
+import pytest
+
+from models.Summary import RunSummary
+from services.job_server import JobServer
+from unittest.mock import Mock
+
+
+class TestJobServer:
+    @pytest.fixture(autouse=True)
+    def _setup(self, tmp_path):
+        """
+        Common setup
+        """
+        self.service = Mock()
+        self.path = str(tmp_path / "jobs.sock")
+        self.server = JobServer(self.service, self.path)
+
+    def test_handle_returns_summary(self):
+        self.service.run.return_value = RunSummary(action="apply", succeeded=2)
+
+        reply = self.server.handle({"id": 7, "action": "apply", "files": ["a.yaml"]})
+
+        self.service.run.assert_called_once_with("apply", "a.yaml")
+        assert reply["id"] == 7
+        assert reply["ok"] is True
+        assert reply["result"]["succeeded"] == 2
+
+    @pytest.mark.parametrize(
+        "request_, error",
+        [
+            ({"action": "watch", "files": ["a.yaml"]}, "Invalid action watch"),
+            ({"action": "apply", "files": []}, "files must be a list"),
+            ([], "A job must be a JSON object"),
+        ],
+    )
+    def test_handle_rejects_invalid_jobs(self, request_, error):
+        reply = self.server.handle(request_)
+
+        assert reply["ok"] is False
+        assert error in reply["error"]
+        self.service.run.assert_not_called()
+
+    def test_handle_returns_errors(self):
+        self.service.run.side_effect = Exception("Invalid yaml format")
+
+        reply = self.server.handle({"action": "add-devices", "files": ["a.yaml"]})
+
+        assert reply == {
+            "ok": False,
+            "error": "Invalid yaml format",
+            "elapsedMs": reply["elapsedMs"],
+        }
+
+    def test_serves_jobs_over_socket(self):
+        self.service.run.return_value = {"sims": {"added": 1}}
+        stop = threading.Event()
+        thread = threading.Thread(target=self.server.serve, args=(stop,))
+        thread.start()
+        try:
+            for _ in range(100):
+                if os.path.exists(self.path):
+                    break
+                time.sleep(0.01)
+
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.connect(self.path)
+                client.sendall(
+                    b'{"action": "ping"}\n'
+                    b"not json\n"
+                    b'{"action": "snapshot", "files": ["sims.db"]}\n'
+                )
+                stream = client.makefile("r")
+                replies = [json.loads(stream.readline()) for _ in range(3)]
+        finally:
+            stop.set()
+            thread.join()
+
+        assert [r["ok"] for r in replies] == [True, False, True]
+        assert replies[2]["result"] == {"sims": {"added": 1}}
+        assert not os.path.exists(self.path)
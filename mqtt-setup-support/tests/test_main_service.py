@@ -5,10 +5,25 @@
 
 import allure
 import pytest
+import threading
+import yaml
 
+from libs.CircuitBreaker import BreakerPolicy
+from libs.FileCache import FileCache
+from libs.Scheduler import BackendLimit
+from libs.Shard import Shard
+from libs.Snapshot import Snapshot
+from libs.Validator import Validator
+from models.Credentials import SDPCredentials
+from models.Devices import AzureSetting, GcpSetting
+from models.InputFile import SECTIONS, InputFile
+from pathlib import Path
 from services.main_service import MainService
 from tests.base import TestBase
-from unittest.mock import Mock
+from unittest.mock import AsyncMock, Mock
+
+
+CONNECTION_STRING = "HostName=hub.azure-devices.net;SharedAccessKeyName=iothubowner;SharedAccessKey=c2VjcmV0"
 
 
 class TestMainService(TestBase):
@@ -20,6 +35,9 @@ class TestMainService(TestBase):
 
         # Mock Service
         self.mock_service = None
+        yield
+        if self.mock_service is not None:
+            self.mock_service.close()
 
     @pytest.mark.parametrize(
         "content, value",
@@ -40,11 +58,836 @@ class TestMainService(TestBase):
                 self.mock_service._MainService__get_yaml_file_type(content)
             assert str(error_response.value) == "Invalid yaml format"
 
+    def test_apply_skips_sim_update_when_device_fails(self, mocker):
+        self.__mock_init(mocker)
+
+        content = {
+            "azureSettings": {
+                "connectionString": CONNECTION_STRING,
+                "options": [{"name": "type", "value": "CA"}],
+                "devices": [
+                    {"imsi": "001", "deviceId": "device1"},
+                    {"imsi": "002", "deviceId": "device2"},
+                ],
+                "authentications": [
+                    {"name": "auth1", "sharedAccessKey": "key", "deviceId": "device1"}
+                ],
+            }
+        }
+        mocker.patch.object(
+            MainService, "_MainService__load_yaml", return_value=content
+        )
+        mocker.patch.object(self.mock_service.sdp, "generate_token")
+        mocker.patch.object(
+            self.mock_service.sdp, "get_sim", side_effect=lambda imsi: {"imsi": imsi}
+        )
+        update_sim = mocker.patch.object(self.mock_service.sdp, "update_sim")
+        create_authentication = mocker.patch.object(
+            self.mock_service.sdp,
+            "create_authentication",
+            return_value={"name": "auth1_202201010000"},
+        )
+
+        def add(setting):
+            if setting.device_id == "device2":
+                raise Exception("failed")
+
+        mocker.patch.object(AzureSetting, "add", autospec=True, side_effect=add)
+
+        self.mock_service.apply("azure.yaml")
+
+        assert [c.kwargs["imsi"] for c in update_sim.call_args_list] == ["001"]
+        assert create_authentication.call_count == 1
+
+    @pytest.mark.parametrize(
+        "gcp_async, setting_class, is_async",
+        [
+            (False, GcpSetting, False),
+            (True, GcpSetting, True),
+            (True, AzureSetting, False),
+        ],
+    )
+    def test_get_add_device(self, mocker, gcp_async, setting_class, is_async):
+        self.__mock_init(mocker)
+        self.mock_service.gcp_async = gcp_async
+
+        res = self.mock_service._MainService__get_add_device(Mock(spec=setting_class))
+
+        if is_async:
+            assert res == self.mock_service._MainService__add_device_async
+        else:
+            assert res == self.mock_service._MainService__add_device
+
+    def test_add_devices_with_gcp_async(self, mocker):
+        self.__mock_init(mocker)
+        self.mock_service.gcp_async = True
+
+        content = {
+            "gcpSettings": {
+                "projectId": "project",
+                "region": "region",
+                "registryId": "registry",
+                "devices": [{"imsi": "001", "deviceId": "device1"}],
+            }
+        }
+        mocker.patch.object(
+            MainService, "_MainService__load_yaml", return_value=content
+        )
+        add = mocker.patch.object(GcpSetting, "add")
+        add_async = mocker.patch.object(GcpSetting, "add_async", new=AsyncMock())
+
+        summary = self.mock_service.add_devices("gcp.yaml")
+
+        add.assert_not_called()
+        add_async.assert_awaited_once_with(self.mock_service.gcp_clients)
+        assert summary.succeeded == 1
+
+    def test_shards_split_sims_disjointly(self, mocker):
+        contents = {
+            "azure.yaml": self.__azure_content(range(0, 40)),
+            "gcp.yaml": self.__gcp_content(range(20, 60)),
+        }
+        mocker.patch.object(
+            MainService, "_MainService__load_yaml", side_effect=contents.get
+        )
+        updated = []
+
+        for index in range(3):
+            self.__mock_init(mocker, shard=Shard(index=index, count=3))
+            mocker.patch.object(self.mock_service.sdp, "generate_token")
+            mocker.patch.object(
+                self.mock_service.sdp,
+                "get_sim",
+                side_effect=lambda imsi: {"imsi": imsi},
+            )
+            update_sim = mocker.patch.object(self.mock_service.sdp, "update_sim")
+
+            self.mock_service.batch_update_sims("azure.yaml", "gcp.yaml")
+            self.mock_service.close()
+
+            updated.append(
+                {c.kwargs["imsi"]: c.kwargs["req"] for c in update_sim.call_args_list}
+            )
+
+        imsis = [imsi for shard in updated for imsi in shard]
+        assert sorted(imsis) == [f"{i:03d}" for i in range(60)]
+        assert all(len(shard) > 0 for shard in updated)
+
+        # Records merged from both files stay complete in their shard
+        req = next(shard["030"] for shard in updated if "030" in shard)
+        assert req.azureDeviceId == "azure030"
+        assert req.gcpDeviceId == "gcp030"
+
+    def test_apply_keeps_sims_with_their_devices(self, mocker):
+        mocker.patch.object(
+            MainService,
+            "_MainService__load_yaml",
+            return_value=self.__azure_content(range(0, 30)),
+        )
+        added_devices = []
+
+        def add(setting):
+            added_devices.append(setting.imsi)
+
+        mocker.patch.object(AzureSetting, "add", autospec=True, side_effect=add)
+
+        for index in range(3):
+            added_devices.clear()
+            self.__mock_init(mocker, shard=Shard(index=index, count=3))
+            mocker.patch.object(self.mock_service.sdp, "generate_token")
+            mocker.patch.object(
+                self.mock_service.sdp,
+                "get_sim",
+                side_effect=lambda imsi: {"imsi": imsi},
+            )
+            update_sim = mocker.patch.object(self.mock_service.sdp, "update_sim")
+
+            summary = self.mock_service.apply("azure.yaml")
+            self.mock_service.close()
+
+            updated = [c.kwargs["imsi"] for c in update_sim.call_args_list]
+            assert sorted(updated) == sorted(added_devices)
+            assert summary.shards == [f"{index}/3"]
+
+    def test_add_devices_raises_load_error(self, mocker):
+        self.__mock_init(mocker)
+        mocker.patch.object(
+            MainService, "_MainService__load_yaml", return_value={"abc": Mock()}
+        )
+
+        with pytest.raises(Exception) as error_response:
+            self.mock_service.add_devices("broken.yaml")
+        assert str(error_response.value) == "Invalid yaml format"
+
+    def test_add_devices_streams_files(self, mocker):
+        self.__mock_init(mocker)
+        mocker.patch("models.Devices.IoTHubRegistryManager")
+        mocker.patch("models.Devices.iot_v1.DeviceManagerClient")
+        contents = {
+            "azure.yaml": self.__azure_content(range(0, 2)),
+            "gcp.yaml": self.__gcp_content(range(2, 4)),
+        }
+        load_yaml = mocker.patch.object(
+            MainService, "_MainService__load_yaml", side_effect=contents.get
+        )
+
+        settings = self.mock_service._MainService__iter_add_devices_from_files(
+            "azure.yaml", "gcp.yaml"
+        )
+        first, second = next(settings), next(settings)
+
+        # The next file is only read when its devices are needed
+        assert load_yaml.call_count == 1
+        assert first.iothub_registry_manager is second.iothub_registry_manager
+        assert first.options is second.options
+
+        third, fourth = list(settings)
+        assert load_yaml.call_count == 2
+        assert third.client is fourth.client
+
+    def test_add_devices_stops_calling_a_down_hub(self, mocker):
+        self.__mock_init(
+            mocker,
+            limits={"azure": BackendLimit(concurrency=1)},
+            breaker=BreakerPolicy(
+                failures=2, cooldown=0.01, max_cooldown=0.01, max_probes=1
+            ),
+        )
+        mocker.patch.object(
+            MainService,
+            "_MainService__load_yaml",
+            return_value=self.__azure_content(range(0, 5)),
+        )
+        add = mocker.patch.object(
+            AzureSetting, "add", side_effect=ConnectionError("Connection refused")
+        )
+
+        summary = self.mock_service.add_devices("azure.yaml")
+
+        # Two failures open the circuit and the probe fails, the other
+        # devices fail without a call
+        assert add.call_count == 3
+        assert summary.failed == 5
+        breaker = self.mock_service.scheduler.get_breaker("azure:hub.azure-devices.net")
+        assert breaker.state == "down"
+
+    def test_update_sims_reports_progress(self, mocker):
+        self.__mock_init(mocker, progress=True)
+        mocker.patch.object(
+            MainService,
+            "_MainService__load_yaml",
+            return_value=self.__azure_content(range(0, 3)),
+        )
+        progress = mocker.patch("services.main_service.Progress")
+        mocker.patch.object(self.mock_service.sdp, "generate_token")
+        mocker.patch.object(
+            self.mock_service.sdp,
+            "get_sim",
+            side_effect=lambda imsi: {"imsi": imsi},
+        )
+        mocker.patch.object(
+            self.mock_service.sdp, "update_sim", side_effect=[None, Exception(), None]
+        )
+
+        self.mock_service.batch_update_sims("azure.yaml")
+
+        progress.assert_called_once_with(total=3)
+        statuses = sorted(c.args[0] for c in progress.return_value.add.call_args_list)
+        assert statuses == ["failed", "succeeded", "succeeded"]
+        assert all(c.args[1] >= 0 for c in progress.return_value.add.call_args_list)
+        progress.return_value.stop.assert_called_once()
+
+    def test_update_sims_sends_only_changed_device_ids(self, mocker):
+        self.__mock_init(mocker)
+        mocker.patch.object(
+            MainService,
+            "_MainService__load_yaml",
+            return_value=self.__azure_content(range(0, 2)),
+        )
+        mocker.patch.object(self.mock_service.sdp, "generate_token")
+        mocker.patch.object(
+            self.mock_service.sdp,
+            "get_sim",
+            side_effect=lambda imsi: {
+                "imsi": imsi,
+                "deviceName": "name",
+                "azureDeviceId": "azure000",
+            },
+        )
+        update_sim = mocker.patch.object(self.mock_service.sdp, "update_sim")
+
+        summary = self.mock_service.batch_update_sims("azure.yaml")
+
+        assert [c.kwargs["imsi"] for c in update_sim.call_args_list] == ["001"]
+        assert update_sim.call_args.kwargs["req"].toJSON() == (
+            '{"azureDeviceId": "azure001"}'
+        )
+        assert summary.succeeded == 1
+        assert summary.skipped == 1
+
+    def test_apply_writes_failed_entries(self, mocker, tmp_path):
+        self.__mock_init(mocker, failures_dir=str(tmp_path))
+        content = self.__azure_content(range(0, 3))
+        content["azureSettings"]["devices"][1]["options"] = [
+            {"name": "status", "value": "disabled"}
+        ]
+        mocker.patch.object(
+            MainService, "_MainService__load_yaml", return_value=content
+        )
+        mocker.patch.object(self.mock_service.sdp, "generate_token")
+        mocker.patch.object(
+            self.mock_service.sdp, "get_sim", side_effect=lambda imsi: {"imsi": imsi}
+        )
+        mocker.patch.object(self.mock_service.sdp, "update_sim")
+
+        def add(setting):
+            if setting.device_id == "azure001":
+                raise Exception("failed")
+
+        mocker.patch.object(AzureSetting, "add", autospec=True, side_effect=add)
+
+        self.mock_service.apply("azure.yaml")
+
+        assert sorted(p.name for p in tmp_path.iterdir()) == [
+            "add-devices-azure-1.yaml",
+            "update-sims-azure-1.yaml",
+        ]
+        with open(tmp_path / "add-devices-azure-1.yaml") as f:
+            assert yaml.safe_load(f) == {
+                "azureSettings": {
+                    "connectionString": CONNECTION_STRING,
+                    "devices": [
+                        {
+                            "imsi": "001",
+                            "deviceId": "azure001",
+                            "options": [
+                                {"name": "type", "value": "CA"},
+                                {"name": "status", "value": "disabled"},
+                            ],
+                        }
+                    ],
+                }
+            }
+        with open(tmp_path / "update-sims-azure-1.yaml") as f:
+            assert yaml.safe_load(f) == {
+                "azureSettings": {"devices": [{"imsi": "001", "deviceId": "azure001"}]}
+            }
+
+    def test_add_authentications_skips_existing(self, mocker):
+        self.__mock_init(mocker, skip_existing=True)
+        content = {
+            "azureSettings": {
+                "connectionString": CONNECTION_STRING,
+                "authentications": [
+                    {"name": "auth1", "sharedAccessKey": "key", "deviceId": "device1"},
+                    {"name": "auth2", "sharedAccessKey": "key", "deviceId": "device2"},
+                    {"name": "auth3", "sharedAccessKey": "key", "deviceId": "device3"},
+                    {"name": "auth3", "sharedAccessKey": "key", "deviceId": "device3"},
+                ],
+            }
+        }
+        mocker.patch.object(
+            MainService, "_MainService__load_yaml", return_value=content
+        )
+        mocker.patch.object(self.mock_service.sdp, "generate_token")
+        pages = {
+            1: [
+                {
+                    "type": "azure-iot-credentials",
+                    "name": "auth1_202201010000",
+                    "deviceId": "device1",
+                }
+            ],
+            2: [
+                {
+                    "type": "azure-iot-credentials",
+                    "name": "auth2_202201010000",
+                    "deviceId": "other",
+                }
+            ],
+        }
+        get_authentications = mocker.patch.object(
+            self.mock_service.sdp,
+            "get_authentications",
+            side_effect=lambda type, page, pageSize: {
+                "page": page,
+                "totalPages": 2,
+                "authentications": pages[page],
+            },
+        )
+        create_authentication = mocker.patch.object(
+            self.mock_service.sdp,
+            "create_authentication",
+            side_effect=lambda req: {"name": req.name},
+        )
+
+        summary = self.mock_service.add_authentications("azure.yaml")
+
+        assert get_authentications.call_count == 2
+        assert all(
+            c.kwargs["type"] == "azure-iot-credentials"
+            for c in get_authentications.call_args_list
+        )
+        created = sorted(
+            c.kwargs["req"].deviceId for c in create_authentication.call_args_list
+        )
+        assert created == ["device2", "device3"]
+        assert summary.succeeded == 2
+        assert summary.skipped == 2
+
+    def test_verify_reports_drift(self, mocker):
+        self.__mock_init(mocker)
+        content = self.__azure_content([1, 2])
+        content["azureSettings"]["authentications"] = [
+            {"name": "auth1", "sharedAccessKey": "key", "deviceId": "azure001"},
+            {"name": "auth2", "sharedAccessKey": "key", "deviceId": "azure002"},
+        ]
+        mocker.patch.object(
+            MainService, "_MainService__load_yaml", return_value=content
+        )
+        mocker.patch.object(self.mock_service.sdp, "generate_token")
+        mocker.patch.object(
+            self.mock_service.sdp,
+            "get_sims",
+            return_value=[
+                {"imsi": "001", "azureDeviceId": "azure001"},
+                {"imsi": "002", "azureDeviceId": "other"},
+            ],
+        )
+        mocker.patch.object(
+            self.mock_service.sdp,
+            "get_authentications",
+            return_value=[
+                {
+                    "type": "azure-iot-credentials",
+                    "name": "auth1_202201010000",
+                    "deviceId": "azure001",
+                }
+            ],
+        )
+        list_devices = mocker.patch.object(
+            AzureSetting,
+            "list_devices",
+            return_value={
+                "azure001": {
+                    "authType": "certificateAuthority",
+                    "status": "enabled",
+                    "thumbprints": None,
+                }
+            },
+        )
+        update_sim = mocker.patch.object(self.mock_service.sdp, "update_sim")
+
+        summary = self.mock_service.verify("azure.yaml")
+
+        assert list_devices.call_count == 1
+        update_sim.assert_not_called()
+        assert summary.succeeded == 3
+        assert sorted((f["kind"], f["key"], f["error"]) for f in summary.failures) == [
+            ("authentication", "auth2", "Drift: Not found"),
+            ("device", "azure:hub.azure-devices.net/azure002", "Drift: Not found"),
+            ("sim", "002", "Drift: azureDeviceId: other -> azure002"),
+        ]
+
+    def test_snapshot_lists_all_pages(self, mocker, tmp_path):
+        self.__mock_init(mocker)
+        mocker.patch.object(self.mock_service.sdp, "generate_token")
+        mocker.patch.object(
+            self.mock_service.sdp,
+            "get_groups",
+            return_value=[{"groupId": "g1", "name": "group 1"}],
+        )
+        get_sims = mocker.patch.object(
+            self.mock_service.sdp,
+            "get_sims",
+            side_effect=lambda page, pageSize: {
+                "page": page,
+                "totalPages": 3,
+                "sims": [{"imsi": f"{page:03d}", "groupId": "g1"}],
+            },
+        )
+
+        counts = self.mock_service.snapshot_sims(str(tmp_path / "snapshot.db"))
+
+        assert get_sims.call_count == 3
+        assert counts["sims"]["added"] == 3
+        assert counts["groups"]["added"] == 1
+
+    @pytest.mark.parametrize("dry_run", [False, True])
+    def test_update_sims_checks_snapshot(self, mocker, tmp_path, dry_run):
+        filename = str(tmp_path / "snapshot.db")
+        with Snapshot(filename) as snapshot:
+            snapshot.refresh_sims(
+                [
+                    {"imsi": "000", "azureDeviceId": "azure000"},
+                    {"imsi": "001", "azureDeviceId": "old"},
+                ]
+            )
+        self.__mock_init(mocker, snapshot=filename, dry_run=dry_run)
+        mocker.patch.object(
+            MainService,
+            "_MainService__load_yaml",
+            return_value=self.__azure_content(range(0, 3)),
+        )
+        mocker.patch.object(self.mock_service.sdp, "generate_token")
+        get_sim = mocker.patch.object(
+            self.mock_service.sdp, "get_sim", side_effect=lambda imsi: {"imsi": imsi}
+        )
+        mocker.patch.object(self.mock_service.sdp, "update_sim")
+
+        summary = self.mock_service.batch_update_sims("azure.yaml")
+
+        # 000 is unchanged, 001 changes and 002 does not exist
+        if dry_run:
+            get_sim.assert_not_called()
+        else:
+            get_sim.assert_called_once_with(imsi="001")
+        assert [f["key"] for f in summary.failures if f["status"] == "failed"] == [
+            "002"
+        ]
+        assert summary.skipped == (2 if dry_run else 1)
+        assert summary.succeeded == (0 if dry_run else 1)
+
+    def test_update_sims_treats_empty_device_id_as_unset(self, mocker, tmp_path):
+        filename = str(tmp_path / "snapshot.db")
+        with Snapshot(filename) as snapshot:
+            snapshot.refresh_sims([{"imsi": "000"}])
+        self.__mock_init(mocker, snapshot=filename)
+        mocker.patch.object(
+            MainService,
+            "_MainService__load_yaml",
+            return_value={
+                "azureSettings": {
+                    "connectionString": "HostName=hub.azure-devices.net",
+                    "devices": [{"imsi": "000", "deviceId": ""}],
+                }
+            },
+        )
+        mocker.patch.object(self.mock_service.sdp, "generate_token")
+        get_sim = mocker.patch.object(self.mock_service.sdp, "get_sim")
+        update_sim = mocker.patch.object(self.mock_service.sdp, "update_sim")
+
+        summary = self.mock_service.batch_update_sims("azure.yaml")
+
+        get_sim.assert_not_called()
+        update_sim.assert_not_called()
+        assert summary.skipped == 1
+
+    def test_update_sims_expands_groups(self, mocker):
+        self.__mock_init(mocker)
+        content = {
+            "gcpSettings": {
+                "projectId": "project",
+                "region": "region",
+                "registryId": "registry",
+                "devices": [{"imsi": "002", "deviceId": "explicit"}],
+                "groups": [{"name": "fleet", "deviceIdTemplate": "{deviceName}-gcp"}],
+            }
+        }
+        mocker.patch.object(
+            MainService, "_MainService__load_yaml", return_value=content
+        )
+        mocker.patch.object(self.mock_service.sdp, "generate_token")
+        mocker.patch.object(
+            self.mock_service.sdp,
+            "get_groups",
+            return_value={
+                "page": 1,
+                "totalPages": 1,
+                "groups": [{"groupId": "g1", "name": "fleet"}],
+            },
+        )
+        get_sims = mocker.patch.object(
+            self.mock_service.sdp,
+            "get_sims",
+            return_value={
+                "page": 1,
+                "totalPages": 1,
+                "sims": [
+                    {"imsi": "001", "deviceName": "sensor1"},
+                    {"imsi": "002", "deviceName": "sensor2"},
+                    {"imsi": "003", "deviceName": None},
+                ],
+            },
+        )
+        mocker.patch.object(
+            self.mock_service.sdp, "get_sim", side_effect=lambda imsi: {"imsi": imsi}
+        )
+        update_sim = mocker.patch.object(self.mock_service.sdp, "update_sim")
+
+        summary = self.mock_service.batch_update_sims("gcp.yaml")
+
+        assert get_sims.call_args.kwargs["groupId"] == "g1"
+        updated = {
+            c.kwargs["imsi"]: c.kwargs["req"].gcpDeviceId
+            for c in update_sim.call_args_list
+        }
+        assert updated == {"001": "sensor1-gcp", "002": "explicit"}
+        assert summary.failures[0]["key"] == "003"
+        assert "deviceName" in summary.failures[0]["error"]
+
+    def test_watch_applies_changed_entries(self, mocker):
+        self.__mock_init(mocker)
+        mocker.patch.object(
+            self.mock_service.sdp, "get_sim", side_effect=lambda imsi: {"imsi": imsi}
+        )
+        update_sim = mocker.patch.object(self.mock_service.sdp, "update_sim")
+        added = []
+        mocker.patch.object(
+            AzureSetting,
+            "add",
+            autospec=True,
+            side_effect=lambda setting: added.append(setting.device_id),
+        )
+        apply_changes = self.mock_service._MainService__apply_changes
+        state = {"device": {}, "sim": {}, "authentication": {}}
+        parse = lambda content: InputFile.parse(content, SECTIONS["watch"])
+
+        content = self.__azure_content(range(0, 3))
+        summary = apply_changes([parse(content)], state)
+        assert sorted(added) == ["azure000", "azure001", "azure002"]
+        assert summary.succeeded == 6
+
+        # Nothing changed
+        added.clear()
+        update_sim.reset_mock()
+        assert apply_changes([parse(content)], state) is None
+
+        # One device gets new options, one SIM a new device ID
+        content["azureSettings"]["devices"][0]["options"] = [
+            {"name": "status", "value": "disabled"}
+        ]
+        content["azureSettings"]["devices"][2]["deviceId"] = "renamed"
+        summary = apply_changes([parse(content)], state)
+
+        assert sorted(added) == ["azure000", "renamed"]
+        assert [c.kwargs["imsi"] for c in update_sim.call_args_list] == ["002"]
+        assert summary.succeeded == 3
+
+    def test_parse_workers_merge_files_in_order(self, mocker, tmp_path):
+        self.__mock_init(mocker, parse_workers=2)
+        filenames = []
+        for index, content in enumerate(
+            [
+                self.__azure_content(range(0, 3)),
+                self.__gcp_content(range(2, 5)),
+                self.__azure_content(range(4, 6)),
+            ]
+        ):
+            filename = tmp_path / f"{index}.yaml"
+            filename.write_text(yaml.safe_dump(content))
+            filenames.append(str(filename))
+
+        records = self.mock_service._MainService__load_batch_update_sims_from_files(
+            *filenames
+        )
+        settings = list(
+            self.mock_service._MainService__iter_add_devices_from_files(*filenames)
+        )
+
+        assert sorted(records) == [f"{i:03d}" for i in range(6)]
+        assert records["002"].azure_device_id == "azure002"
+        assert records["002"].gcp_device_id == "gcp002"
+        assert records["004"].azure_device_id == "azure004"
+        assert [s.device_id for s in settings] == [
+            "azure000",
+            "azure001",
+            "azure002",
+            "gcp002",
+            "gcp003",
+            "gcp004",
+            "azure004",
+            "azure005",
+        ]
+        assert settings[0].options == {"type": "CA"}
+
+    def test_cache_skips_parsing_unchanged_files(self, mocker, tmp_path):
+        self.__mock_init(mocker, cache=FileCache(str(tmp_path / "cache"), "1.0.0"))
+        filename = tmp_path / "azure.yaml"
+        filename.write_text(yaml.safe_dump(self.__azure_content(range(0, 2))))
+        load_yaml = mocker.patch.object(
+            MainService,
+            "_MainService__load_yaml",
+            side_effect=lambda filename: yaml.safe_load(Path(filename).read_text()),
+        )
+        load = self.mock_service._MainService__load_batch_update_sims_from_files
+
+        assert sorted(load(str(filename))) == ["000", "001"]
+        assert sorted(load(str(filename))) == ["000", "001"]
+        assert load_yaml.call_count == 1
+
+        filename.write_text(yaml.safe_dump(self.__azure_content(range(0, 3))))
+        assert sorted(load(str(filename))) == ["000", "001", "002"]
+        assert load_yaml.call_count == 2
+
+    def test_cache_keeps_validation_errors(self, mocker, tmp_path):
+        self.__mock_init(
+            mocker, validate=True, cache=FileCache(str(tmp_path / "cache"), "1.0.0")
+        )
+        valid = tmp_path / "valid.yaml"
+        valid.write_text(yaml.safe_dump(self.__azure_content(range(0, 2))))
+        invalid = tmp_path / "invalid.yaml"
+        invalid.write_text(yaml.safe_dump({"azureSettings": {"devices": [{}]}}))
+        load_file = mocker.spy(Validator, "load_file")
+        load = self.mock_service._MainService__load_batch_update_sims_from_files
+
+        assert sorted(load(str(valid))) == ["000", "001"]
+        assert sorted(load(str(valid))) == ["000", "001"]
+        for _ in range(2):
+            with pytest.raises(Exception, match="imsi is required"):
+                load(str(invalid))
+
+        assert load_file.call_count == 2
+
+    def test_service_reuses_token_between_actions(self, mocker):
+        self.__mock_init(
+            mocker,
+            credentials=SDPCredentials(
+                host="sdp.example.com", tenant_id="tenant", key="key", secret="secret"
+            ),
+        )
+        mocker.patch.object(
+            MainService,
+            "_MainService__load_yaml",
+            return_value=self.__azure_content(range(0, 1)),
+        )
+        generate_token = mocker.patch.object(self.mock_service.sdp, "generate_token")
+        mocker.patch.object(
+            self.mock_service.sdp, "get_sim", side_effect=lambda imsi: {"imsi": imsi}
+        )
+        mocker.patch.object(self.mock_service.sdp, "update_sim")
+
+        for _ in range(2):
+            summary = self.mock_service.run("update-sims", "azure.yaml")
+            assert summary.succeeded == 1
+
+        generate_token.assert_called_once_with(
+            name="key", password="secret", tenant_id="tenant"
+        )
+        assert self.mock_service.sdp._endpoint == "sdp.example.com"
+
+    def test_watch_reloads_changed_files(self, mocker, tmp_path):
+        self.__mock_init(mocker)
+        filename = tmp_path / "azure.yaml"
+        filename.write_text(yaml.safe_dump(self.__azure_content(range(0, 1))))
+        (tmp_path / "notes.txt").write_text("ignored")
+        reload = self.mock_service._MainService__reload_changed_files
+        stamps, files = {}, {}
+
+        assert reload([str(tmp_path)], stamps, files)
+        assert list(files) == [str(filename)]
+        assert not reload([str(tmp_path)], stamps, files)
+
+        filename.write_text(yaml.safe_dump(self.__azure_content(range(0, 2))))
+        assert reload([str(tmp_path)], stamps, files)
+        assert len(files[str(filename)].devices) == 2
+
+        # A broken file keeps its previous content
+        filename.write_text("azureSettings: [")
+        assert not reload([str(tmp_path)], stamps, files)
+        assert len(files[str(filename)].devices) == 2
+
+    def test_watch_stops(self, mocker, tmp_path):
+        self.__mock_init(mocker)
+        filename = tmp_path / "azure.yaml"
+        filename.write_text(yaml.safe_dump(self.__azure_content(range(0, 2))))
+        mocker.patch.object(self.mock_service.sdp, "generate_token")
+        mocker.patch.object(
+            self.mock_service.sdp, "get_sim", side_effect=lambda imsi: {"imsi": imsi}
+        )
+        mocker.patch.object(self.mock_service.sdp, "update_sim")
+        mocker.patch.object(AzureSetting, "add")
+        stop = threading.Event()
+        stop.set()
+
+        summary = self.mock_service.watch(str(filename), interval=0, stop=stop)
+
+        assert summary.succeeded == 4
+
+    def test_validation_blocks_run(self, mocker, tmp_path):
+        self.__mock_init(mocker, validate=True)
+        filename = tmp_path / "azure.yaml"
+        filename.write_text(
+            yaml.safe_dump(
+                {"azureSettings": {"devices": [{"imsi": "001", "deviceId": "d1"}]}}
+            )
+        )
+        generate_token = mocker.patch.object(self.mock_service.sdp, "generate_token")
+
+        with pytest.raises(Exception) as error_response:
+            self.mock_service.apply(str(filename))
+
+        assert str(error_response.value).splitlines() == [
+            "2 errors in the input files:",
+            f"{filename}:2: connectionString is required",
+            f"{filename}:3: Option type is required",
+        ]
+        generate_token.assert_not_called()
+
+    def test_parse_workers_validate_files(self, mocker, tmp_path):
+        self.__mock_init(mocker, validate=True, parse_workers=2)
+        valid = tmp_path / "valid.yaml"
+        valid.write_text(yaml.safe_dump(self.__azure_content(range(0, 2))))
+        invalid = tmp_path / "invalid.yaml"
+        invalid.write_text(
+            yaml.safe_dump(
+                {"azureSettings": {"devices": [{"imsi": "001", "deviceId": "d1"}]}}
+            )
+        )
+        # Nothing is validated in this process
+        mocker.patch("services.main_service.Validator", side_effect=AssertionError)
+        generate_token = mocker.patch.object(self.mock_service.sdp, "generate_token")
+
+        with pytest.raises(Exception) as error_response:
+            self.mock_service.apply(str(valid), str(invalid))
+
+        assert str(error_response.value).splitlines() == [
+            "2 errors in the input files:",
+            f"{invalid}:2: connectionString is required",
+            f"{invalid}:3: Option type is required",
+        ]
+        generate_token.assert_not_called()
+
+    def test_close_shuts_down_scheduler(self, mocker):
+        self.__mock_init(mocker)
+        shutdown = mocker.spy(self.mock_service.scheduler, "shutdown")
+
+        with self.mock_service:
+            pass
+
+        shutdown.assert_called_once()
+
     # Common
 
-    def __mock_init(self, mocker):
+    def __mock_init(self, mocker, **kwargs):
         """
         Initialization of CacheService with mocks
         """
-        # mock constructor
-        self.mock_service = MainService()
+        # mock constructor, the contents of the mocked files are not validated
+        kwargs.setdefault("validate", False)
+        # parse in this process, so that mocked files are used
+        kwargs.setdefault("parse_workers", 1)
+        self.mock_service = MainService(**kwargs)
+
+    def __azure_content(self, imsis):
+        return {
+            "azureSettings": {
+                "connectionString": CONNECTION_STRING,
+                "options": [{"name": "type", "value": "CA"}],
+                "devices": [
+                    {"imsi": f"{i:03d}", "deviceId": f"azure{i:03d}"} for i in imsis
+                ],
+            }
+        }
+
+    def __gcp_content(self, imsis):
+        return {
+            "gcpSettings": {
+                "projectId": "project",
+                "region": "region",
+                "registryId": "registry",
+                "devices": [
+                    {"imsi": f"{i:03d}", "deviceId": f"gcp{i:03d}"} for i in imsis
+                ],
+            }
+        }
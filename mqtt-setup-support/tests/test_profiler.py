@@ -0,0 +1,67 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import logging
+import pstats
+import pytest
+
+from libs.Profiler import Profiler, phase, set_profiler
+from libs.Scheduler import Scheduler
+
+
+def profiled_work():
+    with phase("network"):
+        sum(range(1000))
+
+
+class TestProfiler:
+    @pytest.fixture(autouse=True)
+    def _setup(self, tmp_path):
+        """
+        Common setup
+        """
+        self.prefix = str(tmp_path / "run")
+        self.profiler = Profiler(self.prefix, top=10)
+        set_profiler(self.profiler)
+        yield
+        set_profiler(None)
+
+    def test_profiles_scheduler_threads(self):
+        self.profiler.start()
+        scheduler = Scheduler()
+
+        with scheduler.group() as group:
+            for _ in range(3):
+                group.submit("sdp:tenant", profiled_work)
+        scheduler.shutdown()
+        self.profiler.close()
+
+        stats = pstats.Stats(f"{self.prefix}.pstats")
+        assert any(func[2] == "profiled_work" for func in stats.stats)
+
+        with open(f"{self.prefix}.txt") as f:
+            lines = [line.split() for line in f if line.startswith("network")]
+        assert lines[0][2] == "3"
+
+    def test_counts_logging_phase(self):
+        self.profiler.start()
+        logger = logging.getLogger("test_profiler")
+        handler = logging.NullHandler()
+        logger.addHandler(handler)
+        self.profiler.wrap_handler(handler)
+
+        logger.warning("message")
+        logger.removeHandler(handler)
+        self.profiler.close()
+
+        with open(f"{self.prefix}.txt") as f:
+            lines = [line.split() for line in f if line.startswith("logging")]
+        assert lines[0][2] == "1"
+
+    def test_phase_does_nothing_when_disabled(self):
+        set_profiler(None)
+
+        with phase("network"):
+            pass
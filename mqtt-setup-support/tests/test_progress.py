@@ -0,0 +1,43 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import io
+
+from libs.Progress import Progress
+
+
+class TestProgress:
+    def test_line_has_counts_rate_latency_and_eta(self):
+        progress = Progress(total=10, stream=io.StringIO())
+
+        for latency in [0.1, 0.2, 0.3, 0.4]:
+            progress.add("succeeded", latency)
+        progress.add("failed", 0.5)
+        progress.add("skipped")
+
+        parts = progress.get_line().split(" | ")
+        assert parts[0] == "6/10"
+        assert parts[1] == "4 succeeded, 1 failed, 1 skipped"
+        assert parts[2].endswith("items/s")
+        assert parts[3] == "p50 300ms p95 500ms"
+        assert parts[4].startswith("ETA ")
+
+    def test_line_without_total(self):
+        progress = Progress(stream=io.StringIO())
+
+        progress.add("succeeded")
+
+        assert progress.get_line().startswith("1 | 1 succeeded")
+        assert "ETA" not in progress.get_line()
+
+    def test_stop_writes_final_line(self):
+        stream = io.StringIO()
+        progress = Progress(total=1, stream=stream)
+        progress.start()
+
+        progress.add("succeeded", 0.1)
+        progress.stop()
+
+        assert stream.getvalue().splitlines()[-1].startswith("1/1 | 1 succeeded")
@@ -0,0 +1,182 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import asyncio
+import pytest
+from datetime import datetime
+
+from libs.Recording import CallRecorder, CallReplayer, get_call_key
+from libs.SDP import SDP
+from models.Authentications import AzureAuthentication
+
+
+class TestRecording:
+    @pytest.fixture(autouse=True)
+    def _setup(self, tmp_path):
+        """
+        Common setup
+        """
+        self.filename = str(tmp_path / "calls.jsonl")
+
+    def __record_sdp(self, mocker):
+        sdp = SDP(endpoint="sdp")
+        request = mocker.patch.object(sdp._session, "request")
+        request.return_value.status_code = 200
+        request.return_value.text = '{"imsi": "001"}'
+        request.return_value.headers = {
+            "Content-Type": "application/json",
+            "X-Subject-Token": "secret-token",
+        }
+        recorder = CallRecorder(self.filename)
+        sdp.transport = recorder.wrap_transport(sdp.transport)
+        sdp.generate_token("key", "secret", "tenant")
+        assert sdp.get_sim("001") == {"imsi": "001"}
+        recorder.close()
+
+    def test_replays_sdp_calls(self, mocker):
+        self.__record_sdp(mocker)
+        with open(self.filename) as f:
+            recording = f.read()
+        assert "secret" not in recording
+
+        sdp = SDP(endpoint="sdp")
+        request = mocker.patch.object(sdp._session, "request")
+        sdp.transport = CallReplayer(self.filename, latency_scale=0).wrap_transport(
+            sdp.transport
+        )
+        # The password is not part of the key
+        sdp.generate_token("key", "other", "tenant")
+
+        assert sdp.get_sim("001") == {"imsi": "001"}
+        request.assert_not_called()
+
+    def test_replay_fails_on_call_not_recorded(self, mocker):
+        self.__record_sdp(mocker)
+
+        sdp = SDP(endpoint="sdp")
+        sdp.transport = CallReplayer(self.filename, latency_scale=0).wrap_transport(
+            sdp.transport
+        )
+        sdp.generate_token("key", "secret", "tenant")
+
+        with pytest.raises(Exception, match="No recorded sdp call"):
+            sdp.get_sim("002")
+
+    def test_replays_authentication_created_in_another_minute(self, mocker):
+        now = mocker.patch("models.Authentications.datetime")
+        auth = AzureAuthentication(name="auth1", sharedAccessKey="key", deviceId="d1")
+        sdp = SDP(endpoint="sdp")
+        request = mocker.patch.object(sdp._session, "request")
+        request.return_value.status_code = 200
+        request.return_value.text = '{"name": "auth1_202201011000"}'
+        request.return_value.headers = {"X-Subject-Token": "token"}
+        recorder = CallRecorder(self.filename)
+        sdp.transport = recorder.wrap_transport(sdp.transport)
+        sdp.generate_token("key", "secret", "tenant")
+        now.now.return_value = datetime(2022, 1, 1, 10, 0)
+        sdp.create_authentication(auth.to_create_request())
+        recorder.close()
+
+        sdp = SDP(endpoint="sdp")
+        request = mocker.patch.object(sdp._session, "request")
+        sdp.transport = CallReplayer(self.filename, latency_scale=0).wrap_transport(
+            sdp.transport
+        )
+        sdp.generate_token("key", "secret", "tenant")
+        now.now.return_value = datetime(2022, 1, 1, 10, 1)
+
+        assert sdp.create_authentication(auth.to_create_request()) == {
+            "name": "auth1_202201011000"
+        }
+        request.assert_not_called()
+
+    def test_keys_client_calls_by_target(self, mocker):
+        recorder = CallRecorder(self.filename)
+        for host in ["hub1", "hub2"]:
+            client = mocker.Mock()
+            client.get_device.return_value = host
+            recorder.wrap_client("azure", lambda: client, target=host).get_device("d1")
+        recorder.close()
+
+        replayer = CallReplayer(self.filename, latency_scale=0)
+
+        for host in ["hub2", "hub1"]:
+            replay = replayer.wrap_client("azure", mocker.Mock(), target=host)
+            assert replay.get_device("d1") == host
+
+    def test_replays_client_calls_in_order(self, mocker):
+        client = mocker.Mock()
+        client.get_device.side_effect = ["first", Exception("not found")]
+        recorder = CallRecorder(self.filename)
+        recording = recorder.wrap_client("gcp", lambda: client)
+        assert recording.get_device(name="d1", timeout=1.0) == "first"
+        with pytest.raises(Exception):
+            recording.get_device(name="d1", timeout=1.0)
+        recorder.close()
+
+        create = mocker.Mock()
+        replayer = CallReplayer(self.filename, latency_scale=0)
+        replay = replayer.wrap_client("gcp", create)
+        # The timeout is not part of the key
+        assert replay.get_device(name="d1", timeout=5.0) == "first"
+        with pytest.raises(Exception, match="not found"):
+            replay.get_device(name="d1")
+        create.assert_not_called()
+
+    def test_replays_async_client_calls(self, mocker):
+        client = mocker.Mock()
+        client.create_device = mocker.AsyncMock(return_value="device")
+        recorder = CallRecorder(self.filename)
+        recording = recorder.wrap_client("gcp", lambda: client, is_async=True)
+        assert asyncio.run(recording.create_device(request="r")) == "device"
+        recorder.close()
+
+        replay = CallReplayer(self.filename, latency_scale=0).wrap_client(
+            "gcp", mocker.Mock(), is_async=True
+        )
+        assert asyncio.run(replay.create_device(request="r")) == "device"
+        assert replay.transport is None
+
+    def test_keys_sdk_models_by_content(self, mocker):
+        query = mocker.Mock(spec=["as_dict"])
+        query.as_dict.return_value = {"query": "SELECT * FROM devices"}
+        other = mocker.Mock(spec=["as_dict"])
+        other.as_dict.return_value = {"query": "SELECT * FROM devices"}
+
+        assert get_call_key("query", query) == get_call_key("query", other)
+
+    def test_records_first_page_of_pager(self, mocker):
+        client = mocker.Mock()
+        client.list_devices.return_value = mocker.Mock(
+            pages=iter([]), _response={"devices": ["d1"], "next_page_token": "t"}
+        )
+        recorder = CallRecorder(self.filename)
+        recorder.wrap_client("gcp", lambda: client).list_devices(request="r")
+        recorder.close()
+
+        replay = CallReplayer(self.filename, latency_scale=0).wrap_client(
+            "gcp", mocker.Mock()
+        )
+
+        assert replay.list_devices(request="r") == {
+            "devices": ["d1"],
+            "next_page_token": "t",
+        }
+
+    def test_scales_recorded_latency(self, mocker):
+        client = mocker.Mock()
+        client.get_device.return_value = "device"
+        mocker.patch("libs.Recording.time.perf_counter", side_effect=[1.0, 1.2])
+        recorder = CallRecorder(self.filename)
+        recorder.wrap_client("azure", lambda: client).get_device("d1")
+        recorder.close()
+        sleep = mocker.patch("libs.Recording.time.sleep")
+
+        replay = CallReplayer(self.filename, latency_scale=0.5).wrap_client(
+            "azure", mocker.Mock()
+        )
+
+        assert replay.get_device("d1") == "device"
+        assert sleep.call_args.args[0] == pytest.approx(0.1)
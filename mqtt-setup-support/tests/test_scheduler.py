@@ -0,0 +1,208 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import asyncio
+import threading
+import time
+import pytest
+
+from libs.CircuitBreaker import BreakerPolicy
+from libs.Scheduler import BackendLimit, Scheduler, parse_limits
+
+
+class TestScheduler:
+    @pytest.mark.parametrize(
+        "value, target, concurrency, rate",
+        [
+            ("sdp=4", "sdp", 4, None),
+            ("azure=16:50", "azure", 16, 50.0),
+            (
+                "gcp:project/region/registry=2:0.5",
+                "gcp:project/region/registry",
+                2,
+                0.5,
+            ),
+        ],
+    )
+    def test_parse_limit(self, value, target, concurrency, rate):
+        res_target, res = BackendLimit.parse(value)
+        assert res_target == target
+        assert res.concurrency == concurrency
+        assert res.rate == rate
+
+    @pytest.mark.parametrize("value", ["sdp", "sdp=0", "sdp=a", "sdp=1:-1"])
+    def test_parse_invalid_limit(self, value):
+        with pytest.raises(Exception):
+            BackendLimit.parse(value)
+
+    def test_get_limit(self):
+        scheduler = Scheduler(limits=parse_limits(["azure=16", "azure:hub=2"]))
+
+        assert scheduler.get_limit("azure:hub").concurrency == 2
+        assert scheduler.get_limit("azure:other").concurrency == 16
+        assert scheduler.get_limit("gcp:project/region/registry").concurrency == 8
+
+    def test_group_waits_for_nested_tasks(self):
+        scheduler = Scheduler()
+        done = []
+
+        with scheduler.group() as group:
+
+            def first():
+                group.submit("sdp:tenant", done.append, "second")
+                done.append("first")
+
+            group.submit("azure:hub", first)
+
+        assert sorted(done) == ["first", "second"]
+        scheduler.shutdown()
+
+    def test_async_lane_limits_concurrency(self):
+        scheduler = Scheduler(limits=parse_limits(["gcp=2"]))
+        running = []
+        peak = []
+
+        async def work():
+            running.append(1)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.pop()
+
+        with scheduler.group() as group:
+            for _ in range(10):
+                group.submit("gcp:project/region/registry", work)
+
+        assert len(peak) == 10
+        assert max(peak) == 2
+        scheduler.shutdown()
+
+    def test_group_raises_task_error(self):
+        scheduler = Scheduler()
+        done = []
+
+        def fail():
+            raise Exception("broken")
+
+        with pytest.raises(Exception) as error_response:
+            with scheduler.group() as group:
+                group.submit("sdp:tenant", fail)
+                group.submit("sdp:tenant", done.append, "other")
+
+        assert str(error_response.value) == "broken"
+        assert done == ["other"]
+        scheduler.shutdown()
+
+    def test_group_raises_async_task_error(self):
+        scheduler = Scheduler()
+
+        async def fail():
+            raise Exception("broken")
+
+        with pytest.raises(Exception) as error_response:
+            with scheduler.group() as group:
+                group.submit("gcp:project/region/registry", fail)
+
+        assert str(error_response.value) == "broken"
+        scheduler.shutdown()
+
+    def test_shutdown_hooks_run_on_event_loop(self):
+        scheduler = Scheduler()
+        loops = []
+
+        async def work():
+            loops.append(asyncio.get_running_loop())
+
+        async def hook():
+            loops.append(asyncio.get_running_loop())
+
+        scheduler.add_shutdown_hook(hook)
+        with scheduler.group() as group:
+            group.submit("gcp:project/region/registry", work)
+        scheduler.shutdown()
+
+        assert len(loops) == 2
+        assert loops[0] is loops[1]
+        assert loops[0].is_closed()
+
+    def test_group_bounds_pending_tasks(self):
+        scheduler = Scheduler(limits={"sdp": BackendLimit(concurrency=8)})
+        lock = threading.Lock()
+        running = [0]
+        peak = [0]
+
+        def work():
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+
+        with scheduler.group(max_pending=2) as group:
+            for _ in range(10):
+                group.submit("sdp:tenant", work)
+        scheduler.shutdown()
+
+        assert peak[0] <= 2
+
+    def test_breaker_defers_failing_target(self):
+        scheduler = Scheduler(
+            breaker=BreakerPolicy(failures=2, cooldown=0.2, max_cooldown=0.2)
+        )
+        calls = []
+        failing = [True]
+
+        def work(target):
+            try:
+                with scheduler.guard(target):
+                    calls.append(target)
+                    if target == "azure:bad" and failing[0]:
+                        raise ConnectionError("Unavailable")
+            except Exception:
+                return False
+            return True
+
+        with scheduler.group(max_pending=2) as group:
+            for _ in range(2):
+                group.submit("azure:bad", work, "azure:bad").result()
+            assert scheduler.get_breaker("azure:bad").state == "open"
+
+            # Deferred tasks do not hold the pending slots of the group
+            deferred = [group.submit("azure:bad", work, "azure:bad") for _ in range(5)]
+            for _ in range(5):
+                assert group.submit("azure:ok", work, "azure:ok").result()
+            assert calls.count("azure:bad") == 2
+
+            failing[0] = False
+
+        assert all(f.result() for f in deferred)
+        assert calls.count("azure:bad") == 7
+        assert scheduler.get_breaker("azure:bad").state == "closed"
+        scheduler.shutdown()
+
+    def test_breaker_fails_fast_when_target_is_down(self):
+        scheduler = Scheduler(
+            breaker=BreakerPolicy(
+                failures=1, cooldown=0.01, max_cooldown=0.01, max_probes=1
+            )
+        )
+        calls = []
+
+        def work():
+            with scheduler.guard("gcp:registry"):
+                calls.append(1)
+                raise ConnectionError("Unavailable")
+
+        futures = [scheduler.submit("gcp:registry", work)]
+        futures[0].exception()
+        futures += [scheduler.submit("gcp:registry", work) for _ in range(3)]
+        for future in futures:
+            future.exception()
+
+        # The first call opens the circuit, the second one is the failed probe
+        assert len(calls) == 2
+        assert scheduler.get_breaker("gcp:registry").state == "down"
+        assert "probes failed" in str(futures[-1].exception())
+        scheduler.shutdown()
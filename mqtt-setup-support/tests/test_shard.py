@@ -0,0 +1,24 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import pytest
+
+from libs.Shard import Shard
+
+
+class TestShard:
+    def test_shards_are_disjoint_and_complete(self):
+        keys = [f"4401012345{i:05d}" for i in range(1000)]
+        shards = [Shard(index=i, count=4) for i in range(4)]
+
+        owners = [[s.index for s in shards if s.contains(key)] for key in keys]
+
+        assert all(len(o) == 1 for o in owners)
+        assert {o[0] for o in owners} == {0, 1, 2, 3}
+
+    @pytest.mark.parametrize("value", ["4/4", "-1/4", "1", "a/b", "0/0"])
+    def test_parse_invalid_shard(self, value):
+        with pytest.raises(Exception):
+            Shard.parse(value)
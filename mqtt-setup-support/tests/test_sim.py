@@ -0,0 +1,51 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import json
+import pytest
+
+from models.SIM import SIM
+
+
+class TestSIM:
+    @pytest.fixture(autouse=True)
+    def _setup(self):
+        """
+        Common setup
+        """
+        self.sim = SIM(
+            imsi="001",
+            imei="123",
+            deviceName="device",
+            azureDeviceId="azure001",
+            gcpDeviceId=None,
+        )
+
+    def test_update_request_has_only_changed_fields(self):
+        req = self.sim.get_update_request(
+            azureDeviceId="azure001", gcpDeviceId="gcp001"
+        )
+
+        assert json.loads(req.toJSON()) == {"gcpDeviceId": "gcp001"}
+
+    def test_update_request_clears_empty_fields(self):
+        req = self.sim.get_update_request(azureDeviceId="")
+
+        assert json.loads(req.toJSON()) == {"azureDeviceId": None}
+
+    @pytest.mark.parametrize(
+        "fields",
+        [
+            {"azureDeviceId": "azure001"},
+            {"azureDeviceId": None, "gcpDeviceId": None},
+            {"gcpDeviceId": ""},
+        ],
+    )
+    def test_update_request_is_none_without_changes(self, fields):
+        assert self.sim.get_update_request(**fields) is None
+
+    def test_update_request_rejects_unknown_field(self):
+        with pytest.raises(Exception):
+            self.sim.get_update_request(imsi="002")
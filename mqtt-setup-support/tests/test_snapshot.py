@@ -0,0 +1,53 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import pytest
+
+from libs.Snapshot import Snapshot
+
+
+class TestSnapshot:
+    @pytest.fixture(autouse=True)
+    def _setup(self, tmp_path):
+        """
+        Common setup
+        """
+        self.filename = str(tmp_path / "snapshot.db")
+
+    def test_refresh_only_writes_changes(self):
+        with Snapshot(self.filename) as snapshot:
+            counts = snapshot.refresh_sims(
+                [
+                    {"imsi": "001", "groupId": "g1"},
+                    {"imsi": "002", "groupId": "g1"},
+                    {"imsi": "003", "groupId": "g2"},
+                ]
+            )
+            assert counts == {"added": 3, "changed": 0, "removed": 0, "unchanged": 0}
+
+        with Snapshot(self.filename) as snapshot:
+            counts = snapshot.refresh_sims(
+                [
+                    {"imsi": "001", "groupId": "g1"},
+                    {"imsi": "002", "groupId": "g1", "gcpDeviceId": "device2"},
+                    {"imsi": "004", "groupId": "g2"},
+                ]
+            )
+            assert counts == {"added": 1, "changed": 1, "removed": 1, "unchanged": 1}
+
+            assert snapshot.get_sim("002")["gcpDeviceId"] == "device2"
+            assert snapshot.get_sim("003") is None
+            assert [s["imsi"] for s in snapshot.get_sims_in_group("g1")] == [
+                "001",
+                "002",
+            ]
+            assert snapshot.get_refreshed_at() is not None
+
+    def test_refresh_groups(self):
+        with Snapshot(self.filename) as snapshot:
+            snapshot.refresh_groups([{"groupId": "g1", "name": "group 1"}])
+            counts = snapshot.refresh_groups([{"groupId": "g1", "name": "renamed"}])
+
+        assert counts == {"added": 0, "changed": 1, "removed": 0, "unchanged": 0}
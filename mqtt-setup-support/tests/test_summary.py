@@ -0,0 +1,47 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+from models.Summary import RunSummary
+
+
+class TestRunSummary:
+    def test_add(self):
+        summary = RunSummary(action="update-sims")
+
+        summary.add("sim", "001", "succeeded")
+        summary.add("sim", "002", "failed", "Not Found")
+        summary.add("sim", "003", "skipped")
+
+        assert (summary.succeeded, summary.failed, summary.skipped) == (1, 1, 1)
+        assert summary.failures == [
+            {"kind": "sim", "key": "002", "status": "failed", "error": "Not Found"},
+            {"kind": "sim", "key": "003", "status": "skipped", "error": None},
+        ]
+
+    def test_save_and_load(self, tmp_path):
+        filename = tmp_path / "summary.json"
+        summary = RunSummary(action="add-devices", shards=["1/4"])
+        summary.add("device", "azure:hub/device1", "failed", "Unauthorized")
+        filename.write_text(summary.finish().toJSON())
+
+        res = RunSummary.load(str(filename))
+
+        assert res.toJSON() == summary.toJSON()
+
+    def test_merge(self):
+        first = RunSummary(action="update-sims", shards=["0/2"])
+        first.add("sim", "001", "succeeded")
+        first.add("sim", "002", "failed", "Not Found")
+        second = RunSummary(action="update-sims", shards=["1/2"])
+        second.add("sim", "003", "skipped")
+
+        merged = RunSummary.merge([first.finish(), second.finish()])
+
+        assert merged.action == "update-sims"
+        assert merged.shards == ["0/2", "1/2"]
+        assert (merged.succeeded, merged.failed, merged.skipped) == (1, 1, 1)
+        assert [f["key"] for f in merged.failures] == ["002", "003"]
+        assert merged.startedAt == first.startedAt
+        assert merged.finishedAt == second.finishedAt
@@ -0,0 +1,38 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import pytest
+
+from libs.SDP import SDP
+from libs.Timeouts import Timeouts
+
+
+class TestTimeouts:
+    def test_parse(self):
+        timeouts = Timeouts.parse(["read=2:10", "write=3"])
+
+        assert timeouts.get("read").to_requests() == (2.0, 10.0)
+        assert timeouts.get("write").to_requests() == (3.0, 3.0)
+        assert timeouts.get("auth").to_requests() == (5.0, 30.0)
+        assert timeouts.get("read").total == 12.0
+
+    @pytest.mark.parametrize("value", ["read", "list=1:2", "read=a", "read=0:1"])
+    def test_parse_invalid(self, value):
+        with pytest.raises(Exception):
+            Timeouts.parse([value])
+
+    def test_sdp_uses_timeout_of_operation(self, mocker):
+        sdp = SDP(endpoint="sdp", timeouts=Timeouts.parse(["read=1:2", "write=3:4"]))
+        request = mocker.patch.object(sdp._session, "request")
+        request.return_value.status_code = 200
+        request.return_value.text = "{}"
+
+        sdp.get_sim("001")
+        sdp.update_sim("001", mocker.Mock(toJSON=lambda: "{}"))
+
+        assert [c.kwargs["timeout"] for c in request.call_args_list] == [
+            (1.0, 2.0),
+            (3.0, 4.0),
+        ]
@@ -0,0 +1,64 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import json
+import pytest
+
+from libs.Scheduler import Scheduler
+from libs.Tracer import Tracer, set_tracer, span
+
+
+class TestTracer:
+    @pytest.fixture(autouse=True)
+    def _setup(self, tmp_path):
+        """
+        Common setup
+        """
+        self.filename = str(tmp_path / "trace.jsonl")
+        self.tracer = Tracer(self.filename)
+        set_tracer(self.tracer)
+        yield
+        set_tracer(None)
+
+    def test_spans_are_nested_across_scheduler_threads(self):
+        scheduler = Scheduler()
+
+        def work():
+            with span("sdp.request"):
+                pass
+
+        with span("sim.update", imsi="001"):
+            with scheduler.group() as group:
+                group.submit("sdp:tenant", work)
+        scheduler.shutdown()
+
+        spans = self.__load_spans()
+        assert spans["sdp.request"]["parentSpanId"] == spans["sim.update"]["spanId"]
+        assert spans["sdp.request"]["traceId"] == spans["sim.update"]["traceId"]
+        assert spans["sim.update"]["attributes"] == [
+            {"key": "imsi", "value": {"stringValue": "001"}}
+        ]
+
+    def test_error_status(self):
+        with pytest.raises(Exception):
+            with span("sdp.request"):
+                raise Exception("Not Found")
+
+        spans = self.__load_spans()
+        assert spans["sdp.request"]["status"] == {"code": 2, "message": "Not Found"}
+
+    # Common
+
+    def __load_spans(self):
+        self.tracer.close()
+        with open(self.filename) as f:
+            lines = [json.loads(line) for line in f]
+        return {
+            s["name"]: s
+            for line in lines
+            for resource in line["resourceSpans"]
+            for scope in resource["scopeSpans"]
+            for s in scope["spans"]
+        }
@@ -0,0 +1,116 @@
+## Copyright (c) 2022 NTT Communications Corporation
+##
+## This software is released under the MIT License.
+## see https://github.com/nttcom/icgw-tools/blob/main/LICENSE
+
+import pytest
+
+from libs.Validator import Validator
+
+
+AZURE_YAML = """azureSettings:
+  connectionString: HostName=hub.azure-devices.net
+  options:
+    - name: type
+      value: SAS
+    - name: primary_key
+      value: key
+  devices:
+    - imsi: "001"
+      deviceId: device1
+      options:
+        - name: secondary_key
+          value: key
+    - imsi: "002"
+      deviceId: device2
+    - imsi: "003"
+      deviceId: device3
+      options:
+        - name: type
+          value: token
+  authentications:
+    - name: auth1
+      deviceId: device1
+"""
+
+
+class TestValidator:
+    @pytest.fixture(autouse=True)
+    def _setup(self, tmp_path):
+        """
+        Common setup
+        """
+        self.tmp_path = tmp_path
+
+    def test_reports_all_errors_with_lines(self):
+        filename = self.__write("azure.yaml", AZURE_YAML)
+
+        errors = [str(e) for e in Validator("apply").validate_file(filename)]
+
+        assert errors == [
+            f"{filename}:14: Option secondary_key is required for type SAS",
+            f"{filename}:20: Invalid auth type token, expected one of SAS, X509, CA",
+            f"{filename}:22: sharedAccessKey is required",
+        ]
+
+    def test_only_checks_sections_of_action(self):
+        filename = self.__write("azure.yaml", AZURE_YAML)
+
+        assert Validator("update-sims").validate_file(filename) == []
+
+    def test_gcp_rules(self):
+        public_key = self.__write("public.pem", "KEY")
+        filename = self.__write(
+            "gcp.yaml",
+            f"""gcpSettings:
+  projectId: project
+  region: region
+  devices:
+    - deviceId: device1
+      options:
+        - name: format
+          value: ES256_PEM
+        - name: public_key
+          value: {public_key}
+    - deviceId: device2
+      options:
+        - name: format
+          value: ES256_PEM
+    - deviceId: device3
+      options:
+        - name: format
+          value: RSA
+  authentications:
+    - name: auth1
+      algorithm: HS256
+      privateKey: missing.pem
+      deviceId: device1
+""",
+        )
+
+        errors = [str(e) for e in Validator("apply").validate_file(filename)]
+
+        assert errors == [
+            f"{filename}:2: registryId is required",
+            f"{filename}:5: imsi is required",
+            f"{filename}:11: imsi is required",
+            f"{filename}:11: Option public_key is required for format ES256_PEM",
+            f"{filename}:15: imsi is required",
+            f"{filename}:18: Invalid Public Key Format RSA, expected one of "
+            "ES256_PEM, ES256_X509_PEM, RSA_PEM, RSA_X509_PEM",
+            f"{filename}:21: Invalid algorithm HS256, expected one of ES256, RS256",
+            f"{filename}:22: File missing.pem does not exist",
+        ]
+
+    def test_reports_yaml_syntax_error(self):
+        filename = self.__write("broken.yaml", "azureSettings: [\n")
+
+        errors = Validator("apply").validate_file(filename)
+
+        assert len(errors) == 1
+        assert str(errors[0]).startswith(f"{filename}:2: Invalid yaml")
+
+    def __write(self, name: str, content: str) -> str:
+        path = self.tmp_path / name
+        path.write_text(content)
+        return str(path)